@@ -0,0 +1,130 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Encoder preset benchmark: encode time against output size for each output
+format and encoder preset
+
+    python benchmarks/bench_encode.py                       # synthetic 12 MP photo and graphic
+    python benchmarks/bench_encode.py --inputs samples/ --limit 20 -o encode.json
+    python benchmarks/bench_encode.py --formats PNG --sizes 24 50
+
+Every input is decoded and watermarked once; only encoding is timed, in
+memory, so disk speed does not enter the numbers. Times and sizes are
+summed over the inputs, and each preset is compared with the format's
+default preset.
+"""
+
+import os
+import sys
+import io
+import json
+import time
+import argparse
+import statistics
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from bench_utils import image_dimensions, megabytes
+
+
+def synthetic_inputs(sizes):
+    """(name, image) pairs: a noisy photo-like gradient and a flat graphic per size"""
+    from PIL import Image, ImageDraw, ImageFilter
+
+    for megapixels in sizes:
+        width, height = image_dimensions(megapixels)
+        photo = Image.merge('RGB', [
+            Image.linear_gradient('L').resize((width, height)),
+            Image.radial_gradient('L').resize((width, height)),
+            Image.effect_noise((width, height), 40).filter(ImageFilter.GaussianBlur(1)),
+        ])
+        yield f"photo_{megapixels:g}mp", photo
+
+        graphic = Image.new('RGB', (width, height), (245, 245, 240))
+        draw = ImageDraw.Draw(graphic)
+        step = max(width // 24, 1)
+        for i, x in enumerate(range(0, width, step)):
+            draw.rectangle((x, height // 4, x + step // 2, height * 3 // 4), fill=(40 * (i % 6), 90, 160))
+        yield f"graphic_{megapixels:g}mp", graphic
+
+
+def file_inputs(paths, limit):
+    """(name, image) pairs for sample images, decoded up front"""
+    from PIL import Image
+    import watermark_engine as engine
+
+    for path in engine.find_images(paths)[:limit]:
+        with Image.open(path) as img:
+            img.load()
+            yield os.path.basename(path), img
+
+
+def time_encode(image, spec, repeat):
+    """Median encode seconds and output bytes of a prepared image"""
+    import watermark_engine as engine
+
+    times = []
+    size = 0
+    for _ in range(repeat):
+        output = io.BytesIO()
+        start = time.perf_counter()
+        engine.encode_image(image, output, spec)
+        times.append(time.perf_counter() - start)
+        size = output.tell()
+    return statistics.median(times), size
+
+
+def main():
+    import watermark_engine as engine
+
+    formats = [name for name in ("PNG", "JPEG", "WEBP", "AVIF") if name in engine.OUTPUT_EXTENSIONS]
+    parser = argparse.ArgumentParser(description="Encode time vs output size per format and encoder preset")
+    parser.add_argument('--inputs', nargs='+', help="sample images or folders (default: synthetic images)")
+    parser.add_argument('--limit', type=int, default=10, help="sample images to use at most")
+    parser.add_argument('--sizes', type=float, nargs='+', default=[12], help="synthetic image megapixels")
+    parser.add_argument('--formats', nargs='+', choices=formats, default=formats)
+    parser.add_argument('--quality', type=int, default=85, help="JPEG, WebP and AVIF quality")
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('-o', '--output', help="write results to a JSON file")
+    args = parser.parse_args()
+
+    inputs = file_inputs(args.inputs, args.limit) if args.inputs else synthetic_inputs(args.sizes)
+    base_spec = engine.WatermarkSpec(watermark_opacity=60, jpeg_quality=args.quality)
+    totals = {}
+    names = []
+    for name, image in inputs:
+        names.append(name)
+        watermarked = engine.apply_watermark(image, base_spec)
+        for output_format in args.formats:
+            spec = engine.WatermarkSpec(output_format=output_format, jpeg_quality=args.quality)
+            prepared = engine.prepare_for_save(watermarked, spec)
+            for preset in engine.ENCODER_PRESET_NAMES:
+                seconds, size = time_encode(prepared, engine.WatermarkSpec(
+                    output_format=output_format, jpeg_quality=args.quality, encoder_preset=preset), args.repeat)
+                total = totals.setdefault((output_format, preset), {'seconds': 0.0, 'bytes': 0})
+                total['seconds'] += seconds
+                total['bytes'] += size
+    if not names:
+        print("No images found", file=sys.stderr)
+        return 1
+
+    print(f"{len(names)} inputs, quality {args.quality}")
+    print(f"{'format':>6} {'preset':>8} {'encode ms':>10} {'output MB':>10} {'time':>7} {'size':>7}")
+    results = []
+    for (output_format, preset), total in totals.items():
+        default = totals[(output_format, "default")]
+        time_ratio = total['seconds'] / default['seconds'] if default['seconds'] else 0.0
+        size_ratio = total['bytes'] / default['bytes'] if default['bytes'] else 0.0
+        print(f"{output_format:>6} {preset:>8} {total['seconds'] * 1000:>10.1f} {megabytes(total['bytes']):>10} "
+              f"{time_ratio:>6.2f}x {size_ratio:>6.2f}x")
+        results.append({'format': output_format, 'preset': preset, 'seconds': total['seconds'],
+                        'bytes': total['bytes'], 'time_vs_default': time_ratio, 'size_vs_default': size_ratio})
+
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump({'inputs': names, 'quality': args.quality, 'results': results}, f, indent=2)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
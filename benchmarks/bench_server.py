@@ -0,0 +1,183 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Load test for the HTTP watermarking service
+
+Starts a local watermark_server (or targets a running one with --url),
+sends the same synthetic image from several keep-alive connections for a
+fixed time and reports requests per second and latency percentiles:
+
+    python benchmarks/bench_server.py --workers 4 --concurrency 8 --duration 20
+    python benchmarks/bench_server.py --url http://127.0.0.1:8080 --megapixels 12
+"""
+
+import io
+import os
+import sys
+import json
+import time
+import socket
+import argparse
+import threading
+import subprocess
+import http.client
+from urllib.parse import urlsplit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from bench_utils import image_dimensions
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def make_payload(megapixels):
+    """A JPEG of the given size, encoded in memory"""
+    from PIL import Image
+    width, height = image_dimensions(megapixels)
+    output = io.BytesIO()
+    Image.radial_gradient('L').resize((width, height)).convert('RGB').save(output, 'JPEG', quality=90)
+    return output.getvalue()
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def start_server(workers, max_concurrency):
+    """Start watermark_server in a child process and wait until it answers"""
+    port = free_port()
+    command = [sys.executable, '-m', 'watermark_server', '--port', str(port)]
+    if workers:
+        command += ['-j', str(workers)]
+    if max_concurrency:
+        command += ['--max-concurrency', str(max_concurrency)]
+    process = subprocess.Popen(command, cwd=ROOT)
+    deadline = time.monotonic() + 60
+    while time.monotonic() < deadline:
+        try:
+            conn = http.client.HTTPConnection('127.0.0.1', port, timeout=1)
+            conn.request('GET', '/health')
+            if conn.getresponse().status == 200:
+                conn.close()
+                return process, port
+        except OSError:
+            time.sleep(0.2)
+    process.kill()
+    raise RuntimeError("server did not start")
+
+
+def client(host, port, path, payload, headers, stop_at, latencies, statuses, lock):
+    """Send requests on one keep-alive connection until stop_at"""
+    conn = http.client.HTTPConnection(host, port, timeout=60)
+    local_latencies, local_statuses = [], {}
+    while time.monotonic() < stop_at:
+        started = time.perf_counter()
+        try:
+            conn.request('POST', path, payload, headers)
+            response = conn.getresponse()
+            response.read()
+            status = response.status
+            if response.getheader('Connection', '').lower() == 'close':
+                conn.close()
+        except OSError as e:
+            status = type(e).__name__
+            conn.close()
+        elapsed = time.perf_counter() - started
+        local_statuses[status] = local_statuses.get(status, 0) + 1
+        if status == 200:
+            local_latencies.append(elapsed)
+    conn.close()
+    with lock:
+        latencies.extend(local_latencies)
+        for status, count in local_statuses.items():
+            statuses[status] = statuses.get(status, 0) + count
+
+
+def percentile(sorted_values, fraction):
+    if not sorted_values:
+        return None
+    return sorted_values[min(len(sorted_values) - 1, int(len(sorted_values) * fraction))]
+
+
+def run_load(host, port, path, payload, headers, concurrency, duration):
+    """Run the load and return a result dict"""
+    latencies, statuses, lock = [], {}, threading.Lock()
+    stop_at = time.monotonic() + duration
+    started = time.perf_counter()
+    threads = [threading.Thread(target=client, args=(host, port, path, payload, headers, stop_at,
+                                                      latencies, statuses, lock))
+               for _ in range(concurrency)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - started
+
+    latencies.sort()
+    ms = lambda value: round(value * 1000, 1) if value is not None else None
+    return {
+        'concurrency': concurrency,
+        'seconds': round(elapsed, 2),
+        'requests': sum(statuses.values()),
+        'ok': len(latencies),
+        'statuses': {str(status): count for status, count in sorted(statuses.items(), key=str)},
+        'rps': round(len(latencies) / elapsed, 1),
+        'p50_ms': ms(percentile(latencies, 0.50)),
+        'p99_ms': ms(percentile(latencies, 0.99)),
+        'max_ms': ms(latencies[-1] if latencies else None),
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Load test the watermark HTTP service")
+    parser.add_argument('--url', help="running server, e.g. http://127.0.0.1:8080 (default: start one)")
+    parser.add_argument('--workers', type=int, help="render processes of the started server")
+    parser.add_argument('--max-concurrency', type=int, help="concurrency cap of the started server")
+    parser.add_argument('--concurrency', type=int, nargs='+', default=[1, 4, 8],
+                        help="client connections; several values run one after another")
+    parser.add_argument('--duration', type=float, default=10.0, help="seconds per run")
+    parser.add_argument('--megapixels', type=float, default=2.0)
+    parser.add_argument('--template', help="template name to request")
+    parser.add_argument('--spec', help="X-Watermark-Spec JSON sent with each request")
+    parser.add_argument('-o', '--output', help="write results to this JSON file")
+    args = parser.parse_args(argv)
+
+    payload = make_payload(args.megapixels)
+    path = '/watermark' + (f'?template={args.template}' if args.template else '')
+    headers = {'Content-Type': 'image/jpeg'}
+    if args.spec:
+        headers['X-Watermark-Spec'] = args.spec
+
+    process = None
+    if args.url:
+        url = urlsplit(args.url)
+        host, port = url.hostname, url.port or 80
+    else:
+        process, port = start_server(args.workers, args.max_concurrency)
+        host = '127.0.0.1'
+
+    results = []
+    try:
+        print(f"{'connections':>11} {'requests':>9} {'rps':>8} {'p50 ms':>8} {'p99 ms':>8}  statuses")
+        for concurrency in args.concurrency:
+            result = run_load(host, port, path, payload, headers, concurrency, args.duration)
+            results.append(result)
+            print(f"{concurrency:>11} {result['requests']:>9} {result['rps']:>8.1f} "
+                  f"{result['p50_ms'] or 0:>8.1f} {result['p99_ms'] or 0:>8.1f}  {result['statuses']}")
+    finally:
+        if process:
+            process.terminate()
+            process.wait()
+
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump({'meta': {'megapixels': args.megapixels, 'payload_bytes': len(payload),
+                                'workers': args.workers, 'url': args.url}, 'results': results}, f, indent=2)
+        print(f"Results written to {args.output}")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,230 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Rendering and export benchmark suite
+
+Generates synthetic inputs offline, times each hot path separately and
+records peak memory, then writes the results to JSON:
+
+    python benchmarks/bench_suite.py -o bench.json
+    python benchmarks/bench_suite.py --sizes 1 12 24 50 100 -o bench.json
+    python benchmarks/bench_suite.py --baseline baseline.json --threshold 0.15
+
+Stages:
+    text            apply_text_watermark on a decoded image
+    image           apply_image_watermark on a decoded image
+    tile            text repeated over the whole frame (tile position)
+    preview_load    decode of the display-sized preview proxy (cold)
+    preview         preview refresh on the cached proxy
+    export          decode, watermark, encode and write one file
+
+Every (stage, size, mode) case runs in a fresh process so its peak memory
+can be read from the process high-water mark (Unix only).
+"""
+
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import platform
+import tempfile
+import statistics
+import subprocess
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from bench_utils import current_rss, peak_extra, image_dimensions, megabytes
+
+STAGES = ('text', 'image', 'tile', 'preview_load', 'preview', 'export')
+MODES = ('RGB', 'RGBA', 'P', 'L', 'CMYK')
+DEFAULT_SIZES = (1, 12, 24)
+
+# Differences below these are treated as noise when comparing with a baseline
+TIME_SLACK_SECONDS = 0.002
+MEMORY_SLACK_BYTES = 4 * 1024 * 1024
+
+# Formats the synthetic inputs are stored in, per mode
+INPUT_FORMATS = {'RGB': 'JPEG', 'L': 'JPEG', 'CMYK': 'JPEG', 'RGBA': 'PNG', 'P': 'PNG'}
+
+
+def input_path(work_dir, megapixels, mode):
+    ext = '.jpg' if INPUT_FORMATS[mode] == 'JPEG' else '.png'
+    return os.path.join(work_dir, f"input_{megapixels:g}mp_{mode}{ext}")
+
+
+def logo_path(work_dir):
+    return os.path.join(work_dir, 'logo.png')
+
+
+def generate_inputs(work_dir, sizes, modes):
+    """Create synthetic inputs and a logo, reusing files from earlier runs"""
+    from PIL import Image, ImageDraw
+
+    if not os.path.exists(logo_path(work_dir)):
+        logo = Image.new('RGBA', (600, 300), (0, 0, 0, 0))
+        ImageDraw.Draw(logo).rounded_rectangle((0, 0, 599, 299), radius=60, fill=(255, 255, 255, 220))
+        logo.save(logo_path(work_dir))
+
+    for megapixels in sizes:
+        size = image_dimensions(megapixels)
+        base = None
+        for mode in modes:
+            path = input_path(work_dir, megapixels, mode)
+            if os.path.exists(path):
+                continue
+            if base is None:
+                # Smooth gradients with a little noise, cheap to generate at any size
+                gradient = Image.linear_gradient('L').resize(size)
+                noise = Image.effect_noise((size[0] // 8, size[1] // 8), 40).resize(size)
+                base = Image.merge('RGB', (gradient, gradient.transpose(Image.Transpose.FLIP_LEFT_RIGHT), noise))
+            if mode == 'P':
+                image = base.quantize(256)
+            elif mode == 'RGBA':
+                image = base.convert('RGBA')
+                image.putalpha(Image.linear_gradient('L').rotate(90).resize(size))
+            else:
+                image = base.convert(mode)
+            image.save(path, INPUT_FORMATS[mode], **({'quality': 90} if INPUT_FORMATS[mode] == 'JPEG' else {}))
+            print(f"generated {os.path.basename(path)}", file=sys.stderr)
+
+
+def run_case(work_dir, stage, megapixels, mode, repeat):
+    """Time one stage in this process and return a result dict"""
+    from PIL import Image
+    import watermark_engine as engine
+
+    path = input_path(work_dir, megapixels, mode)
+    spec = engine.WatermarkSpec(watermark_type='image' if stage == 'image' else 'text',
+                                watermark_image_path=logo_path(work_dir), watermark_rotation=15,
+                                watermark_font_size=max(36, image_dimensions(megapixels)[0] // 25),
+                                watermark_position='tile' if stage == 'tile' else 'center')
+    out_dir = tempfile.mkdtemp(prefix='watermark_bench_')
+
+    if stage in ('text', 'image', 'tile'):
+        image = Image.open(path)
+        image.load()
+        engine.apply_watermark(image, spec)  # warm font and sprite caches
+
+        def run():
+            engine.apply_watermark(image, spec)
+    elif stage == 'preview_load':
+        def run():
+            engine.clear_preview_cache()
+            engine.load_preview_proxy(path)
+    elif stage == 'preview':
+        proxy, source_size = engine.load_preview_proxy(path)
+        preview_spec = spec.scaled(proxy.width / source_size[0])
+        engine.apply_watermark(proxy, preview_spec)
+
+        def run():
+            engine.apply_watermark(proxy, preview_spec)
+    elif stage == 'export':
+        engine.apply_watermark(Image.new('RGB', (64, 64)), spec)
+
+        def run():
+            engine.render_file(path, out_dir, spec)
+    else:
+        raise ValueError(f"unknown stage {stage}")
+
+    rss_before = current_rss()
+    timings = []
+    try:
+        for _ in range(repeat):
+            start = time.perf_counter()
+            run()
+            timings.append(time.perf_counter() - start)
+    finally:
+        shutil.rmtree(out_dir, ignore_errors=True)
+
+    return {'stage': stage, 'megapixels': megapixels, 'mode': mode,
+            'seconds': statistics.median(timings), 'min_seconds': min(timings),
+            'peak_extra_bytes': peak_extra(rss_before)}
+
+
+def case_key(result):
+    return f"{result['stage']}/{result['megapixels']:g}MP/{result['mode']}"
+
+
+def compare(results, baseline, threshold):
+    """Return a list of messages for results slower or hungrier than baseline by more than threshold"""
+    previous = {case_key(result): result for result in baseline['results']}
+    regressions = []
+    for result in results:
+        old = previous.get(case_key(result))
+        if not old:
+            continue
+        if result['seconds'] > old['seconds'] * (1 + threshold) + TIME_SLACK_SECONDS:
+            regressions.append(f"{case_key(result)}: time {old['seconds'] * 1000:.1f} ms -> "
+                               f"{result['seconds'] * 1000:.1f} ms")
+        if (result['peak_extra_bytes'] is not None and old.get('peak_extra_bytes')
+                and result['peak_extra_bytes'] > old['peak_extra_bytes'] * (1 + threshold) + MEMORY_SLACK_BYTES):
+            regressions.append(f"{case_key(result)}: memory {megabytes(old['peak_extra_bytes'])} MB -> "
+                               f"{megabytes(result['peak_extra_bytes'])} MB")
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Watermark rendering and export benchmarks")
+    parser.add_argument('--sizes', type=float, nargs='+', default=list(DEFAULT_SIZES), help="megapixels")
+    parser.add_argument('--modes', nargs='+', default=list(MODES), choices=MODES)
+    parser.add_argument('--stages', nargs='+', default=list(STAGES), choices=STAGES)
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--work-dir', default=os.path.join(tempfile.gettempdir(), 'watermark_bench'),
+                        help="where synthetic inputs are kept between runs")
+    parser.add_argument('-o', '--output', default='bench_results.json')
+    parser.add_argument('--baseline', help="results JSON to compare against")
+    parser.add_argument('--threshold', type=float, default=0.2,
+                        help="allowed slowdown/memory growth before a case counts as a regression")
+    parser.add_argument('--case', help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+
+    if args.case:
+        stage, megapixels, mode = args.case.split(',')
+        print(json.dumps(run_case(args.work_dir, stage, float(megapixels), mode, args.repeat)))
+        return 0
+
+    os.makedirs(args.work_dir, exist_ok=True)
+    generate_inputs(args.work_dir, args.sizes, args.modes)
+
+    results = []
+    print(f"{'case':<28} {'median ms':>10} {'peak MB':>8}")
+    for megapixels in args.sizes:
+        for mode in args.modes:
+            for stage in args.stages:
+                case = f"{stage},{megapixels},{mode}"
+                output = subprocess.run([sys.executable, os.path.abspath(__file__), '--case', case,
+                                         '--repeat', str(args.repeat), '--work-dir', args.work_dir],
+                                        check=True, capture_output=True, text=True).stdout
+                result = json.loads(output.strip().splitlines()[-1])
+                results.append(result)
+                print(f"{case_key(result):<28} {result['seconds'] * 1000:>10.1f} "
+                      f"{megabytes(result['peak_extra_bytes']):>8}")
+
+    from PIL import __version__ as pillow_version
+    from watermark_engine import COMPOSITING_BACKEND
+    report = {
+        'meta': {'created': time.strftime('%Y-%m-%dT%H:%M:%S'), 'python': platform.python_version(),
+                 'pillow': pillow_version, 'platform': platform.platform(), 'cpus': os.cpu_count(),
+                 'repeat': args.repeat, 'compositing_backend': COMPOSITING_BACKEND},
+        'results': results,
+    }
+    with open(args.output, 'w', encoding='utf-8') as f:
+        json.dump(report, f, indent=2)
+    print(f"Results written to {args.output}")
+
+    if args.baseline:
+        with open(args.baseline, 'r', encoding='utf-8') as f:
+            baseline = json.load(f)
+        regressions = compare(results, baseline, args.threshold)
+        for message in regressions:
+            print(f"REGRESSION {message}")
+        if regressions:
+            return 1
+        print(f"No regressions beyond {args.threshold:.0%}")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
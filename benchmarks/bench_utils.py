@@ -0,0 +1,46 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Shared helpers for the benchmarks
+"""
+
+import os
+import sys
+
+
+def current_rss():
+    """Current resident set size in bytes, or None if unavailable"""
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError):
+        return None
+
+
+def peak_rss():
+    """Peak resident set size in bytes, or None if unavailable"""
+    try:
+        import resource
+    except ImportError:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak if sys.platform == 'darwin' else peak * 1024
+
+
+def peak_extra(rss_before):
+    """Bytes the process peak grew past rss_before, or None if unavailable"""
+    peak = peak_rss()
+    if peak is None or rss_before is None:
+        return None
+    return max(peak - rss_before, 0)
+
+
+def image_dimensions(megapixels, aspect=(3, 2)):
+    """Width and height of a 3:2 image with the given pixel count"""
+    width = int((megapixels * 1e6 * aspect[0] / aspect[1]) ** 0.5)
+    return width, int(megapixels * 1e6 / width)
+
+
+def megabytes(value):
+    """Format a byte count for tables"""
+    return f"{value / 1e6:.1f}" if value is not None else "n/a"
@@ -0,0 +1,80 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Tests for batch export
+"""
+
+import os
+from PIL import Image
+
+from watermark_engine import WatermarkSpec
+import watermark_batch
+
+
+def test_parallel_export_matches_serial(tmp_path):
+    """Pool and single-worker exports produce identical, ordered outputs"""
+    src = tmp_path / "src"
+    src.mkdir()
+    paths = []
+    for i in range(4):
+        path = src / f"img{i}.png"
+        Image.new('RGB', (80, 60), (i * 40, 0, 0)).save(path)
+        paths.append(str(path))
+    spec = WatermarkSpec(watermark_opacity=100)
+
+    seen = []
+    (tmp_path / "s").mkdir()
+    (tmp_path / "p").mkdir()
+    serial = watermark_batch.export_images(paths, str(tmp_path / "s"), spec, workers=1)
+    parallel = watermark_batch.export_images(paths, str(tmp_path / "p"), spec, workers=2,
+                                             progress=lambda done, total, r: seen.append(done))
+    assert seen == [1, 2, 3, 4]
+    assert [r.image_path for r in parallel] == paths
+    for s, p in zip(serial, parallel):
+        assert s.error is None and p.error is None
+        assert os.path.basename(s.output_path) == os.path.basename(p.output_path)
+        assert Image.open(s.output_path).tobytes() == Image.open(p.output_path).tobytes()
+
+
+def test_export_job_collects_failures_and_logs(tmp_path):
+    """A background export keeps going past failures and reports them together"""
+    paths = []
+    for i in range(3):
+        path = tmp_path / f"img{i}.png"
+        Image.new('RGB', (40, 30)).save(path)
+        paths.append(str(path))
+    broken = tmp_path / "broken.png"
+    broken.write_bytes(b"not an image")
+    paths.insert(1, str(broken))
+    out = tmp_path / "out"
+    out.mkdir()
+
+    job = watermark_batch.ExportJob(paths, str(out), WatermarkSpec(), workers=1).start()
+    assert job.done.wait(30)
+    assert (job.done_count, job.exported_count, job.total) == (4, 3, 4)
+    assert [path for path, error in job.failures] == [str(broken)]
+    assert job.rate() > 0 and job.eta() == 0
+
+    log = tmp_path / "errors.log"
+    job.write_log(str(log))
+    lines = log.read_text(encoding='utf-8').splitlines()
+    assert "3 exported" in lines[0] and "1 failed" in lines[0]
+    assert lines[1].startswith(str(broken) + "\t")
+
+
+def test_export_job_cancel(tmp_path):
+    """A cancelled export stops between images and signals completion"""
+    paths = []
+    for i in range(20):
+        path = tmp_path / f"{i:02}.png"
+        Image.new('L', (20, 20)).save(path)
+        paths.append(str(path))
+    out = tmp_path / "out"
+    out.mkdir()
+    job = watermark_batch.ExportJob(paths, str(out), WatermarkSpec(), workers=1)
+    job.cancel()
+    job.start()
+    assert job.done.wait(30)
+    assert job.cancelled and job.done_count == 1
+    # Renders already in flight may still be written, never the whole batch
+    assert len(os.listdir(out)) < len(paths)
@@ -0,0 +1,235 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Tests for the headless watermark engine and CLI
+"""
+
+import io
+import os
+import sys
+import subprocess
+import pytest
+from PIL import Image, ImageChops, JpegImagePlugin
+
+import watermark_engine
+from watermark_engine import (WatermarkSpec, apply_watermark, calculate_watermark_position, render_file,
+                              render_bytes, prepare_for_save)
+import watermark_cli
+
+
+def test_engine_does_not_import_tkinter():
+    """The engine and CLI must be importable without tkinter"""
+    code = "import sys, watermark_engine, watermark_cli; sys.exit('tkinter' in sys.modules)"
+    result = subprocess.run([sys.executable, "-c", code], cwd=os.path.dirname(os.path.abspath(__file__)))
+    assert result.returncode == 0
+
+
+def test_spec_from_dict_ignores_unknown_keys():
+    """Settings files can carry keys the engine does not know about"""
+    spec = WatermarkSpec.from_dict({'watermark_text': 'Hi', 'unknown': 1})
+    assert spec.watermark_text == 'Hi'
+    assert spec == WatermarkSpec.from_dict(spec.to_dict())
+    assert hash(spec) == hash(WatermarkSpec.from_dict(spec.to_dict()))
+
+
+def test_calculate_watermark_position_presets():
+    """Nine-grid presets and custom position"""
+    spec = WatermarkSpec(watermark_position="bottom_right")
+    assert calculate_watermark_position((800, 600), (100, 50), spec) == (690, 540)
+    spec = WatermarkSpec(watermark_position="custom", watermark_x=5, watermark_y=7)
+    assert calculate_watermark_position((800, 600), (100, 50), spec) == (5, 7)
+
+
+def test_text_watermark_keeps_mode_and_size():
+    """Text watermarking changes pixels but not geometry or mode"""
+    img = Image.new('RGB', (200, 100), 'black')
+    spec = WatermarkSpec(watermark_opacity=100, watermark_rotation=30)
+    out = apply_watermark(img, spec)
+    assert out.mode == 'RGB' and out.size == img.size
+    assert out.getbbox() is not None
+
+
+def test_cli_exports_folder(tmp_path, capsys):
+    """The CLI watermarks every image in a folder"""
+    src = tmp_path / "src"
+    src.mkdir()
+    Image.new('RGB', (64, 48), 'lightblue').save(src / "a.png")
+    Image.new('RGBA', (64, 48), (255, 0, 0, 128)).save(src / "b.png")
+    template = tmp_path / "t.json"
+    template.write_text('{"output_format": "JPEG", "filename_suffix": "_wm"}', encoding='utf-8')
+
+    out = tmp_path / "out"
+    assert watermark_cli.main([str(src), "-o", str(out), "-t", str(template)]) == 0
+    assert sorted(os.listdir(out)) == [".watermark_manifest.json", "a_wm.jpg", "b_wm.jpg"]
+
+    # A second run finds everything up to date; --force renders again
+    assert watermark_cli.main([str(src), "-o", str(out), "-t", str(template)]) == 0
+    assert "2 already up to date" in capsys.readouterr().out
+    assert watermark_cli.main([str(src), "-o", str(out), "-t", str(template), "--force"]) == 0
+    assert "0 already up to date" in capsys.readouterr().out
+
+
+def test_render_file_png(tmp_path):
+    """render_file writes the expected file name"""
+    path = tmp_path / "x.png"
+    Image.new('L', (32, 32), 128).save(path)
+    assert render_file(str(path), str(tmp_path), WatermarkSpec()).endswith("x_watermarked.png")
+
+
+def test_render_bytes_matches_render_file(tmp_path):
+    """render_bytes encodes like render_file, also when there is nothing to draw"""
+    path = tmp_path / "x.jpg"
+    Image.new('RGB', (64, 48), 'red').save(path)
+    for spec in (WatermarkSpec(output_format="PNG"), WatermarkSpec(watermark_type="image", output_format="JPEG")):
+        with open(render_file(str(path), str(tmp_path), spec), 'rb') as f:
+            assert render_bytes(path.read_bytes(), spec) == f.read()
+
+
+def test_image_watermark_sprite_is_cached(tmp_path):
+    """The logo is prepared once per (path, mtime, scale, opacity, rotation)"""
+    logo = tmp_path / "logo.png"
+    Image.new('RGBA', (40, 20), (0, 255, 0, 200)).save(logo)
+    spec = WatermarkSpec(watermark_type="image", watermark_image_path=str(logo),
+                         watermark_scale=50, watermark_rotation=15)
+    watermark_engine.clear_sprite_cache()
+    first = apply_watermark(Image.new('RGB', (100, 100)), spec)
+    second = apply_watermark(Image.new('RGB', (100, 100)), spec)
+    info = watermark_engine.sprite_cache_info()
+    assert (info.hits, info.misses) == (1, 1)
+    assert first.tobytes() == second.tobytes()
+
+    os.utime(logo, (0, 12345))
+    apply_watermark(Image.new('RGB', (100, 100)), spec)
+    assert watermark_engine.sprite_cache_info().misses == 2
+
+
+def test_region_compositing_matches_full_frame(tmp_path):
+    """Blending only the watermark region gives the same pixels as a full-frame blend"""
+    logo = tmp_path / "logo.png"
+    Image.new('RGBA', (60, 30), (0, 0, 255, 180)).save(logo)
+    base = Image.effect_noise((160, 120), 50).convert('RGB')
+    for mode in ('RGB', 'RGBA', 'L', 'LA'):
+        for spec in (WatermarkSpec(watermark_rotation=20, watermark_position="bottom_right"),
+                     WatermarkSpec(watermark_position="custom", watermark_x=-15, watermark_y=100),
+                     WatermarkSpec(watermark_type="image", watermark_image_path=str(logo),
+                                   watermark_position="top_left", watermark_rotation=45)):
+            image = base.convert(mode)
+            region = apply_watermark(image, spec)
+            watermark_engine.REGION_COMPOSITING = False
+            try:
+                full = apply_watermark(image, spec)
+            finally:
+                watermark_engine.REGION_COMPOSITING = True
+            assert region.mode == full.mode == mode
+            assert region.tobytes() == full.tobytes()
+
+
+def test_numpy_backend_matches_pillow(tmp_path):
+    """The NumPy compositing backend stays within 1 per channel of the Pillow backend"""
+    pytest.importorskip("numpy")
+    logo = tmp_path / "logo.png"
+    Image.new('RGBA', (60, 30), (0, 0, 255, 180)).save(logo)
+    base = Image.effect_noise((160, 120), 50).convert('RGB')
+    translucent = base.convert('RGBA')
+    translucent.putalpha(Image.linear_gradient('L').resize(base.size))
+    for image in (base, translucent, base.convert('L'), base.convert('CMYK')):
+        for spec in (WatermarkSpec(watermark_opacity=60),
+                     WatermarkSpec(watermark_rotation=20, watermark_position="bottom_right"),
+                     WatermarkSpec(watermark_type="image", watermark_image_path=str(logo),
+                                   watermark_position="custom", watermark_x=-15, watermark_y=100,
+                                   watermark_opacity=45, watermark_rotation=30)):
+            results = {}
+            for backend in ('pillow', 'numpy'):
+                watermark_engine.COMPOSITING_BACKEND = backend
+                try:
+                    results[backend] = apply_watermark(image, spec)
+                finally:
+                    watermark_engine.COMPOSITING_BACKEND = 'numpy'
+            assert results['numpy'].mode == results['pillow'].mode == image.mode
+            difference = ImageChops.difference(results['numpy'].convert('RGBA'), results['pillow'].convert('RGBA'))
+            assert max(high for low, high in difference.getextrema()) <= 1
+
+
+def test_tile_layout_covers_frame_and_caches_cell(tmp_path):
+    """The tile position repeats one cached pattern cell over the whole image, also across bands"""
+    logo = tmp_path / "logo.png"
+    Image.new('RGBA', (30, 12), (255, 0, 0, 255)).save(logo)
+    base = Image.new('RGB', (400, 300), (0, 0, 0))
+    watermark_engine._prepare_pattern_cell.cache_clear()
+    for spec in (WatermarkSpec(watermark_position="tile", watermark_rotation=-30, watermark_tile_spacing=20),
+                 WatermarkSpec(watermark_type="image", watermark_image_path=str(logo), watermark_opacity=100,
+                               watermark_position="tile", watermark_tile_spacing=10, watermark_tile_stagger=50)):
+        result = apply_watermark(base, spec)
+        # Marks land in every quadrant, not just around one anchor
+        for box in ((0, 0, 200, 150), (200, 0, 400, 150), (0, 150, 200, 300), (200, 150, 400, 300)):
+            assert result.crop(box).getbbox() is not None
+
+        plan = watermark_engine.plan_watermark(base.size, spec)
+        banded = Image.new('RGB', base.size)
+        for top in range(0, base.height, 70):
+            band = base.crop((0, top, base.width, min(top + 70, base.height)))
+            banded.paste(watermark_engine.apply_watermark_band(band, top, plan), (0, top))
+        assert banded.tobytes() == result.tobytes()
+
+    # Image cell: two 40x22 rows, the second shifted half a cell and wrapping around
+    cell = watermark_engine.plan_watermark(base.size, spec)[1].image
+    assert cell.size == (40, 44)
+    assert cell.getpixel((0, 0))[3] == 255 and cell.getpixel((20, 22))[3] == 255
+    assert cell.getpixel((15, 22))[3] == 0 and cell.getpixel((5, 22))[3] == 255
+    assert watermark_engine._prepare_pattern_cell.cache_info().hits >= 2
+
+
+def test_preview_proxy_uses_draft_and_scaled_spec(tmp_path):
+    """Large JPEGs are previewed on a display-sized proxy with a matching watermark"""
+    path = tmp_path / "big.jpg"
+    Image.new('RGB', (4000, 3000), 'gray').save(path, quality=80)
+    proxy, source_size = watermark_engine.load_preview_proxy(str(path))
+    assert source_size == (4000, 3000)
+    assert proxy.size == (800, 600)
+    assert watermark_engine.load_preview_proxy(str(path))[0] is proxy
+
+    scale = proxy.width / source_size[0]
+    spec = WatermarkSpec(watermark_position="custom", watermark_x=2000, watermark_y=1000)
+    assert calculate_watermark_position(proxy.size, (10, 10), spec.scaled(scale)) == (400, 200)
+    spec = WatermarkSpec(watermark_position="top_left")
+    assert calculate_watermark_position(proxy.size, (10, 10), spec.scaled(scale)) == (2, 2)
+
+
+def test_prepare_for_save_converts_unsupported_modes():
+    """Every input mode can be written in both output formats"""
+    for mode in ('RGB', 'RGBA', 'L', 'LA', 'P', 'CMYK', 'I;16'):
+        image = Image.new(mode, (8, 8))
+        for output_format in ("PNG", "JPEG"):
+            prepared = prepare_for_save(image, WatermarkSpec(output_format=output_format))
+            assert prepared.mode in {"PNG": ('1', 'L', 'LA', 'I', 'I;16', 'P', 'RGB', 'RGBA'),
+                                     "JPEG": ('L', 'RGB', 'CMYK')}[output_format]
+    assert prepare_for_save(Image.new('RGBA', (4, 4), (0, 0, 0, 0)),
+                            WatermarkSpec(output_format="JPEG")).getpixel((0, 0)) == (255, 255, 255)
+
+
+def test_encoder_presets_and_modern_formats():
+    """Presets trade encode effort for size; WebP and AVIF (where supported) keep alpha"""
+    image = Image.effect_mandelbrot((320, 240), (-2, -1.2, 1, 1.2), 100).convert('RGB')
+
+    def encoded(**settings):
+        output = io.BytesIO()
+        watermark_engine.encode_image(image, output, WatermarkSpec(**settings))
+        output.seek(0)
+        return output
+
+    sizes = {preset: len(encoded(encoder_preset=preset).getvalue()) for preset in watermark_engine.ENCODER_PRESET_NAMES}
+    assert sizes['fast'] > sizes['default'] >= sizes['small']
+    assert Image.open(encoded(encoder_preset="small", output_format="JPEG")).info.get('progressive')
+    assert JpegImagePlugin.get_sampling(Image.open(encoded(output_format="JPEG", jpeg_subsampling="4:4:4"))) == 0
+
+    formats = ["WEBP"] + (["AVIF"] if watermark_engine.AVIF_SUPPORTED else [])
+    for output_format in formats:
+        spec = WatermarkSpec(output_format=output_format, jpeg_quality=80)
+        prepared = watermark_engine.prepare_for_save(Image.new('LA', (16, 16), (128, 100)), spec)
+        assert prepared.mode == 'RGBA'
+        output = io.BytesIO()
+        watermark_engine.encode_image(prepared, output, spec)
+        with Image.open(output) as decoded:
+            assert decoded.format == output_format and decoded.mode == 'RGBA'
+        extension = watermark_engine.OUTPUT_EXTENSIONS[output_format]
+        assert watermark_engine.output_filename("a/b.png", spec) == f"b_watermarked{extension}"
@@ -0,0 +1,67 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Tests for font resolution
+"""
+
+import os
+import shutil
+import pytest
+from PIL import ImageFont
+
+import watermark_fonts
+
+
+def find_system_font():
+    """Return the path of any installed TrueType font, or None"""
+    for font_dir in watermark_fonts.font_dirs():
+        for dirpath, dirnames, filenames in os.walk(font_dir):
+            for filename in filenames:
+                if filename.lower().endswith('.ttf'):
+                    return os.path.join(dirpath, filename)
+    return None
+
+
+def test_index_is_persisted_and_resolves_family(tmp_path):
+    """A scanned font resolves by family name and the index is reused from disk"""
+    source = find_system_font()
+    if not source:
+        pytest.skip("no TrueType fonts installed")
+    font_dir = tmp_path / "fonts"
+    font_dir.mkdir()
+    shutil.copy(source, font_dir / "sample.ttf")
+    family, style = ImageFont.truetype(source, 12).getname()
+
+    index_file = str(tmp_path / "index.json")
+    fonts = watermark_fonts.load_font_index(index_file, [str(font_dir)])
+    assert fonts[family.lower()][style.lower()][0] == str(font_dir / "sample.ttf")
+    assert fonts["sample"]["regular"][0] == str(font_dir / "sample.ttf")
+    assert os.path.exists(index_file)
+
+    # Unchanged directories reuse the stored index
+    with open(index_file, 'r', encoding='utf-8') as f:
+        stored = f.read()
+    with open(index_file, 'w', encoding='utf-8') as f:
+        f.write(stored.replace('sample.ttf', 'cached.ttf'))
+    assert watermark_fonts.load_font_index(index_file, [str(font_dir)])["sample"]["regular"][0].endswith('cached.ttf')
+
+
+def test_index_save_uses_a_temp_file_per_process(tmp_path, capsys):
+    """Another process's temp file does not block saving, and errors stay off stdout"""
+    index_file = tmp_path / "index.json"
+    (tmp_path / "index.json.tmp").mkdir()
+    watermark_fonts.load_font_index(str(index_file), [])
+    assert index_file.exists()
+    assert sorted(os.listdir(tmp_path)) == ["index.json", "index.json.tmp"]
+
+    (tmp_path / "blocked").write_text("")
+    watermark_fonts.load_font_index(str(tmp_path / "blocked" / "index.json"), [])
+    captured = capsys.readouterr()
+    assert captured.out == "" and "Font index save error" in captured.err
+
+
+def test_get_font_caches_loaded_fonts():
+    """Repeated lookups return the same font object"""
+    first = watermark_fonts.get_font("No Such Family", 20)
+    second = watermark_fonts.get_font("No Such Family", 20)
+    assert first is second
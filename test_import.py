@@ -0,0 +1,54 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Tests for background image import
+"""
+
+import os
+from PIL import Image
+
+from watermark_import import ImageScanner, iter_image_files
+
+
+def make_tree(root):
+    """Create a folder tree with good, broken and non-image files"""
+    (root / "b").mkdir()
+    (root / "a").mkdir()
+    Image.new('RGB', (30, 20)).save(root / "a" / "one.jpg")
+    Image.new('L', (10, 10)).save(root / "b" / "two.png")
+    Image.new('RGBA', (5, 5)).save(root / "top.png")
+    (root / "b" / "broken.png").write_bytes(b"not an image")
+    (root / "notes.txt").write_text("skip me")
+
+
+def test_iter_image_files_walks_tree_in_order(tmp_path):
+    """Folders are walked recursively in name order, non-images skipped"""
+    make_tree(tmp_path)
+    found = [os.path.relpath(p, tmp_path) for p in iter_image_files([str(tmp_path)])]
+    assert found == ["top.png", os.path.join("a", "one.jpg"),
+                     os.path.join("b", "broken.png"), os.path.join("b", "two.png")]
+    assert list(iter_image_files([str(tmp_path)], recursive=False)) == [str(tmp_path / "top.png")]
+
+
+def test_scanner_batches_results_and_collects_failures(tmp_path):
+    """The scanner reports good images in batches and bad ones in one list"""
+    make_tree(tmp_path)
+    scanner = ImageScanner([str(tmp_path)], batch_size=2).start()
+    assert scanner.done.wait(5)
+    infos = scanner.poll()
+    assert sorted(os.path.basename(info.path) for info in infos) == ["one.jpg", "top.png", "two.png"]
+    one = next(info for info in infos if info.path.endswith("one.jpg"))
+    assert (one.size, one.mode, one.format) == ((30, 20), 'RGB', 'JPEG')
+    assert [os.path.basename(path) for path, error in scanner.failures] == ["broken.png"]
+    assert scanner.scanned_count == 4 and scanner.found_count == 3
+
+
+def test_scanner_cancel(tmp_path):
+    """A cancelled scan stops and still signals completion"""
+    for i in range(50):
+        Image.new('L', (2, 2)).save(tmp_path / f"{i:03}.png")
+    scanner = ImageScanner([str(tmp_path)])
+    scanner.cancel()
+    scanner.start()
+    assert scanner.done.wait(5)
+    assert scanner.cancelled and scanner.found_count == 0
@@ -0,0 +1,85 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Tests for incremental exports and atomic output files
+"""
+
+import os
+import pytest
+from dataclasses import replace
+from PIL import Image
+
+from watermark_engine import WatermarkSpec, save_image
+from watermark_manifest import ExportManifest, MANIFEST_NAME
+import watermark_batch
+
+
+def make_inputs(tmp_path, count=4):
+    src = tmp_path / "src"
+    src.mkdir()
+    paths = []
+    for i in range(count):
+        path = src / f"img{i}.png"
+        Image.new('RGB', (60, 40), (i * 50, 0, 0)).save(path)
+        paths.append(str(path))
+    out = tmp_path / "out"
+    out.mkdir()
+    return paths, str(out)
+
+
+def export(paths, out, spec, **kwargs):
+    return watermark_batch.export_images(paths, out, spec, workers=1, manifest=ExportManifest(out, **kwargs))
+
+
+def test_rerun_skips_up_to_date_outputs(tmp_path):
+    paths, out = make_inputs(tmp_path)
+    spec = WatermarkSpec()
+    first = export(paths, out, spec)
+    assert not any(result.skipped or result.error for result in first)
+    assert os.path.exists(os.path.join(out, MANIFEST_NAME))
+
+    second = export(paths, out, spec)
+    assert all(result.skipped for result in second)
+    assert [result.output_path for result in second] == [result.output_path for result in first]
+
+    # A changed input, a deleted output and nothing else are redone
+    Image.new('RGB', (60, 40), 'blue').save(paths[1])
+    os.utime(paths[1], ns=(0, 10 ** 18))
+    os.remove(first[2].output_path)
+    third = export(paths, out, spec)
+    assert [result.skipped for result in third] == [True, False, False, True]
+    assert os.path.exists(first[2].output_path)
+
+    # Changed settings redo everything
+    assert not any(result.skipped for result in export(paths, out, replace(spec, watermark_opacity=80)))
+
+
+def test_checksum_ignores_touched_inputs(tmp_path):
+    paths, out = make_inputs(tmp_path, count=2)
+    spec = WatermarkSpec()
+    export(paths, out, spec, checksum=True)
+    os.utime(paths[0], ns=(0, 10 ** 18))
+    assert [result.skipped for result in export(paths, out, spec)] == [False, True]
+
+    export(paths, out, spec, checksum=True)
+    os.utime(paths[1], ns=(0, 10 ** 18))
+    assert all(result.skipped for result in export(paths, out, spec, checksum=True))
+
+
+def test_interrupted_export_resumes(tmp_path):
+    paths, out = make_inputs(tmp_path)
+    spec = WatermarkSpec()
+    results = watermark_batch.iter_incremental_export(paths, out, spec, ExportManifest(out), workers=1)
+    next(results)
+    next(results)
+    results.close()
+
+    assert [result.skipped for result in export(paths, out, spec)] == [True, True, False, False]
+
+
+def test_failed_save_leaves_no_partial_file(tmp_path):
+    output_path = str(tmp_path / "broken.jpg")
+    with pytest.raises(OSError):
+        # JPEG cannot store RGBA; the encoder fails part way
+        save_image(Image.new('RGBA', (10, 10)), output_path, WatermarkSpec(output_format="JPEG"))
+    assert os.listdir(tmp_path) == []
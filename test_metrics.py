@@ -0,0 +1,59 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Tests for export metrics
+"""
+
+import json
+from PIL import Image
+
+from watermark_engine import WatermarkSpec
+from watermark_metrics import ExportMetrics, STAGES
+from watermark_pipeline import ExportPipeline
+
+
+def test_pipeline_records_every_stage(tmp_path):
+    src, out = tmp_path / "src", tmp_path / "out"
+    src.mkdir()
+    out.mkdir()
+    paths = []
+    for i in range(3):
+        Image.new('RGB', (60, 40), (i * 80, 0, 0)).save(src / f"img{i}.png")
+        paths.append(str(src / f"img{i}.png"))
+    paths.append(str(src / "broken.png"))
+    (src / "broken.png").write_bytes(b"not an image")
+
+    metrics = ExportMetrics()
+    list(ExportPipeline(metrics=metrics).run(paths, str(out), WatermarkSpec(), workers=1))
+    summary = metrics.summary()
+    assert (summary['images'], summary['failed']) == (4, 1)
+    assert set(summary['stages']) == set(STAGES)
+    assert summary['stages']['write']['count'] == 3
+    assert summary['bytes_read'] == sum((src / name).stat().st_size for name in ("img0.png", "img1.png",
+                                                                                  "img2.png", "broken.png"))
+    assert summary['bytes_written'] == sum(path.stat().st_size for path in out.iterdir())
+
+    metrics.write_json(str(tmp_path / "metrics.json"))
+    report = json.loads((tmp_path / "metrics.json").read_text())
+    assert [image['image_path'] for image in report['images']] == paths
+    assert report['images'][3]['error']
+
+
+def test_prometheus_text_format(tmp_path):
+    metrics = ExportMetrics()
+    for i in range(10):
+        metrics.record(f"img{i}.png", {'decode': i / 100, 'write': 0.001}, bytes_read=100, bytes_written=50)
+    metrics.write_prometheus(str(tmp_path / "export.prom"))
+    lines = (tmp_path / "export.prom").read_text().splitlines()
+
+    assert 'watermark_export_stage_seconds{stage="decode",quantile="0.5"} 0.050000' in lines
+    assert 'watermark_export_stage_seconds{stage="decode",quantile="0.99"} 0.090000' in lines
+    assert 'watermark_export_stage_seconds_count{stage="write"} 10' in lines
+    assert 'watermark_export_images_total{result="ok"} 10' in lines
+    assert 'watermark_export_bytes_read_total 1000' in lines
+    # Every sample belongs to a declared metric family
+    declared = {line.split()[2] for line in lines if line.startswith("# TYPE")}
+    for line in lines:
+        if not line.startswith("#"):
+            name = line.split('{')[0].split()[0]
+            assert name in declared or name.rsplit('_', 1)[0] in declared
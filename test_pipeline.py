@@ -0,0 +1,110 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Tests for the staged export pipeline
+"""
+
+import os
+import time
+import threading
+from PIL import Image
+
+from watermark_engine import WatermarkSpec, render_file, estimate_render_memory
+from watermark_pipeline import ExportPipeline, StageQueue, MemoryGate
+
+
+def make_inputs(tmp_path, count=5):
+    src = tmp_path / "src"
+    src.mkdir()
+    paths = []
+    for i in range(count):
+        path = src / f"img{i}.png"
+        Image.new('RGB', (60, 40), (i * 40, 0, 0)).save(path)
+        paths.append(str(path))
+    out = tmp_path / "out"
+    out.mkdir()
+    return paths, str(out)
+
+
+def test_pipeline_matches_render_file_and_reports_errors(tmp_path):
+    paths, out = make_inputs(tmp_path)
+    paths.insert(2, str(tmp_path / "missing.png"))
+    spec = WatermarkSpec(watermark_opacity=100)
+    pipeline = ExportPipeline(read_depth=1, render_depth=1, write_depth=1)
+
+    results = list(pipeline.run(paths, out, spec, workers=1))
+    assert [image_path for image_path, _, _ in results] == paths
+    assert results[2][1] is None and results[2][2]
+    (tmp_path / "ref").mkdir()
+    for image_path, output_path, error in results[:2] + results[3:]:
+        assert error is None
+        expected = render_file(image_path, str(tmp_path / "ref"), spec)
+        assert Image.open(output_path).tobytes() == Image.open(expected).tobytes()
+
+    occupancy = pipeline.occupancy()
+    assert set(occupancy) == {'read', 'render', 'write'}
+    assert all(stats['depth'] == 1 and stats['peak'] <= 1 for stats in occupancy.values())
+    assert "bottleneck" in pipeline.report()
+
+
+def test_pipeline_stops_when_consumer_closes(tmp_path):
+    paths, out = make_inputs(tmp_path, count=20)
+    threads_before = threading.active_count()
+    results = ExportPipeline(read_depth=1, render_depth=1, write_depth=1).run(paths, out, WatermarkSpec(), workers=1)
+    next(results)
+    results.close()
+    # Bounded queues: only a few files got past the first one
+    assert len(os.listdir(out)) < 10
+    assert threading.active_count() == threads_before
+
+
+def test_stage_queue_tracks_mean_and_peak():
+    stage_queue = StageQueue('test', 4)
+    stage_queue.put(1)
+    stage_queue.put(2)
+    time.sleep(0.05)
+    stage_queue.get()
+    stage_queue.get()
+    time.sleep(0.05)
+    stats = stage_queue.occupancy()
+    assert stats['peak'] == 2
+    assert 0.5 < stats['mean'] < 1.5
+
+
+def test_memory_gate_admits_within_limit():
+    gate, stop = MemoryGate(100), threading.Event()
+    assert gate.acquire(60, stop)
+    assert gate.acquire(40, stop)
+    # Over the limit: waits until stopped
+    stop.set()
+    assert not gate.acquire(10, stop)
+    gate.release(60)
+    gate.release(40)
+    # Alone, even an oversized job is admitted
+    assert gate.acquire(500, threading.Event())
+    assert (gate.peak, gate.waits) == (500, 1)
+
+
+def test_memory_limit_bounds_estimated_renders(tmp_path):
+    paths, out = make_inputs(tmp_path, count=6)
+    spec = WatermarkSpec()
+    cost = estimate_render_memory((60, 40), 'RGB', os.path.getsize(paths[0]), spec)
+    assert cost == 60 * 40 * 8 + 2 * os.path.getsize(paths[0])
+    # The tile layout blends the whole frame; palette images are converted as a whole
+    assert estimate_render_memory((60, 40), 'RGB', 0, WatermarkSpec(watermark_position="tile")) == 60 * 40 * 22
+    assert estimate_render_memory((60, 40), 'P', 0, spec) == 60 * 40 * 17
+
+    pipeline = ExportPipeline(memory_limit=int(cost * 2.5))
+    results = list(pipeline.run(paths, out, spec, workers=2))
+    assert all(error is None for _, _, error in results)
+    assert pipeline.memory.peak <= cost * 2.5
+    assert "estimated render memory" in pipeline.report()
+
+    # Under a memory limit the pool grows past workers; the gate bounds what runs
+    pipeline = ExportPipeline(memory_limit=cost * 10, max_workers=4)
+    results = list(pipeline.run(paths, out, spec, workers=2))
+    assert all(error is None for _, _, error in results)
+    assert pipeline.pool_size == 4 and pipeline.memory.peak <= cost * 10
+    without_limit = ExportPipeline(max_workers=4)
+    list(without_limit.run(paths, out, spec, workers=2))
+    assert without_limit.pool_size == 2
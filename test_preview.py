@@ -0,0 +1,129 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Tests for background preview rendering
+"""
+
+import time
+import threading
+
+from watermark_preview import PreviewRenderer
+
+
+def wait_idle(renderer, timeout=5):
+    """Wait until the renderer has nothing queued or in flight"""
+    deadline = time.time() + timeout
+    while not renderer.is_idle():
+        assert time.time() < deadline
+        time.sleep(0.005)
+
+
+def test_latest_request_wins():
+    """Requests queued behind a slow render collapse into the newest one"""
+    started = threading.Event()
+    release = threading.Event()
+    rendered = []
+
+    def render(image, spec):
+        started.set()
+        release.wait()
+        rendered.append(spec)
+        return f"frame {spec}"
+
+    renderer = PreviewRenderer(render)
+    try:
+        renderer.request(None, 0)
+        started.wait(1)
+        for spec in range(1, 20):
+            renderer.request(None, spec)
+        release.set()
+        wait_idle(renderer)
+
+        assert rendered == [0, 19]
+        frame = renderer.take_result()
+        assert frame.image == "frame 19" and frame.seconds >= 0
+        assert renderer.take_result() is None
+        assert renderer.dropped_count == 18
+    finally:
+        renderer.stop()
+
+
+def test_finished_frames_show_while_newer_ones_render():
+    """A frame that finishes after a newer request arrived is still shown"""
+    started = {spec: threading.Event() for spec in range(3)}
+    release = {spec: threading.Event() for spec in range(3)}
+
+    def render(image, spec):
+        started[spec].set()
+        release[spec].wait()
+        return f"frame {spec}"
+
+    renderer = PreviewRenderer(render)
+    try:
+        # Requests keep arriving while each frame renders, as during a drag
+        renderer.request(None, 0)
+        started[0].wait(1)
+        renderer.request(None, 1)
+        release[0].set()
+        started[1].wait(1)
+        assert renderer.take_result().image == "frame 0"
+        renderer.request(None, 2)
+        release[1].set()
+        started[2].wait(1)
+        assert renderer.take_result().image == "frame 1"
+        release[2].set()
+        wait_idle(renderer)
+        assert renderer.take_result().image == "frame 2"
+    finally:
+        for event in release.values():
+            event.set()
+        renderer.stop()
+
+
+def test_poll_reads_frame_and_idle_together():
+    """A render finishing between two polls is collected by the next poll"""
+    release = threading.Event()
+    started = threading.Event()
+
+    def render(image, spec):
+        started.set()
+        release.wait()
+        return spec
+
+    renderer = PreviewRenderer(render)
+    try:
+        renderer.request(None, "last")
+        started.wait(1)
+        # Nothing finished yet, so the poller keeps polling
+        assert renderer.poll() == (None, False)
+        # The render finishes before the next poll; take_result() then is_idle() would have missed it
+        release.set()
+        deadline = time.time() + 5
+        while renderer.rendered_count == 0:
+            assert time.time() < deadline
+            time.sleep(0.005)
+        frame, idle = renderer.poll()
+        assert frame.image == "last" and idle
+        assert renderer.poll() == (None, True)
+    finally:
+        release.set()
+        renderer.stop()
+
+
+def test_render_errors_do_not_kill_worker():
+    """A failing render is reported and the worker keeps serving requests"""
+    def render(image, spec):
+        if spec == "bad":
+            raise ValueError("boom")
+        return spec
+
+    renderer = PreviewRenderer(render)
+    try:
+        renderer.request(None, "bad")
+        wait_idle(renderer)
+        assert renderer.take_result() is None
+        renderer.request(None, "good")
+        wait_idle(renderer)
+        assert renderer.take_result().image == "good"
+    finally:
+        renderer.stop()
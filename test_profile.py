@@ -0,0 +1,55 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Tests for profiling sessions
+"""
+
+import pstats
+import threading
+from PIL import Image
+
+import watermark_engine as engine
+import watermark_batch
+from watermark_profile import ProfileSession
+from watermark_preview import PreviewRenderer
+
+
+def test_profiles_export_threads_and_writes_reports(tmp_path):
+    src = tmp_path / "src"
+    src.mkdir()
+    paths = []
+    for i in range(3):
+        Image.new('RGB', (80, 60), (i * 80, 0, 0)).save(src / f"img{i}.png")
+        paths.append(str(src / f"img{i}.png"))
+    (tmp_path / "out").mkdir()
+
+    session = ProfileSession(label="test export")
+    session.start()
+    with session.profiled():
+        watermark_batch.export_images(paths, str(tmp_path / "out"), engine.WatermarkSpec(), workers=1)
+    written = session.write(str(tmp_path / "prof" / "run"))
+
+    assert [path.rsplit('/', 1)[1] for path in written] == ["run.pstats", "run_alloc.txt", "run_summary.txt"]
+    # Renders ran on pipeline threads started during the session
+    calls = {name: stat[1] for (filename, line, name), stat in pstats.Stats(written[0]).stats.items()}
+    assert calls["apply_text_watermark"] == 3
+    summary = (tmp_path / "prof" / "run_summary.txt").read_text()
+    assert "apply_text_watermark" in summary
+    assert "update_preview" in summary and "not called" in summary
+    assert "tracemalloc peak" in (tmp_path / "prof" / "run_alloc.txt").read_text()
+
+
+def test_wrap_profiles_an_existing_thread(tmp_path):
+    renderer = PreviewRenderer()
+    try:
+        session = ProfileSession()
+        session.start()
+        renderer.render = session.wrap(engine.apply_watermark)
+        renderer.request(Image.new('RGB', (80, 60)), engine.WatermarkSpec(watermark_type="image"))
+        while not renderer.is_idle():
+            threading.Event().wait(0.01)
+        session.stop()
+    finally:
+        renderer.stop()
+    calls = {name: stat[1] for (filename, line, name), stat in session.stats().stats.items()}
+    assert calls["apply_image_watermark"] == 1
@@ -0,0 +1,124 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Tests for the HTTP watermarking service
+"""
+
+import io
+import os
+import json
+import threading
+import http.client
+import pytest
+from PIL import Image
+
+from watermark_engine import WatermarkSpec
+from watermark_server import WatermarkServer, WatermarkService, TemplateStore, RequestError
+
+
+def image_bytes(color='red', fmt='PNG'):
+    output = io.BytesIO()
+    Image.new('RGB', (120, 80), color).save(output, fmt)
+    return output.getvalue()
+
+
+@pytest.fixture
+def server(tmp_path):
+    templates = tmp_path / "templates"
+    templates.mkdir()
+    (templates / "client.json").write_text(json.dumps(WatermarkSpec(watermark_opacity=100,
+                                                                    output_format="JPEG").to_dict()))
+    service = WatermarkService(workers=1, templates=TemplateStore(str(templates), str(tmp_path / "none.json")),
+                               max_body=100000, queue_timeout=0.1)
+    httpd = WatermarkServer(('127.0.0.1', 0), service)
+    thread = threading.Thread(target=httpd.serve_forever)
+    thread.start()
+    yield httpd
+    httpd.shutdown()
+    httpd.server_close()
+    service.close()
+    thread.join()
+
+
+def post(conn, path, body, headers=None):
+    conn.request("POST", path, body, headers or {})
+    response = conn.getresponse()
+    return response, response.read()
+
+
+def test_renders_with_template_and_inline_spec_on_one_connection(server):
+    conn = http.client.HTTPConnection(*server.server_address[:2])
+    response, body = post(conn, "/watermark?template=client", image_bytes())
+    assert response.status == 200
+    assert response.getheader("Content-Type") == "image/jpeg"
+    assert Image.open(io.BytesIO(body)).format == "JPEG"
+
+    # Same connection: the server keeps it alive
+    spec = json.dumps({"watermark_text": "Client A", "watermark_color": "#00FF00", "output_format": "PNG"})
+    response, body = post(conn, "/watermark", image_bytes(), {"X-Watermark-Spec": spec})
+    assert response.status == 200
+    image = Image.open(io.BytesIO(body))
+    assert image.format == "PNG" and image.size == (120, 80)
+    assert image.convert('RGB').tobytes() != Image.new('RGB', (120, 80), 'red').tobytes()
+
+    conn.request("GET", "/health")
+    status = json.loads(conn.getresponse().read())
+    assert status["served"] == 2
+    conn.close()
+
+
+@pytest.mark.parametrize("path, body, headers, expected", [
+    ("/watermark?template=missing", b"x", {}, 404),
+    ("/watermark?template=../settings", b"x", {}, 400),
+    ("/watermark", b"not an image", {}, 400),
+    ("/watermark", b"x" * 100001, {}, 413),
+    ("/watermark", b"x", {"X-Watermark-Spec": '{"watermark_image_path": "/etc/passwd"}'}, 400),
+    ("/watermark", b"x", {"X-Watermark-Spec": '{"render_scale": 50.0}'}, 400),
+    ("/watermark", b"x", {"X-Watermark-Spec": '{"watermark_font_size": "x"}'}, 400),
+    ("/watermark", b"x", {"X-Watermark-Spec": '{"watermark_font_size": 100000}'}, 400),
+    ("/watermark", b"x", {"X-Watermark-Spec": '{"watermark_scale": 5000}'}, 400),
+    ("/watermark", b"x", {"X-Watermark-Spec": '{"watermark_tile_spacing": -5}'}, 400),
+    ("/watermark", b"x", {"X-Watermark-Spec": '{"watermark_rotation": true}'}, 400),
+    ("/watermark", b"x", {"X-Watermark-Spec": '{"resize_mode": "percent", "resize_value": 1000}'}, 400),
+    ("/watermark", b"x", {"X-Watermark-Spec": '{"output_format": "BMP"}'}, 400),
+    ("/watermark", b"x", {"X-Watermark-Spec": '{"watermark_color": "zz"}'}, 400),
+    ("/watermark", b"x", {"X-Watermark-Spec": '{"watermark_color": "#gggggg"}'}, 400),
+    ("/other", b"x", {}, 404),
+])
+def test_rejects_bad_requests(server, path, body, headers, expected):
+    conn = http.client.HTTPConnection(*server.server_address[:2])
+    response, data = post(conn, path, body, headers)
+    assert response.status == expected
+    assert "error" in json.loads(data)
+    conn.close()
+
+
+def test_refuses_requests_over_the_concurrency_cap(server):
+    service = server.service
+    for _ in range(service.max_concurrency):
+        service.acquire()
+    try:
+        conn = http.client.HTTPConnection(*server.server_address[:2])
+        response, _ = post(conn, "/watermark", image_bytes())
+        assert response.status == 503
+        assert response.getheader("Retry-After") == "1"
+        conn.close()
+    finally:
+        for _ in range(service.max_concurrency):
+            service.release()
+    assert service.status()["rejected"] == 1
+
+
+def test_replaces_the_pool_after_a_worker_dies(tmp_path):
+    service = WatermarkService(workers=2, templates=TemplateStore(str(tmp_path), str(tmp_path / "none.json")))
+    try:
+        broken = service.executor
+        with pytest.raises(Exception):
+            broken.submit(os._exit, 1).result()
+        with pytest.raises(RequestError) as error:
+            service.render(image_bytes(), WatermarkSpec())
+        assert error.value.status == 500
+        assert service.executor is not broken
+        assert Image.open(io.BytesIO(service.render(image_bytes(), WatermarkSpec()))).size == (120, 80)
+    finally:
+        service.close()
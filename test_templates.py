@@ -0,0 +1,114 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Tests for compiled templates and multi-template exports
+"""
+
+import os
+import json
+import pytest
+from PIL import Image, ImageFont
+
+import watermark_engine
+import watermark_fonts
+from watermark_engine import WatermarkSpec, render_bytes, render_bytes_multi
+from watermark_templates import compile_template, compile_templates
+from watermark_manifest import ExportManifest
+import watermark_batch
+import watermark_cli
+
+
+def make_templates(tmp_path):
+    logo = tmp_path / "logo.png"
+    Image.new('RGBA', (16, 16), (0, 0, 255, 255)).save(logo)
+    templates = tmp_path / "templates"
+    templates.mkdir()
+    (templates / "a.json").write_text(json.dumps({'watermark_text': 'A', 'watermark_opacity': 100}),
+                                      encoding='utf-8')
+    (templates / "b.json").write_text(json.dumps({'watermark_type': 'image', 'watermark_image_path': str(logo),
+                                                  'output_format': 'JPEG', 'filename_suffix': '_b'}),
+                                      encoding='utf-8')
+    return [str(templates / "a.json"), str(templates / "b.json")]
+
+
+def test_compiled_template_is_hashable_and_resolved(tmp_path):
+    a, b = compile_templates(make_templates(tmp_path))
+    assert (a.name, b.name) == ("a", "b")
+    assert hash(a) == hash(compile_template(a.spec, "a"))
+    assert os.path.isabs(b.spec.watermark_image_path) and b.logo is not None
+    with pytest.raises(ValueError):
+        compile_template(WatermarkSpec(watermark_type="image", watermark_image_path=str(tmp_path / "missing.png")))
+
+
+def test_compiled_font_is_used_when_the_index_changes(tmp_path, monkeypatch):
+    builtin = ImageFont.load_default(24)
+    if not hasattr(builtin.path, 'getvalue'):
+        pytest.skip("Pillow built without its FreeType default font")
+    font_file = tmp_path / "brand.ttf"
+    font_file.write_bytes(builtin.path.getvalue())
+    monkeypatch.setattr(watermark_fonts, '_index', {'brand': {'regular': [str(font_file), 0]}})
+    spec = WatermarkSpec(watermark_text="Brand", watermark_font_family="Brand", watermark_font_size=30,
+                         watermark_opacity=100)
+    template = compile_template(spec, "brand")
+    assert template.font == (str(font_file), 0)
+    assert (template.spec.watermark_font_path, template.spec.watermark_font_index) == template.font
+
+    path = tmp_path / "x.png"
+    Image.new('RGB', (160, 80), 'black').save(path)
+    data = path.read_bytes()
+    expected = render_bytes(data, template.spec)
+
+    # At render time the family resolves to another file; the compiled spec still draws with its own
+    monkeypatch.setattr(watermark_fonts, '_index', {'brand': {'regular': [str(tmp_path / "other.ttf"), 0]}})
+    watermark_engine._prepare_text_mark.cache_clear()
+    assert render_bytes(data, template.spec) == expected
+    assert render_bytes(data, spec) != expected
+
+
+def test_render_bytes_multi_matches_single_renders(tmp_path):
+    templates = compile_templates(make_templates(tmp_path))
+    path = tmp_path / "x.png"
+    Image.new('RGB', (64, 48), 'gray').save(path)
+    data = path.read_bytes()
+    outputs = render_bytes_multi(data, [template.spec for template in templates])
+    assert outputs == [render_bytes(data, template.spec) for template in templates]
+
+
+def test_multi_template_export_writes_each_into_its_folder(tmp_path):
+    templates = compile_templates(make_templates(tmp_path))
+    targets = [template.target for template in templates]
+    src = tmp_path / "src"
+    src.mkdir()
+    paths = []
+    for i in range(3):
+        path = src / f"img{i}.png"
+        Image.new('RGB', (60, 40), (i * 50, 0, 0)).save(path)
+        paths.append(str(path))
+    out = tmp_path / "out"
+    out.mkdir()
+
+    for workers in (1, 2):
+        results = watermark_batch.export_images(paths, str(out), targets, workers=workers)
+        assert all(result.error is None for result in results)
+        assert results[0].outputs == (str(out / "a" / "img0_watermarked.png"), str(out / "b" / "img0_b.jpg"))
+        assert results[0].output_path == results[0].outputs[0]
+    assert sorted(os.listdir(out / "b")) == ["img0_b.jpg", "img1_b.jpg", "img2_b.jpg"]
+
+    # The manifest tracks every output; removing one re-renders its image
+    first = watermark_batch.export_images(paths, str(out), targets, workers=1, manifest=ExportManifest(str(out)))
+    assert not any(result.skipped for result in first)
+    os.remove(out / "b" / "img1_b.jpg")
+    second = watermark_batch.export_images(paths, str(out), targets, workers=1, manifest=ExportManifest(str(out)))
+    assert [result.skipped for result in second] == [True, False, True]
+    assert second[0].outputs == first[0].outputs
+
+
+def test_cli_applies_several_templates(tmp_path):
+    template_a, template_b = make_templates(tmp_path)
+    src = tmp_path / "src"
+    src.mkdir()
+    Image.new('RGB', (64, 48), 'white').save(src / "p.png")
+    out = tmp_path / "out"
+    assert watermark_cli.main([str(src), "-o", str(out), "-t", template_a, "-t", template_b, "-j", "1"]) == 0
+    assert os.listdir(out / "a") == ["p_watermarked.png"]
+    assert os.listdir(out / "b") == ["p_b.jpg"]
@@ -0,0 +1,61 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Tests for the thumbnail cache
+"""
+
+import os
+import time
+from PIL import Image
+
+from watermark_thumbs import ThumbnailCache, ThumbnailLoader
+
+
+def test_cache_hits_and_invalidates_on_change(tmp_path):
+    """Thumbnails are reused from disk until the source changes"""
+    source = tmp_path / "photo.jpg"
+    Image.new('RGB', (400, 300), 'red').save(source)
+    cache_dir = str(tmp_path / "cache")
+
+    thumb = ThumbnailCache(cache_dir).get(str(source))
+    assert thumb.size == (48, 36)
+
+    # A new cache instance (e.g. next launch) finds the stored thumbnail
+    cache = ThumbnailCache(cache_dir)
+    cache.get(str(source))
+    assert (cache.hits, cache.misses) == (1, 0)
+
+    Image.new('RGB', (400, 300), 'blue').save(source)
+    os.utime(source, ns=(0, time.time_ns() + 10 ** 9))
+    assert cache.get(str(source)).getpixel((0, 0))[2] > 200
+    assert cache.misses == 1
+
+
+def test_cache_evicts_least_recently_used(tmp_path):
+    """The cache stays under its cap by dropping the oldest entries"""
+    cache = ThumbnailCache(str(tmp_path / "cache"), max_bytes=1)
+    for i in range(3):
+        path = tmp_path / f"{i}.png"
+        Image.effect_noise((100, 100), 80).save(path)
+        cache.get(str(path))
+    assert len(os.listdir(tmp_path / "cache")) <= 1
+
+
+def test_loader_delivers_requested_rows(tmp_path):
+    """Every requested row gets its thumbnail"""
+    paths = []
+    for i in range(3):
+        path = tmp_path / f"{i}.png"
+        Image.new('L', (64, 64), i * 50).save(path)
+        paths.append(str(path))
+    loader = ThumbnailLoader(ThumbnailCache(str(tmp_path / "cache")), workers=1)
+    try:
+        loader.request([(i, path) for i, path in enumerate(paths)])
+        deadline = time.time() + 5
+        results = []
+        while len(results) < 3 and time.time() < deadline:
+            results.extend(loader.poll())
+            time.sleep(0.01)
+        assert sorted(key for key, thumb in results) == [0, 1, 2]
+    finally:
+        loader.shutdown()
@@ -0,0 +1,119 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Tests for tiled, bounded-memory export
+"""
+
+from PIL import Image, ImageChops
+
+from watermark_engine import WatermarkSpec, apply_watermark
+import pytest
+import watermark_tiled
+import watermark_cli
+
+
+def make_source(path, mode='RGB', size=(700, 1900), **save_args):
+    gradient = Image.linear_gradient('L').resize(size)
+    image = Image.merge('RGB', (gradient, gradient.transpose(Image.Transpose.FLIP_LEFT_RIGHT), gradient))
+    image.convert(mode).save(path, **save_args)
+    return path
+
+
+def assert_matches_full_render(source, output, spec):
+    with Image.open(source) as img:
+        expected = apply_watermark(img.convert(watermark_tiled.writer_mode(img.mode)), spec)
+    with Image.open(output) as result:
+        result.load()
+        assert result.size == expected.size
+        assert ImageChops.difference(result.convert(expected.mode), expected).getbbox() is None
+
+
+def test_band_reader_streams_raw_sources(tmp_path):
+    """Uncompressed TIFF and BMP are decoded band by band"""
+    for name, save_args in (("a.tif", {}), ("b.bmp", {})):
+        path = make_source(str(tmp_path / name), **save_args)
+        reader = watermark_tiled.BandReader(path)
+        assert reader.streamable
+        with Image.open(path) as img:
+            assert ImageChops.difference(reader.read(300, 420), img.crop((0, 300, 700, 420))).getbbox() is None
+        assert reader._image is None
+
+
+def test_band_reader_decodes_compressed_tiff_in_chunks(tmp_path):
+    """LZW strips and deflate tiles are decoded a band at a time"""
+    strips = make_source(str(tmp_path / "lzw.tif"), 'RGBA', compression="tiff_lzw")
+    tiled = str(tmp_path / "tiled.tif")
+    with Image.open(strips) as img, watermark_tiled.TiledTiffWriter(tiled, img.size, 'RGBA') as writer:
+        for top in range(0, img.height, 512):
+            writer.write(img.crop((0, top, img.width, min(top + 512, img.height))))
+    for path in (strips, tiled):
+        reader = watermark_tiled.BandReader(path)
+        assert reader.chunks is not None
+        with Image.open(path) as img:
+            for top, bottom in ((0, 1), (300, 777), (1800, 1900)):
+                expected = img.crop((0, top, 700, bottom))
+                assert ImageChops.difference(reader.read(top, bottom), expected).getbbox() is None
+        assert reader._image is None
+
+
+def test_refuses_whole_decodes_over_budget(tmp_path):
+    source = make_source(str(tmp_path / "deflate.png"))
+    with pytest.raises(ValueError):
+        watermark_tiled.render_file_tiled(source, str(tmp_path), WatermarkSpec(), memory_budget=1024 * 1024)
+    output = watermark_tiled.render_file_tiled(source, str(tmp_path), WatermarkSpec(), memory_budget=8 * 1024 * 1024)
+    assert_matches_full_render(source, output, WatermarkSpec())
+
+
+def test_tiled_output_matches_full_render(tmp_path):
+    """Watermarks crossing band boundaries render exactly like a full-frame render"""
+    spec = WatermarkSpec(watermark_text="TILED", watermark_font_size=160, watermark_rotation=30,
+                         watermark_position="center", watermark_opacity=70)
+    sources = [
+        make_source(str(tmp_path / "rgb.tif")),
+        make_source(str(tmp_path / "gray.bmp"), 'L'),
+        make_source(str(tmp_path / "rgba.tif"), 'RGBA'),
+        make_source(str(tmp_path / "lzw.tif"), compression="tiff_lzw"),
+    ]
+    for output_format in ("PNG", "TIFF"):
+        out_dir = tmp_path / output_format
+        out_dir.mkdir()
+        for source in sources:
+            format_spec = WatermarkSpec.from_dict({**spec.to_dict(), "output_format": output_format})
+            # A small budget forces many bands across the watermark
+            output = watermark_tiled.render_file_tiled(source, str(out_dir), format_spec, memory_budget=700 * 20 * 256)
+            assert output.endswith(".png" if output_format == "PNG" else ".tif")
+            assert_matches_full_render(source, output, format_spec)
+    with pytest.raises(ValueError):
+        watermark_tiled.render_file_tiled(sources[0], str(tmp_path), WatermarkSpec(output_format="JPEG"))
+
+
+def test_size_limit_leaves_pillow_global_alone(tmp_path, monkeypatch):
+    path = make_source(str(tmp_path / "a.tif"))
+    monkeypatch.setattr(Image, 'MAX_IMAGE_PIXELS', 1000)
+    reader = watermark_tiled.BandReader(path)
+    assert reader.size == (700, 1900) and reader.read(0, 10).size == (700, 10)
+    assert Image.MAX_IMAGE_PIXELS == 1000
+    with pytest.raises(Image.DecompressionBombError):
+        watermark_tiled.BandReader(path, max_pixels=700 * 1900 - 1)
+
+
+def test_band_height_respects_budget():
+    assert watermark_tiled.band_height(1000, 1000 * watermark_tiled.BYTES_PER_BAND_PIXEL * 300, 256) == 256
+    assert watermark_tiled.band_height(1000, 1, 256) == 256
+    assert watermark_tiled.band_height(1000, 1000 * watermark_tiled.BYTES_PER_BAND_PIXEL * 300) == 300
+
+
+def test_cli_tiled(tmp_path):
+    src = tmp_path / "src"
+    src.mkdir()
+    make_source(str(src / "pano.tif"))
+    out = tmp_path / "out"
+    assert watermark_cli.main([str(src), "-o", str(out), "-j", "1", "--memory-budget", "1", "--format", "JPEG"]) == 2
+    assert watermark_cli.main([str(src), "-o", str(out), "-j", "1", "--tiled", "--format", "TIFF",
+                               "--metrics-json", str(tmp_path / "metrics.json")]) == 2
+    assert not (tmp_path / "metrics.json").exists()
+    assert watermark_cli.main([str(src), "-o", str(out), "-j", "1", "--memory-budget", "1", "--format", "TIFF"]) == 0
+    outputs = list(out.glob("*.tif"))
+    assert len(outputs) == 1
+    with Image.open(outputs[0]) as result:
+        assert result.size == (700, 1900)
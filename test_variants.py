@@ -0,0 +1,114 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Tests for resized exports and multi-variant output profiles
+"""
+
+import io
+import json
+import pytest
+from dataclasses import replace
+from PIL import Image
+
+import watermark_engine
+from watermark_engine import WatermarkSpec, resized_size, render_variants, render_bytes, draft_for_specs
+from watermark_variants import OutputVariant, load_profile, variant_targets
+import watermark_cli
+
+PROFILE = {'variants': [
+    {'name': 'full', 'output_format': 'JPEG', 'jpeg_quality': 90, 'filename_suffix': ''},
+    {'name': 'web', 'resize_mode': 'long_edge', 'resize_value': 600, 'output_format': 'JPEG',
+     'filename_suffix': '_web'},
+    {'name': 'thumb', 'resize_mode': 'long_edge', 'resize_value': 200, 'output_format': 'PNG',
+     'filename_suffix': '_thumb', 'subdir': 'thumbs'},
+]}
+
+
+def test_resized_size_modes():
+    size = (1200, 800)
+    assert resized_size(size, WatermarkSpec()) == size
+    assert resized_size(size, WatermarkSpec(resize_mode="width", resize_value=600)) == (600, 400)
+    assert resized_size(size, WatermarkSpec(resize_mode="height", resize_value=200)) == (300, 200)
+    assert resized_size(size, WatermarkSpec(resize_mode="long_edge", resize_value=300)) == (300, 200)
+    assert resized_size(size, WatermarkSpec(resize_mode="percent", resize_value=50)) == (600, 400)
+    # Fitting never enlarges
+    assert resized_size(size, WatermarkSpec(resize_mode="long_edge", resize_value=4000)) == size
+
+
+def test_variants_cascade_from_one_decode(tmp_path, monkeypatch):
+    sources = []
+    resize = watermark_engine.resize_image
+
+    def recording_resize(image, size):
+        sources.append((image.size, size))
+        return resize(image, size)
+
+    monkeypatch.setattr(watermark_engine, 'resize_image', recording_resize)
+    logo = tmp_path / "logo.png"
+    Image.new('RGBA', (200, 100), (255, 0, 0, 255)).save(logo)
+    spec = WatermarkSpec(watermark_type="image", watermark_image_path=str(logo), watermark_opacity=100)
+    image = Image.new('RGB', (1200, 800), 'black')
+    specs = [spec, spec, replace(spec, resize_mode="long_edge", resize_value=200),
+             replace(spec, resize_mode="long_edge", resize_value=600)]
+    rendered = dict(render_variants(image, specs))
+    assert [rendered[i].size for i in range(4)] == [(1200, 800), (1200, 800), (200, 133), (600, 400)]
+    # The full frame is resampled once; the thumbnail comes from the web copy
+    assert sources == [((1200, 800), (600, 400)), ((600, 400), (200, 133))]
+
+    # The watermark keeps its size and position relative to the image
+    assert rendered[0].getbbox() == (500, 350, 700, 450)
+    assert rendered[3].getbbox() == (250, 175, 350, 225)
+
+
+def test_profile_validation():
+    with pytest.raises(ValueError):
+        OutputVariant.from_dict({'name': 'x', 'watermark_text': 'no'})
+    with pytest.raises(ValueError):
+        OutputVariant.from_dict({'name': 'x', 'resize_mode': 'fit'})
+    duplicate = [OutputVariant.from_dict({'name': 'a'}), OutputVariant.from_dict({'name': 'b', 'jpeg_quality': 50})]
+    with pytest.raises(ValueError):
+        variant_targets(WatermarkSpec(), duplicate)
+
+
+def test_cli_writes_every_variant(tmp_path, capsys):
+    src = tmp_path / "src"
+    src.mkdir()
+    Image.new('RGB', (1200, 900), 'navy').save(src / "photo.png")
+    template = tmp_path / "template.json"
+    template.write_text('{"watermark_text": "Proof"}', encoding='utf-8')
+    profile = tmp_path / "profile.json"
+    profile.write_text(json.dumps(PROFILE), encoding='utf-8')
+    assert len(load_profile(str(profile))) == 3
+
+    out = tmp_path / "out"
+    args = [str(src), "-o", str(out), "-t", str(template), "--variants", str(profile)]
+    assert watermark_cli.main(args + ["-j", "1"]) == 0
+    assert Image.open(out / "photo.jpg").size == (1200, 900)
+    assert Image.open(out / "photo_web.jpg").size == (600, 450)
+    thumb = Image.open(out / "thumbs" / "photo_thumb.png")
+    assert thumb.format == "PNG" and thumb.size == (200, 150)
+
+    # Unchanged variants are skipped on the next run
+    assert watermark_cli.main(args) == 0
+    assert "1 already up to date" in capsys.readouterr().out
+
+
+def test_reduce_on_load_keeps_watermark_relative(tmp_path):
+    logo = tmp_path / "logo.png"
+    Image.new('RGBA', (400, 200), (255, 0, 0, 255)).save(logo)
+    path = tmp_path / "camera.jpg"
+    Image.new('RGB', (2400, 1600), 'black').save(path)
+    spec = WatermarkSpec(watermark_type="image", watermark_image_path=str(logo), watermark_opacity=100,
+                         output_format="PNG", resize_mode="long_edge", resize_value=400)
+
+    # The JPEG decoder scales by 1/4 instead of decoding the full frame
+    with Image.open(path) as img:
+        assert draft_for_specs(img, [spec]) == (2400, 1600)
+        assert img.size == (600, 400)
+
+    with Image.open(io.BytesIO(render_bytes(path.read_bytes(), spec))) as out:
+        assert out.size == (400, 267)
+        left, top, right, bottom = out.convert('RGB').point(lambda v: 255 if v > 128 else 0).getbbox()
+    # The 400x200 logo on the 2400px source becomes about 67x33 on the 400px output
+    assert abs(right - left - 67) <= 2 and abs(bottom - top - 33) <= 2
+    assert abs((left + right) / 2 - 200) <= 2
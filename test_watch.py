@@ -0,0 +1,136 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Tests for watch-folder mode
+"""
+
+import os
+import sys
+import time
+import threading
+import pytest
+from PIL import Image
+
+import watermark_watch
+from watermark_engine import WatermarkSpec
+from watermark_batch import export_one
+from watermark_manifest import MANIFEST_NAME
+from watermark_watch import WatchDaemon, InotifyWatcher
+
+
+def start_daemon(src, out, **kwargs):
+    options = dict(workers=1, settle=0.1, poll_interval=0.1, stats_interval=0.5, log=lambda line: None)
+    options.update(kwargs)
+    daemon = WatchDaemon([str(src)], str(out), WatermarkSpec(output_format="PNG"), **options)
+    thread = threading.Thread(target=daemon.run)
+    thread.start()
+    return daemon, thread
+
+
+def wait_for_outputs(out, count, timeout=20):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        outputs = [name for name in os.listdir(out) if name.endswith(".png")]
+        if len(outputs) >= count:
+            return outputs
+        time.sleep(0.05)
+    return [name for name in os.listdir(out) if name.endswith(".png")]
+
+
+@pytest.mark.parametrize("use_inotify", [
+    False,
+    pytest.param(True, marks=pytest.mark.skipif(not sys.platform.startswith("linux"), reason="inotify is Linux only")),
+])
+def test_watch_renders_existing_and_new_files(tmp_path, use_inotify):
+    src, out = tmp_path / "src", tmp_path / "out"
+    (src / "day1").mkdir(parents=True)
+    Image.new('RGB', (60, 40), 'red').save(src / "old.png")
+
+    daemon, thread = start_daemon(src, out, use_inotify=use_inotify)
+    try:
+        assert len(wait_for_outputs(out, 1)) == 1
+        Image.new('RGB', (60, 40), 'green').save(src / "day1" / "new.png")
+        (src / "day2").mkdir()
+        Image.new('RGB', (60, 40), 'blue').save(src / "day2" / "later.png")
+        assert len(wait_for_outputs(out, 3)) == 3
+    finally:
+        daemon.stop()
+        thread.join()
+    assert daemon.stats.rendered == 3
+    assert os.path.exists(out / MANIFEST_NAME)
+
+    # A restart finds everything already rendered
+    daemon, thread = start_daemon(src, out, use_inotify=use_inotify)
+    time.sleep(0.5)
+    daemon.stop()
+    thread.join()
+    assert daemon.stats.rendered == 0
+
+
+def test_watch_waits_for_files_to_settle(tmp_path):
+    src, out = tmp_path / "src", tmp_path / "out"
+    src.mkdir()
+    daemon, thread = start_daemon(src, out, use_inotify=False, settle=1.0)
+    try:
+        path = src / "slow.png"
+        with open(path, 'wb') as f:
+            f.write(b'\x89PNG')
+        time.sleep(0.5)
+        Image.new('RGB', (60, 40), 'red').save(path)
+        assert len(wait_for_outputs(out, 1)) == 1
+    finally:
+        daemon.stop()
+        thread.join()
+    assert (daemon.stats.rendered, daemon.stats.failed) == (1, 0)
+
+
+def test_watch_backlog_defers_and_rescans(tmp_path):
+    src, out = tmp_path / "src", tmp_path / "out"
+    src.mkdir()
+    for i in range(12):
+        Image.new('RGB', (60, 40), (i * 20, 0, 0)).save(src / f"img{i}.png")
+
+    daemon, thread = start_daemon(src, out, use_inotify=False, max_backlog=4)
+    try:
+        assert len(wait_for_outputs(out, 12)) == 12
+    finally:
+        daemon.stop()
+        thread.join()
+    assert daemon.stats.rendered == 12
+
+
+def crashing_export(image_path, *args):
+    """export_one that kills its worker process for files named crash*"""
+    if os.path.basename(image_path).startswith("crash"):
+        os._exit(1)
+    return export_one(image_path, *args)
+
+
+def test_watch_survives_a_dying_worker(tmp_path, monkeypatch):
+    monkeypatch.setattr(watermark_watch, 'export_one', crashing_export)
+    src, out = tmp_path / "src", tmp_path / "out"
+    src.mkdir()
+    Image.new('RGB', (60, 40), 'red').save(src / "crash.png")
+    daemon, thread = start_daemon(src, out, use_inotify=False, workers=2)
+    try:
+        deadline = time.monotonic() + 20
+        while not daemon.stats.failed and time.monotonic() < deadline:
+            time.sleep(0.05)
+        assert daemon.stats.failed == 1
+        Image.new('RGB', (60, 40), 'green').save(src / "after.png")
+        assert wait_for_outputs(out, 1) == ["after_watermarked.png"]
+    finally:
+        daemon.stop()
+        thread.join()
+
+
+def test_inotify_reports_closed_files(tmp_path):
+    if not sys.platform.startswith("linux"):
+        pytest.skip("inotify is Linux only")
+    watcher = InotifyWatcher([str(tmp_path)])
+    try:
+        Image.new('RGB', (10, 10)).save(tmp_path / "a.png")
+        (tmp_path / "notes.txt").write_text("ignored")
+        assert set(watcher.poll(1.0)) == {str(tmp_path / "a.png")}
+    finally:
+        watcher.close()
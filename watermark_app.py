@@ -10,10 +10,47 @@ from tkinter import ttk, filedialog, messagebox, colorchooser, simpledialog
 from tkinter.font import families
 import os
 import json
-from PIL import Image, ImageDraw, ImageFont, ImageTk, ImageEnhance
-import math
-from pathlib import Path
-import shutil
+import time
+import contextlib
+from PIL import ImageTk
+import threading
+import multiprocessing
+import watermark_engine as engine
+import watermark_batch as batch
+import watermark_fonts as fonts
+from watermark_engine import WatermarkSpec
+from watermark_preview import PreviewRenderer
+from watermark_import import ImageScanner
+from watermark_manifest import ExportManifest
+from watermark_templates import TEMPLATES_DIR, load_template, compile_templates
+from watermark_profile import ProfileSession
+from watermark_thumbs import ThumbnailCache, ThumbnailLoader, THUMB_SIZE
+
+# How often the Tk thread checks for finished preview frames
+PREVIEW_POLL_MS = 15
+
+# How often the Tk thread moves scanned images into the list
+IMPORT_POLL_MS = 100
+
+# Thumbnail requests wait for scrolling to settle; results are polled
+THUMB_DELAY_MS = 50
+THUMB_POLL_MS = 50
+
+# How often the Tk thread refreshes export progress
+EXPORT_POLL_MS = 200
+
+# Encoder presets as shown in the export settings
+ENCODER_PRESET_LABELS = {"default": "标准", "fast": "快速", "small": "文件最小"}
+
+# Export resize modes as shown in the export settings
+RESIZE_MODE_LABELS = {"none": "不调整", "width": "按宽度", "height": "按高度", "long_edge": "按长边",
+                      "percent": "按百分比"}
+
+def format_duration(seconds):
+    """Format seconds as m:ss or h:mm:ss"""
+    minutes, seconds = divmod(int(seconds), 60)
+    hours, minutes = divmod(minutes, 60)
+    return f"{hours}:{minutes:02d}:{seconds:02d}" if hours else f"{minutes}:{seconds:02d}"
 
 class WatermarkApp:
     def __init__(self, root):
@@ -26,19 +63,45 @@ class WatermarkApp:
         self.images = []  # List of loaded images
         self.current_image_index = 0
         self.preview_image = None
+        self.preview_source_size = None
         self.preview_with_watermark = None
         self.watermark_x = 0
         self.watermark_y = 0
         self.dragging = False
         
+        # Background preview rendering
+        self.preview_renderer = PreviewRenderer()
+        self.preview_poll_scheduled = False
+        self.render_time_text = tk.StringVar()
+        
+        # Profiling session started from the tools menu
+        self.profile_session = None
+        
+        # Background image import
+        self.scanner = None
+        self.import_status = tk.StringVar()
+        
+        # Lazily loaded list thumbnails backed by the on-disk cache
+        self.thumbnail_photos = {}
+        self.thumbnail_job = None
+        try:
+            self.thumbnail_loader = ThumbnailLoader(ThumbnailCache())
+        except OSError as e:
+            print(f"Thumbnail cache error: {str(e)}")
+            self.thumbnail_loader = None
+        
         # Watermark settings
         self.watermark_text = tk.StringVar(value="Sample Watermark")
         self.watermark_font_family = tk.StringVar(value="Arial")
         self.watermark_font_size = tk.IntVar(value=36)
+        self.watermark_bold = tk.BooleanVar(value=False)
+        self.watermark_italic = tk.BooleanVar(value=False)
         self.watermark_color = "#FFFFFF"
         self.watermark_opacity = tk.IntVar(value=50)
         self.watermark_rotation = tk.IntVar(value=0)
         self.watermark_position = tk.StringVar(value="center")
+        self.watermark_tile_spacing = tk.IntVar(value=100)
+        self.watermark_tile_stagger = tk.IntVar(value=50)
         self.watermark_image_path = tk.StringVar()
         self.watermark_type = tk.StringVar(value="text")
         self.watermark_scale = tk.IntVar(value=100)
@@ -46,14 +109,25 @@ class WatermarkApp:
         # Export settings
         self.output_format = tk.StringVar(value="PNG")
         self.jpeg_quality = tk.IntVar(value=95)
+        self.encoder_preset = tk.StringVar(value="default")
         self.filename_prefix = tk.StringVar()
         self.filename_suffix = tk.StringVar(value="_watermarked")
-        self.scale_width = tk.IntVar()
-        self.scale_height = tk.IntVar()
+        self.resize_mode = tk.StringVar(value="none")
+        self.scale_width = tk.IntVar(value=1920)
+        self.scale_height = tk.IntVar(value=1080)
+        self.scale_long_edge = tk.IntVar(value=2048)
         self.scale_percent = tk.IntVar(value=100)
+        self.export_workers = tk.IntVar(value=batch.default_workers())
+        self.export_status = tk.StringVar()
+        self.export_job = None
         
         self.setup_ui()
         self.load_settings()
+        if self.thumbnail_loader:
+            self.root.after(THUMB_POLL_MS, self.poll_thumbnails)
+        
+        # Build/load the font index off the main thread so the first preview is fast
+        threading.Thread(target=fonts.get_font_index, daemon=True).start()
         
     def setup_ui(self):
         """Setup the user interface"""
@@ -86,6 +160,13 @@ class WatermarkApp:
         template_menu.add_command(label="保存模板", command=self.save_template)
         template_menu.add_command(label="加载模板", command=self.load_template)
         template_menu.add_command(label="管理模板", command=self.manage_templates)
+        template_menu.add_command(label="按多个模板导出", command=self.export_with_templates)
+        
+        # Tools menu
+        self.tools_menu = tk.Menu(menubar, tearoff=0)
+        menubar.add_cascade(label="工具", menu=self.tools_menu)
+        self.tools_menu.add_command(label="开始性能分析", command=self.start_profiling)
+        self.tools_menu.add_command(label="停止性能分析并保存...", command=self.stop_profiling, state=tk.DISABLED)
         
     def create_main_frames(self):
         """Create main layout frames"""
@@ -112,18 +193,31 @@ class WatermarkApp:
         ttk.Button(btn_frame, text="导入文件夹", command=self.import_folder).pack(side=tk.LEFT, padx=(0, 5))
         ttk.Button(btn_frame, text="清空", command=self.clear_images).pack(side=tk.LEFT)
         
-        # Image listbox with scrollbar
+        # Image list (thumbnail + file name) with scrollbar
         list_container = ttk.Frame(list_frame)
         list_container.pack(fill=tk.BOTH, expand=True)
         
-        self.image_listbox = tk.Listbox(list_container, selectmode=tk.SINGLE)
-        scrollbar = ttk.Scrollbar(list_container, orient=tk.VERTICAL, command=self.image_listbox.yview)
-        self.image_listbox.config(yscrollcommand=scrollbar.set)
+        ttk.Style().configure("Thumbs.Treeview", rowheight=THUMB_SIZE[1] + 4)
+        self.image_list = ttk.Treeview(list_container, show="tree", selectmode="browse", style="Thumbs.Treeview")
+        scrollbar = ttk.Scrollbar(list_container, orient=tk.VERTICAL, command=self.image_list.yview)
         
-        self.image_listbox.pack(side=tk.LEFT, fill=tk.BOTH, expand=True)
+        def on_scroll(first, last):
+            scrollbar.set(first, last)
+            self.schedule_thumbnails()
+            
+        self.image_list.config(yscrollcommand=on_scroll)
+        
+        self.image_list.pack(side=tk.LEFT, fill=tk.BOTH, expand=True)
         scrollbar.pack(side=tk.RIGHT, fill=tk.Y)
         
-        self.image_listbox.bind('<<ListboxSelect>>', self.on_image_select)
+        self.image_list.bind('<<TreeviewSelect>>', self.on_image_select)
+        self.image_list.bind('<Configure>', lambda e: self.schedule_thumbnails())
+        
+        # Import progress
+        import_frame = ttk.Frame(list_frame)
+        import_frame.pack(fill=tk.X, pady=(5, 0))
+        ttk.Label(import_frame, textvariable=self.import_status).pack(side=tk.LEFT)
+        self.import_cancel_btn = ttk.Button(import_frame, text="取消导入", command=self.cancel_import)
         
     def create_preview_frame(self):
         """Create preview frame"""
@@ -144,6 +238,9 @@ class WatermarkApp:
         v_scrollbar.pack(side=tk.RIGHT, fill=tk.Y)
         h_scrollbar.pack(side=tk.BOTTOM, fill=tk.X)
         
+        # Render time readout
+        ttk.Label(preview_frame, textvariable=self.render_time_text).pack(anchor=tk.E)
+        
         # Bind mouse events for dragging
         self.preview_canvas.bind("<Button-1>", self.on_canvas_click)
         self.preview_canvas.bind("<B1-Motion>", self.on_canvas_drag)
@@ -188,6 +285,14 @@ class WatermarkApp:
         size_spin.pack(side=tk.LEFT, padx=(5, 0))
         size_spin.bind('<KeyRelease>', lambda e: self.update_preview())
         
+        # Font style
+        style_frame = ttk.Frame(self.text_frame)
+        style_frame.pack(fill=tk.X, pady=(0, 5))
+        ttk.Checkbutton(style_frame, text="粗体", variable=self.watermark_bold,
+                        command=self.update_preview).pack(side=tk.LEFT)
+        ttk.Checkbutton(style_frame, text="斜体", variable=self.watermark_italic,
+                        command=self.update_preview).pack(side=tk.LEFT, padx=(10, 0))
+        
         # Color and opacity
         color_frame = ttk.Frame(self.text_frame)
         color_frame.pack(fill=tk.X, pady=(0, 5))
@@ -245,6 +350,18 @@ class WatermarkApp:
             btn = ttk.Button(pos_frame, text=text, width=6,
                            command=lambda v=value: self.set_position_preset(v))
             btn.grid(row=row, column=col, padx=1, pady=1)
+        ttk.Button(pos_frame, text="平铺", width=6,
+                  command=lambda: self.set_position_preset("tile")).grid(row=3, column=0, padx=1, pady=1)
+        
+        # Tile layout: gap between marks and shift of every other row
+        tile_frame = ttk.Frame(pos_frame)
+        tile_frame.grid(row=3, column=1, columnspan=2, sticky=tk.W)
+        ttk.Label(tile_frame, text="间距:").pack(side=tk.LEFT)
+        ttk.Spinbox(tile_frame, from_=0, to=2000, textvariable=self.watermark_tile_spacing, width=5,
+                   command=self.update_preview).pack(side=tk.LEFT)
+        ttk.Label(tile_frame, text="错位%:").pack(side=tk.LEFT, padx=(5, 0))
+        ttk.Spinbox(tile_frame, from_=0, to=99, textvariable=self.watermark_tile_stagger, width=4,
+                   command=self.update_preview).pack(side=tk.LEFT)
             
     def create_export_settings_frame(self):
         """Create export settings frame"""
@@ -258,14 +375,37 @@ class WatermarkApp:
         ttk.Label(format_frame, text="输出格式:").pack(side=tk.LEFT)
         ttk.Radiobutton(format_frame, text="PNG", variable=self.output_format, value="PNG").pack(side=tk.LEFT, padx=(5, 0))
         ttk.Radiobutton(format_frame, text="JPEG", variable=self.output_format, value="JPEG").pack(side=tk.LEFT, padx=(5, 0))
+        ttk.Radiobutton(format_frame, text="WebP", variable=self.output_format, value="WEBP").pack(side=tk.LEFT, padx=(5, 0))
+        if engine.AVIF_SUPPORTED:
+            ttk.Radiobutton(format_frame, text="AVIF", variable=self.output_format, value="AVIF").pack(side=tk.LEFT, padx=(5, 0))
+        
+        # Encoder preset
+        preset_frame = ttk.Frame(export_frame)
+        preset_frame.pack(fill=tk.X, pady=(0, 5))
+        ttk.Label(preset_frame, text="编码方式:").pack(side=tk.LEFT)
+        for preset in engine.ENCODER_PRESET_NAMES:
+            ttk.Radiobutton(preset_frame, text=ENCODER_PRESET_LABELS[preset], variable=self.encoder_preset,
+                            value=preset).pack(side=tk.LEFT, padx=(5, 0))
         
         # JPEG quality
         quality_frame = ttk.Frame(export_frame)
         quality_frame.pack(fill=tk.X, pady=(0, 5))
-        ttk.Label(quality_frame, text="JPEG质量:").pack(side=tk.LEFT)
+        ttk.Label(quality_frame, text="JPEG/WebP/AVIF质量:").pack(side=tk.LEFT)
         ttk.Scale(quality_frame, from_=1, to=100, variable=self.jpeg_quality, 
                  orient=tk.HORIZONTAL).pack(side=tk.RIGHT, fill=tk.X, expand=True, padx=(5, 0))
         
+        # Resize on export
+        resize_frame = ttk.Frame(export_frame)
+        resize_frame.pack(fill=tk.X, pady=(0, 5))
+        ttk.Label(resize_frame, text="尺寸调整:").pack(side=tk.LEFT)
+        self.resize_combo = ttk.Combobox(resize_frame, values=list(RESIZE_MODE_LABELS.values()), state="readonly",
+                                         width=8)
+        self.resize_combo.pack(side=tk.LEFT, padx=(5, 0))
+        self.resize_combo.bind('<<ComboboxSelected>>', self.on_resize_mode_change)
+        self.resize_spin = ttk.Spinbox(resize_frame, from_=1, to=100000, width=8)
+        self.resize_spin.pack(side=tk.RIGHT)
+        self.show_resize_mode()
+        
         # Filename settings
         name_frame = ttk.LabelFrame(export_frame, text="文件名设置", padding=3)
         name_frame.pack(fill=tk.X, pady=(0, 5))
@@ -280,8 +420,24 @@ class WatermarkApp:
         ttk.Label(suffix_frame, text="后缀:").pack(side=tk.LEFT)
         ttk.Entry(suffix_frame, textvariable=self.filename_suffix, width=15).pack(side=tk.RIGHT)
         
+        # Parallel export
+        workers_frame = ttk.Frame(export_frame)
+        workers_frame.pack(fill=tk.X, pady=(0, 5))
+        ttk.Label(workers_frame, text="并行进程数:").pack(side=tk.LEFT)
+        ttk.Spinbox(workers_frame, from_=1, to=256, textvariable=self.export_workers, width=8).pack(side=tk.RIGHT)
+        
         # Export button
-        ttk.Button(export_frame, text="导出所有图片", command=self.export_all_images).pack(fill=tk.X, pady=(5, 0))
+        self.export_btn = ttk.Button(export_frame, text="导出所有图片", command=self.export_all_images)
+        self.export_btn.pack(fill=tk.X, pady=(5, 0))
+        
+        # Export progress, shown while an export runs
+        self.export_progress_frame = ttk.Frame(export_frame)
+        self.export_progress = ttk.Progressbar(self.export_progress_frame, mode='determinate')
+        self.export_progress.pack(side=tk.LEFT, fill=tk.X, expand=True)
+        self.export_cancel_btn = ttk.Button(self.export_progress_frame, text="取消导出", command=self.cancel_export)
+        self.export_cancel_btn.pack(side=tk.RIGHT, padx=(5, 0))
+        self.export_status_label = ttk.Label(export_frame, textvariable=self.export_status)
+        self.export_status_label.pack(anchor=tk.W)
         
     def import_images(self):
         """Import images through file dialog"""
@@ -299,8 +455,8 @@ class WatermarkApp:
             filetypes=filetypes
         )
         
-        for file_path in files:
-            self.add_image(file_path)
+        if files:
+            self.start_import(files)
             
     def import_folder(self):
         """Import all images from a folder"""
@@ -308,43 +464,105 @@ class WatermarkApp:
         if not folder_path:
             return
             
-        supported_formats = ('.jpg', '.jpeg', '.png', '.bmp', '.tiff', '.tif')
-        
-        for file_path in Path(folder_path).rglob('*'):
-            if file_path.suffix.lower() in supported_formats:
-                self.add_image(str(file_path))
-                
-    def add_image(self, file_path):
-        """Add an image to the list"""
-        try:
-            # Test if image can be opened
-            with Image.open(file_path) as img:
-                # Add to list
-                self.images.append(file_path)
-                filename = os.path.basename(file_path)
-                self.image_listbox.insert(tk.END, filename)
-                
-                # Select the first image if this is the first one
-                if len(self.images) == 1:
-                    self.image_listbox.selection_set(0)
-                    self.current_image_index = 0
-                    self.load_current_image()
-                    
-        except Exception as e:
-            messagebox.showerror("错误", f"无法加载图片 {file_path}: {str(e)}")
+        self.start_import([folder_path])
+        
+    def start_import(self, paths):
+        """Scan files and folders in the background and add images as they are found"""
+        if self.scanner and not self.scanner.done.is_set():
+            self.scanner.cancel()
+        self.scanner = ImageScanner(paths).start()
+        self.import_cancel_btn.pack(side=tk.RIGHT)
+        self.root.after(IMPORT_POLL_MS, self.poll_import, self.scanner)
+        
+    def poll_import(self, scanner):
+        """Move scanned images into the list in batches"""
+        self.add_images([info.path for info in scanner.poll()])
+        if scanner is not self.scanner:
+            return
+            
+        if not scanner.done.is_set():
+            self.import_status.set(f"正在导入: {scanner.found_count} 张 (已检查 {scanner.scanned_count} 个文件)")
+            self.root.after(IMPORT_POLL_MS, self.poll_import, scanner)
+            return
+            
+        # Pick up anything queued between the last poll and completion
+        self.add_images([info.path for info in scanner.poll()])
+        self.import_cancel_btn.pack_forget()
+        state = "已取消" if scanner.cancelled else "完成"
+        self.import_status.set(f"导入{state}: {scanner.found_count} 张, 失败 {len(scanner.failures)} 个")
+        
+        if scanner.failures:
+            lines = [f"{os.path.basename(path)}: {error}" for path, error in scanner.failures[:10]]
+            if len(scanner.failures) > 10:
+                lines.append(f"... 以及另外 {len(scanner.failures) - 10} 个文件")
+            messagebox.showwarning("部分图片无法加载", "\n".join(lines))
+            
+    def cancel_import(self):
+        """Cancel the running import"""
+        if self.scanner:
+            self.scanner.cancel()
+            
+    def add_images(self, file_paths):
+        """Add already probed images to the list"""
+        if not file_paths:
+            return
             
+        first_batch = not self.images
+        start = len(self.images)
+        self.images.extend(file_paths)
+        for index, path in enumerate(file_paths, start):
+            self.image_list.insert('', tk.END, iid=str(index), text=os.path.basename(path))
+        self.schedule_thumbnails()
+        
+        # Select the first image if these are the first ones
+        if first_batch:
+            self.image_list.selection_set('0')
+            self.current_image_index = 0
+            self.load_current_image()
+            
+    def schedule_thumbnails(self):
+        """Request thumbnails for visible rows once scrolling settles"""
+        if self.thumbnail_loader and not self.thumbnail_job:
+            self.thumbnail_job = self.root.after(THUMB_DELAY_MS, self.request_thumbnails)
+            
+    def request_thumbnails(self):
+        """Ask the thumbnail loader for the rows currently in view"""
+        self.thumbnail_job = None
+        count = len(self.images)
+        if not count:
+            return
+        first, last = self.image_list.yview()
+        start = max(int(first * count) - 2, 0)
+        end = min(int(last * count) + 3, count)
+        visible = [((index, self.images[index]), self.images[index]) for index in range(start, end)
+                   if index not in self.thumbnail_photos]
+        self.thumbnail_loader.request(visible)
+        
+    def poll_thumbnails(self):
+        """Show finished thumbnails on the Tk thread"""
+        for (index, path), thumb in self.thumbnail_loader.poll():
+            # Skip results for rows that were cleared or replaced meanwhile
+            if index < len(self.images) and self.images[index] == path:
+                self.thumbnail_photos[index] = ImageTk.PhotoImage(thumb)
+                self.image_list.item(str(index), image=self.thumbnail_photos[index])
+        self.root.after(THUMB_POLL_MS, self.poll_thumbnails)
+        
     def clear_images(self):
         """Clear all images"""
+        self.cancel_import()
         self.images.clear()
-        self.image_listbox.delete(0, tk.END)
+        self.image_list.delete(*self.image_list.get_children())
+        self.thumbnail_photos.clear()
+        if self.thumbnail_loader:
+            self.thumbnail_loader.reset()
         self.preview_canvas.delete("all")
         self.current_image_index = 0
         
     def on_image_select(self, event):
         """Handle image selection"""
-        selection = self.image_listbox.curselection()
+        selection = self.image_list.selection()
         if selection:
-            self.current_image_index = selection[0]
+            self.current_image_index = int(selection[0])
             self.load_current_image()
             
     def load_current_image(self):
@@ -354,40 +572,40 @@ class WatermarkApp:
             
         try:
             image_path = self.images[self.current_image_index]
-            self.preview_image = Image.open(image_path)
-            
-            # Convert to RGB if necessary (for JPEG export)
-            if self.preview_image.mode in ('RGBA', 'LA', 'P'):
-                # Create white background for transparency
-                background = Image.new('RGB', self.preview_image.size, (255, 255, 255))
-                if self.preview_image.mode == 'P':
-                    self.preview_image = self.preview_image.convert('RGBA')
-                background.paste(self.preview_image, mask=self.preview_image.split()[-1] if self.preview_image.mode == 'RGBA' else None)
-                self.preview_image_rgb = background
-            else:
-                self.preview_image_rgb = self.preview_image.copy()
-                
+            # Display-sized proxy; the full-resolution image is only decoded on export
+            self.preview_image, self.preview_source_size = engine.load_preview_proxy(image_path)
             self.update_preview()
             
         except Exception as e:
             messagebox.showerror("错误", f"无法加载图片: {str(e)}")
             
     def update_preview(self):
-        """Update the preview with watermark"""
+        """Request a preview refresh; rendering happens on the preview worker"""
         if not self.preview_image:
             return
             
-        try:
-            # Create a copy of the image
-            preview = self.preview_image.copy()
-            
-            # Apply watermark
-            preview = self.apply_watermark(preview)
+        # Render on the proxy with the watermark scaled to match
+        with self.profiled():
+            scale = self.preview_image.width / self.preview_source_size[0]
+            self.preview_renderer.request(self.preview_image, self.get_spec().scaled(scale))
+        if not self.preview_poll_scheduled:
+            self.preview_poll_scheduled = True
+            self.root.after(PREVIEW_POLL_MS, self.poll_preview)
             
-            # Resize for display (maintain aspect ratio)
-            display_size = (800, 600)
-            preview.thumbnail(display_size, Image.Resampling.LANCZOS)
+    def poll_preview(self):
+        """Show finished preview frames on the Tk thread"""
+        self.preview_poll_scheduled = False
+        frame, idle = self.preview_renderer.poll()
+        if frame:
+            self.show_preview(frame.image)
+            self.render_time_text.set(f"渲染耗时: {frame.seconds * 1000:.1f} ms")
+        if not idle:
+            self.preview_poll_scheduled = True
+            self.root.after(PREVIEW_POLL_MS, self.poll_preview)
             
+    def show_preview(self, preview):
+        """Display a rendered preview frame"""
+        try:
             # Convert to PhotoImage for display
             self.preview_photo = ImageTk.PhotoImage(preview)
             
@@ -401,152 +619,99 @@ class WatermarkApp:
         except Exception as e:
             print(f"Preview update error: {str(e)}")
             
-    def apply_watermark(self, image):
-        """Apply watermark to image"""
-        if self.watermark_type.get() == "text":
-            return self.apply_text_watermark(image)
+    def resize_value_var(self):
+        """Variable holding the size for the current resize mode, None when not resizing"""
+        return {"width": self.scale_width, "height": self.scale_height, "long_edge": self.scale_long_edge,
+                "percent": self.scale_percent}.get(self.resize_mode.get())
+        
+    def show_resize_mode(self):
+        """Show the resize mode and its size in the export settings"""
+        self.resize_combo.set(RESIZE_MODE_LABELS.get(self.resize_mode.get(), RESIZE_MODE_LABELS["none"]))
+        var = self.resize_value_var()
+        if var is None:
+            self.resize_spin.config(textvariable="", state=tk.DISABLED)
         else:
-            return self.apply_image_watermark(image)
+            self.resize_spin.config(textvariable=var, state=tk.NORMAL)
             
-    def apply_text_watermark(self, image):
-        """Apply text watermark"""
-        if not self.watermark_text.get().strip():
-            return image
-            
-        # Create a copy with RGBA mode for transparency
-        watermarked = image.convert('RGBA')
-        
-        # Create transparent overlay
-        overlay = Image.new('RGBA', watermarked.size, (255, 255, 255, 0))
-        draw = ImageDraw.Draw(overlay)
+    def on_resize_mode_change(self, event=None):
+        """Switch the resize mode chosen in the combobox"""
+        label = self.resize_combo.get()
+        self.resize_mode.set(next(mode for mode, text in RESIZE_MODE_LABELS.items() if text == label))
+        self.show_resize_mode()
+        
+    def get_spec(self):
+        """Snapshot the current settings as an immutable render spec"""
+        return WatermarkSpec(
+            watermark_text=self.watermark_text.get(),
+            watermark_font_family=self.watermark_font_family.get(),
+            watermark_font_size=self.watermark_font_size.get(),
+            watermark_bold=self.watermark_bold.get(),
+            watermark_italic=self.watermark_italic.get(),
+            watermark_color=self.watermark_color,
+            watermark_opacity=self.watermark_opacity.get(),
+            watermark_rotation=self.watermark_rotation.get(),
+            watermark_position=self.watermark_position.get(),
+            watermark_type=self.watermark_type.get(),
+            watermark_image_path=self.watermark_image_path.get(),
+            watermark_scale=self.watermark_scale.get(),
+            watermark_x=self.watermark_x,
+            watermark_y=self.watermark_y,
+            watermark_tile_spacing=self.watermark_tile_spacing.get(),
+            watermark_tile_stagger=self.watermark_tile_stagger.get(),
+            output_format=self.output_format.get(),
+            jpeg_quality=self.jpeg_quality.get(),
+            encoder_preset=self.encoder_preset.get(),
+            filename_prefix=self.filename_prefix.get(),
+            filename_suffix=self.filename_suffix.get(),
+            resize_mode=self.resize_mode.get(),
+            resize_value=self.resize_value_var().get() if self.resize_value_var() else 0
+        )
         
-        # Get font
-        try:
-            font = ImageFont.truetype(f"{self.watermark_font_family.get()}.ttf", self.watermark_font_size.get())
-        except:
-            try:
-                font = ImageFont.truetype("arial.ttf", self.watermark_font_size.get())
-            except:
-                font = ImageFont.load_default()
-                
-        # Get text size
-        text = self.watermark_text.get()
-        bbox = draw.textbbox((0, 0), text, font=font)
-        text_width = bbox[2] - bbox[0]
-        text_height = bbox[3] - bbox[1]
-        
-        # Calculate position
-        x, y = self.calculate_watermark_position(watermarked.size, (text_width, text_height))
-        
-        # Convert color and apply opacity
-        color = self.hex_to_rgba(self.watermark_color, self.watermark_opacity.get())
-        
-        # Draw text
-        if self.watermark_rotation.get() != 0:
-            # Create rotated text
-            text_img = Image.new('RGBA', (text_width * 2, text_height * 2), (255, 255, 255, 0))
-            text_draw = ImageDraw.Draw(text_img)
-            text_draw.text((text_width // 2, text_height // 2), text, font=font, fill=color)
-            text_img = text_img.rotate(self.watermark_rotation.get(), expand=1)
-            
-            # Calculate new position after rotation
-            new_width, new_height = text_img.size
-            x -= (new_width - text_width) // 2
-            y -= (new_height - text_height) // 2
-            
-            overlay.paste(text_img, (x, y), text_img)
-        else:
-            draw.text((x, y), text, font=font, fill=color)
-            
-        # Composite with original image
-        watermarked = Image.alpha_composite(watermarked, overlay)
+    def set_spec(self, spec):
+        """Show a spec's settings in the controls"""
+        self.watermark_text.set(spec.watermark_text)
+        self.watermark_font_family.set(spec.watermark_font_family)
+        self.watermark_font_size.set(spec.watermark_font_size)
+        self.watermark_bold.set(spec.watermark_bold)
+        self.watermark_italic.set(spec.watermark_italic)
+        self.watermark_color = spec.watermark_color
+        self.watermark_opacity.set(spec.watermark_opacity)
+        self.watermark_rotation.set(spec.watermark_rotation)
+        self.watermark_position.set(spec.watermark_position)
+        self.watermark_tile_spacing.set(spec.watermark_tile_spacing)
+        self.watermark_tile_stagger.set(spec.watermark_tile_stagger)
+        self.watermark_type.set(spec.watermark_type)
+        self.watermark_image_path.set(spec.watermark_image_path)
+        self.watermark_scale.set(spec.watermark_scale)
+        self.output_format.set(spec.output_format)
+        self.jpeg_quality.set(spec.jpeg_quality)
+        self.encoder_preset.set(spec.encoder_preset)
+        self.filename_prefix.set(spec.filename_prefix)
+        self.filename_suffix.set(spec.filename_suffix)
+        self.resize_mode.set(spec.resize_mode)
+        if self.resize_value_var() and spec.resize_value > 0:
+            self.resize_value_var().set(spec.resize_value)
+        self.show_resize_mode()
         
-        # Convert back to original mode if needed
-        if image.mode != 'RGBA':
-            watermarked = watermarked.convert(image.mode)
+    def apply_watermark(self, image):
+        """Apply watermark to image"""
+        return engine.apply_watermark(image, self.get_spec())
             
-        return watermarked
+    def apply_text_watermark(self, image):
+        """Apply text watermark"""
+        return engine.apply_text_watermark(image, self.get_spec())
         
     def apply_image_watermark(self, image):
         """Apply image watermark"""
-        if not self.watermark_image_path.get() or not os.path.exists(self.watermark_image_path.get()):
-            return image
-            
-        try:
-            # Load watermark image
-            watermark_img = Image.open(self.watermark_image_path.get())
-            
-            # Scale watermark
-            scale_factor = self.watermark_scale.get() / 100.0
-            new_size = (int(watermark_img.width * scale_factor), int(watermark_img.height * scale_factor))
-            watermark_img = watermark_img.resize(new_size, Image.Resampling.LANCZOS)
-            
-            # Apply opacity
-            if watermark_img.mode != 'RGBA':
-                watermark_img = watermark_img.convert('RGBA')
-                
-            # Apply opacity
-            opacity = self.watermark_opacity.get() / 100.0
-            alpha = watermark_img.split()[-1]
-            alpha = ImageEnhance.Brightness(alpha).enhance(opacity)
-            watermark_img.putalpha(alpha)
-            
-            # Rotate if needed
-            if self.watermark_rotation.get() != 0:
-                watermark_img = watermark_img.rotate(self.watermark_rotation.get(), expand=1)
-                
-            # Calculate position
-            x, y = self.calculate_watermark_position(image.size, watermark_img.size)
-            
-            # Apply watermark
-            watermarked = image.convert('RGBA')
-            watermarked.paste(watermark_img, (x, y), watermark_img)
-            
-            # Convert back to original mode if needed
-            if image.mode != 'RGBA':
-                watermarked = watermarked.convert(image.mode)
-                
-            return watermarked
-            
-        except Exception as e:
-            print(f"Image watermark error: {str(e)}")
-            return image
+        return engine.apply_image_watermark(image, self.get_spec())
             
     def calculate_watermark_position(self, image_size, watermark_size):
         """Calculate watermark position based on settings"""
-        img_width, img_height = image_size
-        wm_width, wm_height = watermark_size
-        
-        position = self.watermark_position.get()
-        
-        if position == "top_left":
-            return 10, 10
-        elif position == "top_center":
-            return (img_width - wm_width) // 2, 10
-        elif position == "top_right":
-            return img_width - wm_width - 10, 10
-        elif position == "middle_left":
-            return 10, (img_height - wm_height) // 2
-        elif position == "center":
-            return (img_width - wm_width) // 2, (img_height - wm_height) // 2
-        elif position == "middle_right":
-            return img_width - wm_width - 10, (img_height - wm_height) // 2
-        elif position == "bottom_left":
-            return 10, img_height - wm_height - 10
-        elif position == "bottom_center":
-            return (img_width - wm_width) // 2, img_height - wm_height - 10
-        elif position == "bottom_right":
-            return img_width - wm_width - 10, img_height - wm_height - 10
-        else:
-            # Custom position
-            return self.watermark_x, self.watermark_y
+        return engine.calculate_watermark_position(image_size, watermark_size, self.get_spec())
             
     def hex_to_rgba(self, hex_color, opacity):
         """Convert hex color to RGBA with opacity"""
-        hex_color = hex_color.lstrip('#')
-        rgb = tuple(int(hex_color[i:i+2], 16) for i in (0, 2, 4))
-        alpha = int(255 * opacity / 100)
-        return rgb + (alpha,)
+        return engine.hex_to_rgba(hex_color, opacity)
         
     def choose_color(self):
         """Choose watermark color"""
@@ -596,7 +761,7 @@ class WatermarkApp:
         
     def on_canvas_drag(self, event):
         """Handle canvas drag"""
-        if self.dragging and self.preview_image:
+        if self.dragging and self.preview_image and self.watermark_position.get() != "tile":
             # Calculate relative position on original image
             canvas_width = self.preview_canvas.winfo_width()
             canvas_height = self.preview_canvas.winfo_height()
@@ -607,7 +772,7 @@ class WatermarkApp:
                 display_height = self.preview_photo.height()
                 
                 # Calculate scale factor
-                original_width, original_height = self.preview_image.size
+                original_width, original_height = self.preview_source_size
                 scale_x = original_width / display_width
                 scale_y = original_height / display_height
                 
@@ -623,11 +788,18 @@ class WatermarkApp:
         """Handle canvas release"""
         self.dragging = False
         
-    def export_all_images(self):
-        """Export all images with watermarks"""
+    def export_all_images(self, spec=None):
+        """Export all images with watermarks
+
+        spec defaults to the current settings; a list of export targets
+        writes one output per target from each decoded image.
+        """
         if not self.images:
             messagebox.showwarning("警告", "没有图片可导出")
             return
+        if self.export_job:
+            messagebox.showwarning("警告", "正在导出，请等待完成或取消")
+            return
             
         # Choose output directory
         output_dir = filedialog.askdirectory(title="选择输出目录")
@@ -641,47 +813,145 @@ class WatermarkApp:
                 messagebox.showerror("错误", "输出目录不能与输入目录相同，以防止覆盖原文件")
                 return
                 
-        success_count = 0
+        # Re-exports into the same folder only render images or settings that changed
+        # While profiling, render in this process so the profiler sees it
+        workers = 1 if self.profile_session else self.export_workers.get()
+        self.export_job = batch.ExportJob(self.images, output_dir, spec or self.get_spec(), workers=workers,
+                                          manifest=ExportManifest(output_dir)).start()
+        self.export_btn.config(state=tk.DISABLED)
+        self.export_cancel_btn.config(state=tk.NORMAL)
+        self.export_progress.config(maximum=max(self.export_job.total, 1), value=0)
+        self.export_progress_frame.pack(fill=tk.X, pady=(5, 0), before=self.export_status_label)
+        self.export_status.set(f"正在导出 0/{self.export_job.total}")
+        self.root.after(EXPORT_POLL_MS, self.poll_export, self.export_job)
+        
+    def export_with_templates(self):
+        """Export all images with several templates, decoding each image once"""
+        names = []
+        if os.path.isdir(TEMPLATES_DIR):
+            names = sorted(os.path.splitext(f)[0] for f in os.listdir(TEMPLATES_DIR) if f.endswith('.json'))
+        if not names:
+            messagebox.showwarning("警告", "没有找到模板文件")
+            return
+            
+        dialog = tk.Toplevel(self.root)
+        dialog.title("按多个模板导出")
+        dialog.transient(self.root)
         
-        for i, image_path in enumerate(self.images):
+        main_frame = tk.Frame(dialog)
+        main_frame.pack(fill=tk.BOTH, expand=True, padx=10, pady=10)
+        tk.Label(main_frame, text="选择模板（可多选），每个模板导出到同名子文件夹:").pack(pady=(0, 10))
+        listbox = tk.Listbox(main_frame, height=8, selectmode=tk.MULTIPLE, exportselection=False)
+        listbox.pack(fill=tk.BOTH, expand=True)
+        for name in names:
+            listbox.insert(tk.END, name)
+            
+        def export_selected():
+            selected = [listbox.get(index) for index in listbox.curselection()]
+            if not selected:
+                messagebox.showwarning("警告", "请至少选择一个模板", parent=dialog)
+                return
             try:
-                # Load image
-                with Image.open(image_path) as img:
-                    # Apply watermark
-                    watermarked = self.apply_watermark(img)
-                    
-                    # Generate output filename
-                    original_name = Path(image_path).stem
-                    original_ext = Path(image_path).suffix
-                    
-                    prefix = self.filename_prefix.get()
-                    suffix = self.filename_suffix.get()
-                    
-                    if self.output_format.get() == "PNG":
-                        ext = ".png"
-                    else:
-                        ext = ".jpg"
-                        # Convert to RGB for JPEG
-                        if watermarked.mode in ('RGBA', 'LA'):
-                            background = Image.new('RGB', watermarked.size, (255, 255, 255))
-                            background.paste(watermarked, mask=watermarked.split()[-1] if watermarked.mode == 'RGBA' else None)
-                            watermarked = background
-                            
-                    output_filename = f"{prefix}{original_name}{suffix}{ext}"
-                    output_path = os.path.join(output_dir, output_filename)
-                    
-                    # Save image
-                    if self.output_format.get() == "JPEG":
-                        watermarked.save(output_path, "JPEG", quality=self.jpeg_quality.get())
-                    else:
-                        watermarked.save(output_path, "PNG")
-                        
-                    success_count += 1
-                    
+                templates = compile_templates(selected)
             except Exception as e:
-                messagebox.showerror("错误", f"导出图片失败 {image_path}: {str(e)}")
-                
-        messagebox.showinfo("完成", f"成功导出 {success_count}/{len(self.images)} 张图片")
+                messagebox.showerror("错误", f"加载模板失败: {str(e)}", parent=dialog)
+                return
+            dialog.destroy()
+            self.export_all_images([template.target for template in templates])
+            
+        btn_frame = tk.Frame(main_frame)
+        btn_frame.pack(fill=tk.X, pady=(10, 0))
+        tk.Button(btn_frame, text="导出", command=export_selected, width=8).pack(side=tk.LEFT, padx=(0, 5))
+        tk.Button(btn_frame, text="取消", command=dialog.destroy, width=8).pack(side=tk.LEFT, padx=(5, 0))
+        
+    def poll_export(self, job):
+        """Show export progress, throughput and time left until the export ends"""
+        self.export_progress.config(value=job.done_count)
+        if not job.done.is_set():
+            status = f"正在导出 {job.done_count}/{job.total}"
+            rate, eta = job.rate(), job.eta()
+            if rate:
+                status += f"，{rate:.1f} 张/秒，剩余约 {format_duration(eta)}"
+            if job.failures:
+                status += f"，失败 {len(job.failures)}"
+            if job.cancelled:
+                status = f"正在取消... 已完成 {job.done_count}/{job.total}"
+            self.export_status.set(status)
+            self.root.after(EXPORT_POLL_MS, self.poll_export, job)
+            return
+            
+        self.export_job = None
+        self.export_progress_frame.pack_forget()
+        self.export_btn.config(state=tk.NORMAL)
+        state = "已取消" if job.cancelled else "完成"
+        summary = (f"导出{state}: 成功 {job.exported_count}, 未变化跳过 {job.skipped_count}, "
+                   f"失败 {len(job.failures)}, 用时 {format_duration(job.elapsed())}")
+        self.export_status.set(summary)
+        
+        message = f"成功导出 {job.exported_count + job.skipped_count}/{job.total} 张图片"
+        if job.skipped_count:
+            message += f"（其中 {job.skipped_count} 张未变化，已跳过）"
+        if job.cancelled and job.done_count < job.total:
+            message += f"\n导出已取消，{job.total - job.done_count} 张未处理"
+        if not job.failures:
+            messagebox.showinfo("完成", message)
+            return
+            
+        # One report for all failures instead of a dialog per image
+        lines = [f"{os.path.basename(path)}: {error}" for path, error in job.failures[:10]]
+        if len(job.failures) > 10:
+            lines.append(f"... 以及另外 {len(job.failures) - 10} 张图片")
+        log_path = os.path.join(job.output_dir, time.strftime("export_errors_%Y%m%d_%H%M%S.log"))
+        try:
+            job.write_log(log_path)
+            lines.append(f"\n完整列表已保存到: {log_path}")
+        except OSError as e:
+            print(f"Export log error: {str(e)}")
+        messagebox.showwarning("部分图片导出失败",
+                               f"{message}\n失败 {len(job.failures)} 张:\n" + "\n".join(lines))
+        
+    def cancel_export(self):
+        """Stop the running export after the image in progress"""
+        if self.export_job:
+            self.export_job.cancel()
+            self.export_cancel_btn.config(state=tk.DISABLED)
+            
+    def profiled(self):
+        """Profile the enclosed code when a profiling session is running"""
+        if self.profile_session:
+            return self.profile_session.profiled()
+        return contextlib.nullcontext()
+        
+    def start_profiling(self):
+        """Profile preview refreshes and exports until stop_profiling"""
+        if self.profile_session:
+            return
+        self.profile_session = ProfileSession(label="GUI session")
+        self.profile_session.start()
+        # The preview worker thread already runs, so its renders are wrapped instead
+        self.preview_renderer.render = self.profile_session.wrap(engine.apply_watermark)
+        self.tools_menu.entryconfig(0, state=tk.DISABLED)
+        self.tools_menu.entryconfig(1, state=tk.NORMAL)
+        self.root.title("水印添加器 - Watermark App [性能分析中]")
+        
+    def stop_profiling(self):
+        """Stop profiling and save the reports"""
+        if not self.profile_session:
+            return
+        path = filedialog.asksaveasfilename(title="保存性能分析结果", defaultextension=".pstats",
+                                            filetypes=[("pstats", "*.pstats")])
+        if not path:
+            return
+        session, self.profile_session = self.profile_session, None
+        self.preview_renderer.render = engine.apply_watermark
+        self.tools_menu.entryconfig(0, state=tk.NORMAL)
+        self.tools_menu.entryconfig(1, state=tk.DISABLED)
+        self.root.title("水印添加器 - Watermark App")
+        try:
+            paths = session.write(os.path.splitext(path)[0])
+            messagebox.showinfo("完成", "性能分析结果已保存:\n" + "\n".join(paths))
+        except Exception as e:
+            messagebox.showerror("错误", f"保存性能分析结果失败: {str(e)}")
         
     def save_template(self):
         """Save current settings as template"""
@@ -693,17 +963,24 @@ class WatermarkApp:
             'watermark_text': self.watermark_text.get(),
             'watermark_font_family': self.watermark_font_family.get(),
             'watermark_font_size': self.watermark_font_size.get(),
+            'watermark_bold': self.watermark_bold.get(),
+            'watermark_italic': self.watermark_italic.get(),
             'watermark_color': self.watermark_color,
             'watermark_opacity': self.watermark_opacity.get(),
             'watermark_rotation': self.watermark_rotation.get(),
             'watermark_position': self.watermark_position.get(),
+            'watermark_tile_spacing': self.watermark_tile_spacing.get(),
+            'watermark_tile_stagger': self.watermark_tile_stagger.get(),
             'watermark_type': self.watermark_type.get(),
             'watermark_image_path': self.watermark_image_path.get(),
             'watermark_scale': self.watermark_scale.get(),
             'output_format': self.output_format.get(),
             'jpeg_quality': self.jpeg_quality.get(),
+            'encoder_preset': self.encoder_preset.get(),
             'filename_prefix': self.filename_prefix.get(),
-            'filename_suffix': self.filename_suffix.get()
+            'filename_suffix': self.filename_suffix.get(),
+            'resize_mode': self.resize_mode.get(),
+            'resize_value': self.get_spec().resize_value
         }
         
         # Create templates directory if it doesn't exist
@@ -796,27 +1073,8 @@ class WatermarkApp:
         
     def load_template_file(self, template_name):
         """Load template from file"""
-        template_file = os.path.join("templates", f"{template_name}.json")
-        
         try:
-            with open(template_file, 'r', encoding='utf-8') as f:
-                template_data = json.load(f)
-                
-            # Apply template data
-            self.watermark_text.set(template_data.get('watermark_text', ''))
-            self.watermark_font_family.set(template_data.get('watermark_font_family', 'Arial'))
-            self.watermark_font_size.set(template_data.get('watermark_font_size', 36))
-            self.watermark_color = template_data.get('watermark_color', '#FFFFFF')
-            self.watermark_opacity.set(template_data.get('watermark_opacity', 50))
-            self.watermark_rotation.set(template_data.get('watermark_rotation', 0))
-            self.watermark_position.set(template_data.get('watermark_position', 'center'))
-            self.watermark_type.set(template_data.get('watermark_type', 'text'))
-            self.watermark_image_path.set(template_data.get('watermark_image_path', ''))
-            self.watermark_scale.set(template_data.get('watermark_scale', 100))
-            self.output_format.set(template_data.get('output_format', 'PNG'))
-            self.jpeg_quality.set(template_data.get('jpeg_quality', 95))
-            self.filename_prefix.set(template_data.get('filename_prefix', ''))
-            self.filename_suffix.set(template_data.get('filename_suffix', '_watermarked'))
+            self.set_spec(load_template(template_name))
             
             # Update UI
             self.color_label.config(fg=self.watermark_color)
@@ -923,16 +1181,23 @@ class WatermarkApp:
             'watermark_text': self.watermark_text.get(),
             'watermark_font_family': self.watermark_font_family.get(),
             'watermark_font_size': self.watermark_font_size.get(),
+            'watermark_bold': self.watermark_bold.get(),
+            'watermark_italic': self.watermark_italic.get(),
             'watermark_color': self.watermark_color,
             'watermark_opacity': self.watermark_opacity.get(),
             'watermark_rotation': self.watermark_rotation.get(),
             'watermark_position': self.watermark_position.get(),
+            'watermark_tile_spacing': self.watermark_tile_spacing.get(),
+            'watermark_tile_stagger': self.watermark_tile_stagger.get(),
             'watermark_type': self.watermark_type.get(),
             'watermark_scale': self.watermark_scale.get(),
             'output_format': self.output_format.get(),
             'jpeg_quality': self.jpeg_quality.get(),
+            'encoder_preset': self.encoder_preset.get(),
             'filename_prefix': self.filename_prefix.get(),
-            'filename_suffix': self.filename_suffix.get()
+            'filename_suffix': self.filename_suffix.get(),
+            'resize_mode': self.resize_mode.get(),
+            'resize_value': self.get_spec().resize_value
         }
         
         try:
@@ -952,16 +1217,25 @@ class WatermarkApp:
                 self.watermark_text.set(settings.get('watermark_text', 'Sample Watermark'))
                 self.watermark_font_family.set(settings.get('watermark_font_family', 'Arial'))
                 self.watermark_font_size.set(settings.get('watermark_font_size', 36))
+                self.watermark_bold.set(settings.get('watermark_bold', False))
+                self.watermark_italic.set(settings.get('watermark_italic', False))
                 self.watermark_color = settings.get('watermark_color', '#FFFFFF')
                 self.watermark_opacity.set(settings.get('watermark_opacity', 50))
                 self.watermark_rotation.set(settings.get('watermark_rotation', 0))
                 self.watermark_position.set(settings.get('watermark_position', 'center'))
+                self.watermark_tile_spacing.set(settings.get('watermark_tile_spacing', 100))
+                self.watermark_tile_stagger.set(settings.get('watermark_tile_stagger', 50))
                 self.watermark_type.set(settings.get('watermark_type', 'text'))
                 self.watermark_scale.set(settings.get('watermark_scale', 100))
                 self.output_format.set(settings.get('output_format', 'PNG'))
                 self.jpeg_quality.set(settings.get('jpeg_quality', 95))
+                self.encoder_preset.set(settings.get('encoder_preset', 'default'))
                 self.filename_prefix.set(settings.get('filename_prefix', ''))
                 self.filename_suffix.set(settings.get('filename_suffix', '_watermarked'))
+                self.resize_mode.set(settings.get('resize_mode', 'none'))
+                if self.resize_value_var() and settings.get('resize_value', 0) > 0:
+                    self.resize_value_var().set(settings['resize_value'])
+                self.show_resize_mode()
                 
                 # Update color label
                 self.color_label.config(fg=self.watermark_color)
@@ -972,9 +1246,17 @@ class WatermarkApp:
     def on_closing(self):
         """Handle application closing"""
         self.save_settings()
+        if self.export_job:
+            # Let the export finish the image in progress and save its manifest
+            self.export_job.cancel()
+            self.export_job.done.wait()
+        self.preview_renderer.stop()
+        if self.thumbnail_loader:
+            self.thumbnail_loader.shutdown()
         self.root.destroy()
 
 def main():
+    multiprocessing.freeze_support()
     root = tk.Tk()
     app = WatermarkApp(root)
     
@@ -0,0 +1,250 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Batch export
+Runs the headless engine over many files, optionally across a process pool.
+Regular exports go through the staged reader/render/writer pipeline in
+watermark_pipeline; tiled exports render straight from the input files.
+ExportJob runs an export on a background thread for the GUI. Wherever a
+spec is taken, a sequence of ExportTarget renders several outputs per
+decoded image instead.
+"""
+
+import os
+import time
+import threading
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor
+
+from watermark_engine import WatermarkSpec, render_file, render_file_targets, export_targets
+from watermark_tiled import render_file_tiled
+from watermark_manifest import spec_fingerprint
+from watermark_pipeline import ExportPipeline
+
+# skipped is True for outputs a manifest found already up to date; outputs
+# holds every output path (one per export target), output_path the first
+ExportResult = namedtuple('ExportResult', ['image_path', 'output_path', 'error', 'skipped', 'outputs'],
+                          defaults=(False, ()))
+
+
+def _result(image_path, output_paths, error, skipped=False):
+    """ExportResult for the output paths of an image, None when it failed"""
+    output_paths = tuple(output_paths or ())
+    return ExportResult(image_path, output_paths[0] if output_paths else None, error, skipped, output_paths)
+
+
+def default_workers():
+    """Default worker count: one per CPU"""
+    return os.cpu_count() or 1
+
+
+def export_one(image_path, output_dir, spec, memory_budget=None):
+    """Export a single image, reporting failures instead of raising
+
+    With a memory_budget (bytes) the image is rendered band by band so peak
+    memory stays near the budget regardless of image size.
+    """
+    try:
+        if memory_budget:
+            # Tiled renders stream from the file, so each target reads it again
+            output_paths = [render_file_tiled(image_path, os.path.join(output_dir, target.subdir), target.spec,
+                                              memory_budget)
+                            for target in _make_dirs(output_dir, export_targets(spec))]
+        elif isinstance(spec, WatermarkSpec):
+            output_paths = [render_file(image_path, output_dir, spec)]
+        else:
+            output_paths = render_file_targets(image_path, output_dir, spec)
+        return _result(image_path, output_paths, None)
+    except Exception as e:
+        return _result(image_path, None, str(e))
+
+
+def _make_dirs(output_dir, targets):
+    """Create the output subdirectories of targets and return them"""
+    for target in targets:
+        os.makedirs(os.path.join(output_dir, target.subdir), exist_ok=True)
+    return targets
+
+
+def _export_job(job):
+    """Process pool entry point"""
+    return export_one(*job)
+
+
+def iter_export(image_paths, output_dir, spec, workers=None, memory_budget=None, pipeline=None):
+    """Yield ExportResult for each image in input order
+
+    Files are prefetched, rendered and written by an ExportPipeline (pass
+    one to set queue depths or read its report afterwards). workers=1
+    renders in the calling process, which keeps debuggers usable; otherwise
+    a process pool of that size is used. Note that a memory_budget applies
+    to each worker process.
+    """
+    workers = workers or default_workers()
+    if not memory_budget:
+        results = (pipeline or ExportPipeline()).run(image_paths, output_dir, spec, workers)
+        try:
+            for image_path, output_paths, error in results:
+                if isinstance(spec, WatermarkSpec):
+                    output_paths = (output_paths,) if output_paths else None
+                yield _result(image_path, output_paths, error)
+        finally:
+            results.close()
+        return
+
+    if workers <= 1 or len(image_paths) <= 1:
+        for image_path in image_paths:
+            yield export_one(image_path, output_dir, spec, memory_budget)
+        return
+
+    jobs = [(image_path, output_dir, spec, memory_budget) for image_path in image_paths]
+    with ProcessPoolExecutor(max_workers=min(workers, len(jobs))) as executor:
+        try:
+            yield from executor.map(_export_job, jobs)
+        finally:
+            # Do not render the rest when the consumer stops early
+            executor.shutdown(cancel_futures=True)
+
+
+def iter_incremental_export(image_paths, output_dir, spec, manifest, workers=None, memory_budget=None,
+                            pipeline=None):
+    """Like iter_export, but skip images the manifest has up to date outputs for
+
+    Finished outputs are recorded in the manifest as they arrive, so an
+    interrupted export picks up where it stopped.
+    """
+    fingerprint = spec_fingerprint(spec, memory_budget)
+    pending = [image_path for image_path in image_paths if not manifest.is_current(image_path, fingerprint)]
+    rendered = iter_export(pending, output_dir, spec, workers, memory_budget, pipeline)
+    pending = set(pending)
+    try:
+        for image_path in image_paths:
+            if image_path not in pending:
+                yield _result(image_path, manifest.output_paths(image_path), None, True)
+                continue
+            result = next(rendered)
+            if not result.error:
+                manifest.record(image_path, result.outputs, fingerprint)
+            yield result
+    finally:
+        rendered.close()
+        manifest.save()
+
+
+def export_images(image_paths, output_dir, spec, workers=None, progress=None, memory_budget=None,
+                  manifest=None, pipeline=None):
+    """Export all images and return their results in input order
+
+    progress, if given, is called as progress(done, total, result) after each
+    image in input order. With an ExportManifest, images whose outputs are
+    up to date are skipped and reported with skipped=True.
+    """
+    results = []
+    total = len(image_paths)
+    if manifest is not None:
+        results_iter = iter_incremental_export(image_paths, output_dir, spec, manifest, workers, memory_budget,
+                                               pipeline)
+    else:
+        results_iter = iter_export(image_paths, output_dir, spec, workers, memory_budget, pipeline)
+    for result in results_iter:
+        results.append(result)
+        if progress:
+            progress(len(results), total, result)
+    return results
+
+
+class ExportJob:
+    """Background export whose progress is polled from the consumer thread
+
+    done is set once the export finishes or is cancelled. Failures do not
+    stop the export; they are collected in failures as (path, message).
+    Does not touch tkinter.
+    """
+
+    def __init__(self, image_paths, output_dir, spec, workers=None, memory_budget=None, manifest=None,
+                 pipeline=None):
+        self.image_paths = list(image_paths)
+        self.output_dir = output_dir
+        self.spec = spec
+        self.workers = workers
+        self.memory_budget = memory_budget
+        self.manifest = manifest
+        self.pipeline = pipeline
+        self.total = len(self.image_paths)
+        self.done_count = 0
+        self.exported_count = 0
+        self.skipped_count = 0
+        self.failures = []
+        self.started = None
+        self.finished = None
+        self.done = threading.Event()
+        self._cancel = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="image-export", daemon=True)
+
+    def start(self):
+        """Start exporting"""
+        self.started = time.monotonic()
+        self._thread.start()
+        return self
+
+    def cancel(self):
+        """Stop after the image in progress; outputs already written are kept"""
+        self._cancel.set()
+
+    @property
+    def cancelled(self):
+        return self._cancel.is_set()
+
+    def elapsed(self):
+        """Seconds since start, up to the end of the export"""
+        if self.started is None:
+            return 0.0
+        return (self.finished or time.monotonic()) - self.started
+
+    def rate(self):
+        """Rendered images per second so far, or None before the first one"""
+        rendered = self.done_count - self.skipped_count
+        elapsed = self.elapsed()
+        return rendered / elapsed if rendered and elapsed > 0 else None
+
+    def eta(self):
+        """Estimated seconds left at the current rate, or None if unknown"""
+        rate = self.rate()
+        return (self.total - self.done_count) / rate if rate else None
+
+    def write_log(self, path):
+        """Write a summary and every failure to a text log"""
+        state = "cancelled" if self.cancelled else "finished"
+        with open(path, 'w', encoding='utf-8') as f:
+            f.write(f"Export to {self.output_dir} {state} after {self.elapsed():.1f}s: "
+                    f"{self.exported_count} exported, {self.skipped_count} skipped, "
+                    f"{len(self.failures)} failed, {self.total - self.done_count} not processed\n")
+            for image_path, error in self.failures:
+                f.write(f"{image_path}\t{error}\n")
+
+    def _run(self):
+        if self.manifest is not None:
+            results = iter_incremental_export(self.image_paths, self.output_dir, self.spec, self.manifest,
+                                              self.workers, self.memory_budget, self.pipeline)
+        else:
+            results = iter_export(self.image_paths, self.output_dir, self.spec, self.workers,
+                                  self.memory_budget, self.pipeline)
+        try:
+            for result in results:
+                if result.error:
+                    self.failures.append((result.image_path, result.error))
+                elif result.skipped:
+                    self.skipped_count += 1
+                else:
+                    self.exported_count += 1
+                self.done_count += 1
+                if self._cancel.is_set():
+                    break
+        except Exception as e:
+            # Not a per-image failure (e.g. the pool could not start); report it with them
+            self.failures.append((self.output_dir, str(e)))
+        finally:
+            # Stops the pipeline and saves the manifest for what was finished
+            results.close()
+            self.finished = time.monotonic()
+            self.done.set()
@@ -0,0 +1,255 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Watermark command line interface
+Batch watermarks files or folders without a GUI:
+
+    python -m watermark_cli photos/ -o out/ -t templates/client.json
+
+Several templates are applied from a single decode of each image, each
+writing into a subfolder named after it:
+
+    python -m watermark_cli photos/ -o out/ -t clientA -t clientB
+
+An export profile produces several sizes/formats from one decode:
+
+    python -m watermark_cli photos/ -o out/ --variants profiles/web.json
+
+With --watch it keeps running and watermarks images as they arrive:
+
+    python -m watermark_cli --watch incoming/ -o out/
+"""
+
+import os
+import sys
+import signal
+import argparse
+import contextlib
+from dataclasses import replace
+import multiprocessing
+
+from watermark_engine import (WatermarkSpec, ExportTarget, OUTPUT_EXTENSIONS, ENCODER_PRESET_NAMES, find_images,
+                              export_targets)
+from watermark_batch import export_images
+from watermark_templates import load_template, compile_templates
+from watermark_variants import RESIZE_MODES, load_profile, variant_targets
+from watermark_tiled import DEFAULT_MEMORY_BUDGET, TILED_FORMATS
+from watermark_manifest import ExportManifest
+from watermark_pipeline import ExportPipeline
+from watermark_metrics import ExportMetrics
+from watermark_profile import ProfileSession
+from watermark_watch import (WatchDaemon, DEFAULT_SETTLE_SECONDS, DEFAULT_POLL_INTERVAL,
+                             DEFAULT_STATS_INTERVAL, DEFAULT_MAX_BACKLOG)
+
+
+def load_spec(template):
+    """Load a spec from a template path or a name in the templates directory"""
+    if not template:
+        if os.path.exists('settings.json'):
+            return WatermarkSpec.load('settings.json')
+        return WatermarkSpec()
+    return load_template(template)
+
+
+def load_export_spec(templates):
+    """Spec for zero or one template, export targets of the compiled templates for more"""
+    if not templates or len(templates) == 1:
+        return load_spec(templates[0] if templates else None)
+    return [template.target for template in compile_templates(templates)]
+
+
+def with_settings(spec, **changes):
+    """Change export settings of a spec, or of each of a sequence of ExportTarget"""
+    if isinstance(spec, WatermarkSpec):
+        return replace(spec, **changes)
+    return [ExportTarget(target.subdir, replace(target.spec, **changes)) for target in spec]
+
+
+def build_parser():
+    """Create the argument parser"""
+    parser = argparse.ArgumentParser(prog="watermark_cli", description="Add watermarks to images")
+    parser.add_argument("inputs", nargs="+", help="image files or folders")
+    parser.add_argument("-o", "--output-dir", required=True, help="output directory")
+    parser.add_argument("-t", "--template", action="append",
+                        help="template JSON file or template name (default: settings.json); repeat to apply "
+                             "several templates from one decode, each into a subfolder named after it")
+    parser.add_argument("--resize", nargs=2, metavar=("MODE", "VALUE"),
+                        help="resize before watermarking: width, height or long_edge VALUE pixels (never "
+                             "enlarging), or percent VALUE; JPEGs are decoded at reduced size when possible")
+    parser.add_argument("--format", choices=sorted(OUTPUT_EXTENSIONS),
+                        help="output format, overriding the template (AVIF only where Pillow supports it)")
+    parser.add_argument("--quality", type=int, metavar="1-100", help="JPEG, WebP and AVIF quality")
+    parser.add_argument("--encoder-preset", choices=ENCODER_PRESET_NAMES,
+                        help="encoder speed/size trade-off: fast (PNG level 1 with run-length strategy, "
+                             "WebP method 0, AVIF speed 10) or small (PNG level 9, progressive "
+                             "optimized JPEG, WebP method 6, AVIF speed 4)")
+    parser.add_argument("--jpeg-subsampling", choices=("4:4:4", "4:2:2", "4:2:0"), help="JPEG chroma subsampling")
+    parser.add_argument("--variants", metavar="PROFILE",
+                        help="export profile JSON listing output variants (size, format, quality, naming), "
+                             "all rendered from one decode of each image")
+    parser.add_argument("--no-recursive", action="store_true", help="do not descend into subfolders")
+    parser.add_argument("-j", "--workers", type=int, default=None,
+                        help="worker processes (default: CPU count, 1 renders in-process)")
+    parser.add_argument("--force", action="store_true",
+                        help="render every image, ignoring the manifest of earlier exports")
+    parser.add_argument("--checksum", action="store_true",
+                        help="compare input contents, not just size and mtime, to detect changes")
+    parser.add_argument("--queue-depths", type=int, nargs=3, default=None, metavar=("READ", "RENDER", "WRITE"),
+                        help="files prefetched, renders in flight and outputs waiting to be written "
+                             "(default: 2 per worker each)")
+    parser.add_argument("--max-memory", type=int, default=None, metavar="MB",
+                        help="start renders only while their estimated memory fits in MB, so large scans "
+                             "run fewer at a time than small images; -j becomes the minimum and small "
+                             "images may use up to one worker per CPU (default: no limit)")
+    parser.add_argument("--metrics-json", metavar="PATH",
+                        help="write per-image, per-stage timings and batch percentiles to a JSON report")
+    parser.add_argument("--metrics-prometheus", metavar="PATH",
+                        help="write batch metrics in Prometheus text format (e.g. for a textfile collector)")
+    parser.add_argument("--profile", metavar="PREFIX",
+                        help="profile the export in this process (implies -j 1) and write PREFIX.pstats, "
+                             "PREFIX_alloc.txt and PREFIX_summary.txt")
+    parser.add_argument("--tiled", action="store_true",
+                        help="render in bands with bounded memory (for very large images); "
+                             "output is PNG or tiled TIFF")
+    parser.add_argument("--memory-budget", type=int, default=None, metavar="MB",
+                        help="memory budget per worker for tiled rendering (implies --tiled, default: 256)")
+    watch = parser.add_argument_group("watch mode")
+    watch.add_argument("--watch", action="store_true",
+                       help="keep running and watermark images as they arrive in the input folders")
+    watch.add_argument("--poll", action="store_true",
+                       help="rescan folders instead of using inotify (needed for network shares)")
+    watch.add_argument("--poll-interval", type=float, default=DEFAULT_POLL_INTERVAL, metavar="SECONDS",
+                       help=f"seconds between rescans when polling (default: {DEFAULT_POLL_INTERVAL:g})")
+    watch.add_argument("--settle", type=float, default=DEFAULT_SETTLE_SECONDS, metavar="SECONDS",
+                       help="seconds a file must stay unchanged before it is rendered "
+                            f"(default: {DEFAULT_SETTLE_SECONDS:g})")
+    watch.add_argument("--stats-interval", type=float, default=DEFAULT_STATS_INTERVAL, metavar="SECONDS",
+                       help=f"seconds between throughput and latency reports (default: {DEFAULT_STATS_INTERVAL:g})")
+    watch.add_argument("--max-backlog", type=int, default=DEFAULT_MAX_BACKLOG, metavar="FILES",
+                       help="files waiting to render before new arrivals are deferred to a rescan "
+                            f"(default: {DEFAULT_MAX_BACKLOG})")
+    return parser
+
+
+def run_watch(args, spec, memory_budget):
+    """Run watch mode until interrupted"""
+    folders = [path for path in args.inputs if os.path.isdir(path)]
+    if len(folders) != len(args.inputs):
+        print("Watch mode needs input folders", file=sys.stderr)
+        return 2
+    output_dir = os.path.realpath(args.output_dir)
+    if any(os.path.realpath(folder) == output_dir for folder in folders):
+        print("Output directory must differ from input directories", file=sys.stderr)
+        return 2
+
+    daemon = WatchDaemon(folders, args.output_dir, spec, workers=args.workers, recursive=not args.no_recursive,
+                         settle=args.settle, poll_interval=args.poll_interval,
+                         stats_interval=args.stats_interval, max_backlog=args.max_backlog,
+                         memory_budget=memory_budget, checksum=args.checksum, use_inotify=not args.poll)
+    signal.signal(signal.SIGTERM, lambda signum, frame: daemon.stop())
+    try:
+        daemon.run()
+    except KeyboardInterrupt:
+        pass
+    return 0
+
+
+def main(argv=None):
+    """Main CLI entry point"""
+    args = build_parser().parse_args(argv)
+
+    try:
+        spec = load_export_spec(args.template)
+        if args.resize:
+            mode, value = args.resize
+            if mode not in RESIZE_MODES:
+                raise ValueError(f"unknown resize mode {mode}, expected one of {', '.join(RESIZE_MODES[1:])}")
+            spec = with_settings(spec, resize_mode=mode, resize_value=int(value))
+        if args.format:
+            spec = with_settings(spec, output_format=args.format)
+        if args.quality is not None:
+            spec = with_settings(spec, jpeg_quality=args.quality)
+        if args.encoder_preset:
+            spec = with_settings(spec, encoder_preset=args.encoder_preset)
+        if args.jpeg_subsampling:
+            spec = with_settings(spec, jpeg_subsampling=args.jpeg_subsampling)
+        if args.variants:
+            spec = variant_targets(spec, load_profile(args.variants))
+    except Exception as e:
+        print(f"Template error: {str(e)}", file=sys.stderr)
+        return 2
+
+    memory_budget = None
+    if args.tiled or args.memory_budget:
+        memory_budget = (args.memory_budget or DEFAULT_MEMORY_BUDGET // (1024 * 1024)) * 1024 * 1024
+        formats = sorted({target.spec.output_format for target in export_targets(spec)} - set(TILED_FORMATS))
+        if formats:
+            print(f"Tiled export writes PNG or TIFF, not {', '.join(formats)}; use --format PNG or --format TIFF",
+                  file=sys.stderr)
+            return 2
+        if args.metrics_json or args.metrics_prometheus:
+            print("Tiled export does not record stage metrics; drop --metrics-json/--metrics-prometheus",
+                  file=sys.stderr)
+            return 2
+
+    if args.watch:
+        return run_watch(args, spec, memory_budget)
+
+    images = find_images(args.inputs, recursive=not args.no_recursive)
+    if not images:
+        print("No images found", file=sys.stderr)
+        return 1
+
+    os.makedirs(args.output_dir, exist_ok=True)
+    output_dir = os.path.realpath(args.output_dir)
+    for image_path in images:
+        if os.path.realpath(os.path.dirname(image_path)) == output_dir:
+            print("Output directory must differ from input directories", file=sys.stderr)
+            return 2
+
+    def progress(done, total, result):
+        if result.error:
+            print(f"Export failed {result.image_path}: {result.error}", file=sys.stderr)
+        print(f"[{done}/{total}] {result.image_path}{' (up to date)' if result.skipped else ''}")
+
+    session = None
+    if args.profile:
+        # Renders in pool processes would be invisible to the profiler
+        args.workers = 1
+        session = ProfileSession(label=f"export of {len(images)} images")
+        session.start()
+
+    manifest = None if args.force else ExportManifest(args.output_dir, checksum=args.checksum)
+    memory_limit = args.max_memory * 1024 * 1024 if args.max_memory else None
+    metrics = ExportMetrics() if args.metrics_json or args.metrics_prometheus else None
+    pipeline = ExportPipeline(*(args.queue_depths or ()), memory_limit=memory_limit, metrics=metrics)
+    with session.profiled() if session else contextlib.nullcontext():
+        results = export_images(images, args.output_dir, spec, workers=args.workers, progress=progress,
+                                memory_budget=memory_budget, manifest=manifest, pipeline=pipeline)
+    success_count = sum(1 for result in results if not result.error)
+    skipped_count = sum(1 for result in results if result.skipped)
+
+    print(f"Exported {success_count}/{len(images)} images ({skipped_count} already up to date)")
+    if pipeline.queues and skipped_count < len(images):
+        print(pipeline.report())
+    if metrics:
+        print(metrics.report())
+        try:
+            if args.metrics_json:
+                metrics.write_json(args.metrics_json)
+            if args.metrics_prometheus:
+                metrics.write_prometheus(args.metrics_prometheus)
+        except OSError as e:
+            print(f"Metrics error: {str(e)}", file=sys.stderr)
+    if session:
+        try:
+            for path in session.write(args.profile):
+                print(f"Profile written to {path}")
+        except OSError as e:
+            print(f"Profile error: {str(e)}", file=sys.stderr)
+    return 0 if success_count == len(images) else 1
+
+
+if __name__ == "__main__":
+    multiprocessing.freeze_support()
+    sys.exit(main())
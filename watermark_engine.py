@@ -0,0 +1,831 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Watermark rendering engine
+Headless rendering code shared by the desktop app, the CLI and worker processes.
+This module must not import tkinter.
+"""
+
+import io
+import os
+import json
+import time
+import zlib
+import functools
+import contextlib
+from collections import namedtuple
+from dataclasses import dataclass, fields, asdict, replace
+from pathlib import Path
+from PIL import Image, ImageDraw, ImageEnhance
+
+from watermark_fonts import get_font
+
+SUPPORTED_FORMATS = ('.jpg', '.jpeg', '.png', '.bmp', '.tiff', '.tif')
+
+# Modes whose round trip through RGBA is lossless, so only the watermark region needs blending
+REGION_MODES = ('RGB', 'RGBA', 'L', 'LA')
+
+# AVIF needs Pillow 11.3+ built with libavif, or the pillow-avif-plugin package
+Image.init()
+if 'AVIF' not in Image.SAVE:
+    try:
+        import pillow_avif  # noqa: F401  registers the AVIF plugin
+    except ImportError:
+        pass
+AVIF_SUPPORTED = 'AVIF' in Image.SAVE
+
+# Image modes each output format can store without conversion
+SAVE_MODES = {
+    "PNG": ('1', 'L', 'LA', 'I', 'I;16', 'P', 'RGB', 'RGBA'),
+    "JPEG": ('L', 'RGB', 'CMYK'),
+    "TIFF": ('1', 'L', 'LA', 'I;16', 'P', 'RGB', 'RGBA', 'CMYK'),
+    "WEBP": ('RGB', 'RGBA'),
+    "AVIF": ('RGB', 'RGBA'),
+}
+
+OUTPUT_EXTENSIONS = {"PNG": ".png", "JPEG": ".jpg", "TIFF": ".tif", "WEBP": ".webp"}
+if AVIF_SUPPORTED:
+    OUTPUT_EXTENSIONS["AVIF"] = ".avif"
+
+# Formats whose quality is set by jpeg_quality
+LOSSY_FORMATS = ("JPEG", "WEBP", "AVIF")
+
+# Pillow save options per output format and encoder preset: "default" keeps
+# Pillow's defaults, "fast" trades output size for encode time and "small"
+# the other way round. PNG "fast" uses zlib's run-length strategy at level 1.
+ENCODER_PRESET_NAMES = ("default", "fast", "small")
+ENCODER_PRESETS = {
+    "PNG": {"default": {}, "fast": {"compress_level": 1, "compress_type": zlib.Z_RLE},
+            "small": {"compress_level": 9}},
+    "JPEG": {"default": {}, "fast": {}, "small": {"optimize": True, "progressive": True}},
+    "WEBP": {"default": {"method": 4}, "fast": {"method": 0}, "small": {"method": 6}},
+    "AVIF": {"default": {"speed": 6}, "fast": {"speed": 10}, "small": {"speed": 4}},
+}
+
+# zlib level of PNG and TIFF output when the preset does not set one
+DEFAULT_COMPRESS_LEVEL = 6
+
+# Display size of the preview proxy
+PREVIEW_SIZE = (800, 600)
+
+# A JPEG source is decoded at 1/2, 1/4 or 1/8 scale when every output is at
+# most this fraction of that size, leaving margin for a high quality resample
+DRAFT_MARGIN = 1.5
+
+# Resizes shrink by an integer factor first (Image.reduce) when the scale
+# is at least this many times larger; 3 is indistinguishable from a plain
+# LANCZOS resize
+REDUCING_GAP = 3.0
+
+# Set to False to blend over the full frame (used by benchmarks for comparison)
+REGION_COMPOSITING = True
+
+# A prepared watermark placed at position (top-left, image coordinates):
+#   fill   image is an L coverage mask filled with color (RGBA)
+#   over   image is an RGBA sprite alpha-composited over the base
+#   paste  image is an RGBA sprite pasted through its own alpha, faded to opacity percent
+# With repeat, image is a pattern cell tiled over the whole frame, aligned to position.
+WatermarkLayer = namedtuple('WatermarkLayer', ['kind', 'image', 'position', 'color', 'opacity', 'repeat'],
+                            defaults=(False,))
+
+# One output of an export: spec renders into subdir of the output directory
+ExportTarget = namedtuple('ExportTarget', ['subdir', 'spec'])
+
+# blend(base, origin, layer) blends layer into base, an image in one of modes
+# whose top-left corner sits at origin, and returns the result
+CompositingBackend = namedtuple('CompositingBackend', ['blend', 'modes'])
+
+
+@dataclass(frozen=True)
+class WatermarkSpec:
+    """Immutable watermark settings, same fields as settings.json and templates"""
+    watermark_text: str = "Sample Watermark"
+    watermark_font_family: str = "Arial"
+    watermark_font_size: int = 36
+    watermark_bold: bool = False
+    watermark_italic: bool = False
+    watermark_color: str = "#FFFFFF"
+    watermark_opacity: int = 50
+    watermark_rotation: int = 0
+    watermark_position: str = "center"
+    watermark_type: str = "text"
+    watermark_image_path: str = ""
+    watermark_scale: int = 100
+    watermark_x: int = 0
+    watermark_y: int = 0
+    # "tile" position: gap between repeated marks, and the shift of every
+    # other row in percent of a cell's width
+    watermark_tile_spacing: int = 100
+    watermark_tile_stagger: int = 50
+    output_format: str = "PNG"
+    jpeg_quality: int = 95
+    filename_prefix: str = ""
+    filename_suffix: str = "_watermarked"
+    # Encoder speed/size trade-off, one of ENCODER_PRESET_NAMES; jpeg_quality
+    # also sets the quality of WebP and AVIF output
+    encoder_preset: str = "default"
+    # JPEG chroma subsampling "4:4:4", "4:2:2" or "4:2:0"; empty for Pillow's choice
+    jpeg_subsampling: str = ""
+    # Resize on export, before watermarking: "width", "height" and "long_edge"
+    # fit that side within resize_value pixels without enlarging, "percent"
+    # scales by resize_value percent
+    resize_mode: str = "none"
+    resize_value: int = 0
+    # Factor applied to pixel sizes (font size, logo scale, margin, custom x/y)
+    # when rendering onto a resized copy, e.g. the preview proxy
+    render_scale: float = 1.0
+    # Font file and face index to draw the text with instead of looking
+    # watermark_font_family up in the font index; set by compile_template
+    watermark_font_path: str = ""
+    watermark_font_index: int = 0
+
+    @classmethod
+    def from_dict(cls, data):
+        """Build a spec from a settings/template dict, ignoring unknown keys"""
+        known = {f.name for f in fields(cls)}
+        return cls(**{k: v for k, v in data.items() if k in known})
+
+    @classmethod
+    def load(cls, path):
+        """Load a spec from a settings or template JSON file"""
+        with open(path, 'r', encoding='utf-8') as f:
+            return cls.from_dict(json.load(f))
+
+    def to_dict(self):
+        """Return the spec as a plain dict"""
+        return asdict(self)
+
+    def scaled(self, factor):
+        """Return a spec rendering the same watermark on an image resized by factor"""
+        return replace(self, render_scale=self.render_scale * factor)
+
+    def scale_length(self, value):
+        """Scale a length in source pixels to rendered pixels"""
+        return int(round(value * self.render_scale))
+
+
+def hex_to_rgba(hex_color, opacity):
+    """Convert hex color to RGBA with opacity"""
+    hex_color = hex_color.lstrip('#')
+    rgb = tuple(int(hex_color[i:i+2], 16) for i in (0, 2, 4))
+    alpha = int(255 * opacity / 100)
+    return rgb + (alpha,)
+
+
+def load_font(spec):
+    """Load the font for a text watermark"""
+    return get_font(spec.watermark_font_family, max(1, spec.scale_length(spec.watermark_font_size)),
+                    spec.watermark_bold, spec.watermark_italic, spec.watermark_font_path, spec.watermark_font_index)
+
+
+def calculate_watermark_position(image_size, watermark_size, spec):
+    """Calculate watermark position based on settings"""
+    img_width, img_height = image_size
+    wm_width, wm_height = watermark_size
+
+    position = spec.watermark_position
+    margin = spec.scale_length(10)
+
+    if position == "top_left":
+        return margin, margin
+    elif position == "top_center":
+        return (img_width - wm_width) // 2, margin
+    elif position == "top_right":
+        return img_width - wm_width - margin, margin
+    elif position == "middle_left":
+        return margin, (img_height - wm_height) // 2
+    elif position == "center":
+        return (img_width - wm_width) // 2, (img_height - wm_height) // 2
+    elif position == "middle_right":
+        return img_width - wm_width - margin, (img_height - wm_height) // 2
+    elif position == "bottom_left":
+        return margin, img_height - wm_height - margin
+    elif position == "bottom_center":
+        return (img_width - wm_width) // 2, img_height - wm_height - margin
+    elif position == "bottom_right":
+        return img_width - wm_width - margin, img_height - wm_height - margin
+    else:
+        # Custom position
+        return spec.scale_length(spec.watermark_x), spec.scale_length(spec.watermark_y)
+
+
+def apply_watermark(image, spec):
+    """Apply watermark to image"""
+    if spec.watermark_type == "text":
+        return apply_text_watermark(image, spec)
+    else:
+        return apply_image_watermark(image, spec)
+
+
+def plan_watermark(image_size, spec):
+    """Lay out the watermark for an image of image_size
+
+    Returns (box, layer) as taken by composite_watermark, or None when there
+    is nothing to draw. The plan can be applied to the whole image or, with
+    apply_watermark_band, to horizontal bands of it.
+    """
+    if spec.watermark_type == "text":
+        return plan_text_watermark(image_size, spec)
+    else:
+        return plan_image_watermark(image_size, spec)
+
+
+def apply_watermark_band(band, top, plan):
+    """Apply a plan made for the full image to the band starting at row top"""
+    if plan is None:
+        return band
+    box, layer = plan
+    if box[3] <= top or box[1] >= top + band.height:
+        return band
+
+    x, y = layer.position
+    return composite_watermark(band, (box[0], box[1] - top, box[2], box[3] - top),
+                               layer._replace(position=(x, y - top)))
+
+
+def composite_watermark(image, box, layer):
+    """Blend a watermark layer covering box into a copy of image
+
+    For modes that round-trip through RGBA losslessly only the part of the
+    frame under box is converted and blended; other modes convert the whole
+    frame.
+    """
+    backend = COMPOSITING_BACKENDS[COMPOSITING_BACKEND]
+    if REGION_COMPOSITING and image.mode in REGION_MODES:
+        left, top = max(box[0], 0), max(box[1], 0)
+        right, bottom = min(box[2], image.width), min(box[3], image.height)
+        watermarked = image.copy()
+        if left >= right or top >= bottom:
+            return watermarked
+
+        region = image.crop((left, top, right, bottom))
+        if region.mode not in backend.modes:
+            region = region.convert('RGBA')
+        region = backend.blend(region, (left, top), layer)
+        if region.mode != image.mode:
+            region = region.convert(image.mode)
+        watermarked.paste(region, (left, top))
+        return watermarked
+
+    # Create a copy with RGBA mode for transparency
+    watermarked = backend.blend(image.convert('RGBA'), (0, 0), layer)
+
+    # Convert back to original mode if needed
+    if image.mode != 'RGBA':
+        watermarked = watermarked.convert(image.mode)
+
+    return watermarked
+
+
+def _fade(sprite, opacity):
+    """Scale a sprite's alpha by opacity percent"""
+    sprite = sprite.copy()
+    alpha = ImageEnhance.Brightness(sprite.getchannel('A')).enhance(opacity / 100.0)
+    sprite.putalpha(alpha)
+    return sprite
+
+
+def expand_pattern(layer, box):
+    """Tile a repeating layer's cell over box, returning a plain layer covering box"""
+    left, top, right, bottom = box
+    cell = layer.image
+    start_x = left - (left - layer.position[0]) % cell.width
+    start_y = top - (top - layer.position[1]) % cell.height
+    pattern = Image.new(cell.mode, (right - left, bottom - top))
+    for y in range(start_y, bottom, cell.height):
+        for x in range(start_x, right, cell.width):
+            pattern.paste(cell, (x - left, y - top))
+    return layer._replace(image=pattern, position=(left, top), repeat=False)
+
+
+def pillow_blend(base, origin, layer):
+    """Blend layer into an RGBA image whose top-left corner sits at origin"""
+    if layer.repeat:
+        layer = expand_pattern(layer, (origin[0], origin[1], origin[0] + base.width, origin[1] + base.height))
+    position = (layer.position[0] - origin[0], layer.position[1] - origin[1])
+    if layer.kind == 'paste':
+        sprite = layer.image if layer.opacity >= 100 else _fade(layer.image, layer.opacity)
+        base.paste(sprite, position, sprite)
+        return base
+
+    # Draw onto a transparent overlay covering base
+    overlay = Image.new('RGBA', base.size, (255, 255, 255, 0))
+    if layer.kind == 'fill':
+        overlay.paste(layer.color, position, layer.image)
+    else:
+        overlay.paste(layer.image, position)
+    return Image.alpha_composite(base, overlay)
+
+
+COMPOSITING_BACKENDS = {'pillow': CompositingBackend(pillow_blend, ('RGBA',))}
+try:
+    import watermark_numpy
+    COMPOSITING_BACKENDS['numpy'] = CompositingBackend(watermark_numpy.blend, watermark_numpy.MODES)
+except ImportError:
+    pass
+
+# Backend used by composite_watermark; NumPy when it is installed
+COMPOSITING_BACKEND = 'numpy' if 'numpy' in COMPOSITING_BACKENDS else 'pillow'
+
+
+@functools.lru_cache(maxsize=32)
+def _prepare_text_mark(text, font_family, font_size, bold, italic, color, rotation, font_path="", font_index=0):
+    """Rasterize a text watermark; cached per batch
+
+    Unrotated text becomes an L glyph coverage mask to be filled with color.
+    Rotated text becomes an RGBA sprite: the text is drawn on a transparent
+    canvas twice its size, rotated, and pasted through its own alpha.
+    """
+    font = get_font(font_family, font_size, bold, italic, font_path, font_index)
+    bbox = font.getbbox(text)
+    text_width = bbox[2] - bbox[0]
+    text_height = bbox[3] - bbox[1]
+
+    if rotation != 0:
+        # Create rotated text
+        text_img = Image.new('RGBA', (text_width * 2, text_height * 2), (255, 255, 255, 0))
+        text_draw = ImageDraw.Draw(text_img)
+        text_draw.text((text_width // 2, text_height // 2), text, font=font, fill=color)
+        text_img = text_img.rotate(rotation, expand=1)
+
+        sprite = Image.new('RGBA', text_img.size, (255, 255, 255, 0))
+        sprite.paste(text_img, (0, 0), text_img)
+        return sprite
+
+    # Glyph coverage, filled with the color when blended
+    mask = Image.new('L', (text_width, text_height), 0)
+    ImageDraw.Draw(mask).text((-bbox[0], -bbox[1]), text, font=font, fill=255)
+    return mask
+
+
+def _text_mark_args(spec):
+    """Arguments of _prepare_text_mark for a spec"""
+    return (spec.watermark_text, spec.watermark_font_family, max(1, spec.scale_length(spec.watermark_font_size)),
+            spec.watermark_bold, spec.watermark_italic, hex_to_rgba(spec.watermark_color, spec.watermark_opacity),
+            spec.watermark_rotation, spec.watermark_font_path, spec.watermark_font_index)
+
+
+def plan_text_watermark(image_size, spec):
+    """Lay out a text watermark, see plan_watermark"""
+    if not spec.watermark_text.strip():
+        return None
+
+    args = _text_mark_args(spec)
+    color = args[5]
+    kind = 'over' if spec.watermark_rotation != 0 else 'fill'
+    if spec.watermark_position == "tile":
+        return plan_tiled_watermark(image_size, spec, WatermarkLayer(kind, None, None, color, 100),
+                                    _prepare_text_mark, args)
+
+    mark = _prepare_text_mark(*args)
+
+    # Get text size
+    bbox = load_font(spec).getbbox(spec.watermark_text)
+    text_width = bbox[2] - bbox[0]
+    text_height = bbox[3] - bbox[1]
+
+    # Calculate position
+    x, y = calculate_watermark_position(image_size, (text_width, text_height), spec)
+    if kind == 'over':
+        # Keep the rotated text centred where the unrotated text would be
+        x -= (mark.width - text_width) // 2
+        y -= (mark.height - text_height) // 2
+    else:
+        x += bbox[0]
+        y += bbox[1]
+
+    return (x, y, x + mark.width, y + mark.height), WatermarkLayer(kind, mark, (x, y), color, 100)
+
+
+def apply_text_watermark(image, spec):
+    """Apply text watermark"""
+    plan = plan_text_watermark(image.size, spec)
+    if plan is None:
+        return image
+    return composite_watermark(image, *plan)
+
+
+@functools.lru_cache(maxsize=32)
+def _prepare_watermark_image(path, mtime, scale, opacity, rotation):
+    """Load, scale, fade and rotate a logo; cached per batch"""
+    with Image.open(path) as watermark_img:
+        # Scale watermark
+        scale_factor = scale / 100.0
+        new_size = (int(watermark_img.width * scale_factor), int(watermark_img.height * scale_factor))
+        watermark_img = watermark_img.resize(new_size, Image.Resampling.LANCZOS)
+
+    if watermark_img.mode != 'RGBA':
+        watermark_img = watermark_img.convert('RGBA')
+
+    # Apply opacity
+    if opacity < 100:
+        watermark_img = _fade(watermark_img, opacity)
+
+    # Rotate if needed
+    if rotation != 0:
+        watermark_img = watermark_img.rotate(rotation, expand=1)
+
+    return watermark_img
+
+
+def _image_mark_args(spec, opacity):
+    """Arguments of _prepare_watermark_image for a spec"""
+    path = os.path.abspath(spec.watermark_image_path)
+    return path, os.path.getmtime(path), spec.watermark_scale * spec.render_scale, opacity, spec.watermark_rotation
+
+
+def prepare_watermark_image(spec, opacity=None):
+    """Return the prepared RGBA logo sprite for a spec
+
+    opacity overrides the spec's opacity, e.g. 100 for an unfaded sprite.
+    The sprite is shared between calls and must not be modified.
+    """
+    if opacity is None:
+        opacity = spec.watermark_opacity
+    return _prepare_watermark_image(*_image_mark_args(spec, opacity))
+
+
+def sprite_cache_info():
+    """Hit/miss counters of the prepared logo cache"""
+    return _prepare_watermark_image.cache_info()
+
+
+def clear_sprite_cache():
+    """Drop all prepared logo sprites"""
+    _prepare_watermark_image.cache_clear()
+
+
+def plan_image_watermark(image_size, spec):
+    """Lay out an image watermark, see plan_watermark"""
+    if not spec.watermark_image_path or not os.path.exists(spec.watermark_image_path):
+        return None
+
+    # Vectorized backends fade while blending, so opacity changes reuse the cached sprite
+    opacity = 100 if COMPOSITING_BACKEND != 'pillow' else spec.watermark_opacity
+    layer_opacity = spec.watermark_opacity if COMPOSITING_BACKEND != 'pillow' else 100
+    if spec.watermark_position == "tile":
+        return plan_tiled_watermark(image_size, spec, WatermarkLayer('paste', None, None, None, layer_opacity),
+                                    _prepare_watermark_image, _image_mark_args(spec, opacity))
+
+    watermark_img = prepare_watermark_image(spec, opacity)
+
+    # Calculate position
+    x, y = calculate_watermark_position(image_size, watermark_img.size, spec)
+
+    box = (x, y, x + watermark_img.width, y + watermark_img.height)
+    return box, WatermarkLayer('paste', watermark_img, (x, y), None, layer_opacity)
+
+
+def apply_image_watermark(image, spec):
+    """Apply image watermark"""
+    try:
+        plan = plan_image_watermark(image.size, spec)
+        if plan is None:
+            return image
+        return composite_watermark(image, *plan)
+
+    except Exception as e:
+        print(f"Image watermark error: {str(e)}")
+        return image
+
+
+@functools.lru_cache(maxsize=8)
+def _prepare_pattern_cell(prepare, args, spacing, stagger):
+    """Build the repeating cell of a tiled watermark from the mark prepare(*args); cached per batch
+
+    The cell holds one mark at its top-left corner and, one row down, the
+    same mark shifted right by stagger percent of the cell width, so tiling
+    it gives a staggered grid. Returns (cell, mark size), or None when the
+    mark is empty.
+    """
+    mark = prepare(*args)
+    bbox = mark.getbbox()
+    if not bbox:
+        return None
+    mark = mark.crop(bbox)
+
+    cell_width, cell_height = mark.width + spacing, mark.height + spacing
+    shift = cell_width * (stagger % 100) // 100
+    cell = Image.new(mark.mode, (cell_width, cell_height * 2))
+    cell.paste(mark, (0, 0))
+    cell.paste(mark, (shift, cell_height))
+    if shift:
+        # The shifted mark wraps around into the start of the next cell
+        cell.paste(mark, (shift - cell_width, cell_height))
+    return cell, mark.size
+
+
+def plan_tiled_watermark(image_size, spec, layer, prepare, args):
+    """Lay out a watermark repeated over the whole image, see plan_watermark
+
+    layer gives the kind, color and opacity of the mark prepare(*args)
+    returns; the pattern is anchored so one mark sits in the image centre.
+    """
+    prepared = _prepare_pattern_cell(prepare, args, max(0, spec.scale_length(spec.watermark_tile_spacing)),
+                                     spec.watermark_tile_stagger)
+    if prepared is None:
+        return None
+    cell, (mark_width, mark_height) = prepared
+
+    width, height = image_size
+    position = ((width - mark_width) // 2, (height - mark_height) // 2)
+    return (0, 0, width, height), layer._replace(image=cell, position=position, repeat=True)
+
+
+@functools.lru_cache(maxsize=16)
+def _load_preview_proxy(path, mtime, max_size):
+    """Decode a display-sized proxy of an image; cached per (path, mtime, size)"""
+    with Image.open(path) as img:
+        source_size = img.size
+        # JPEG: let the decoder scale by 1/2, 1/4 or 1/8 while keeping
+        # enough resolution for a high quality downscale
+        img.draft(img.mode, (max_size[0] * 2, max_size[1] * 2))
+        if img.mode == 'P':
+            # Palette images are resized with NEAREST; resample in RGBA instead
+            img = img.convert('RGBA')
+        img.thumbnail(max_size, Image.Resampling.LANCZOS)
+        img.load()
+    return img, source_size
+
+
+def load_preview_proxy(path, max_size=PREVIEW_SIZE):
+    """Return (proxy, source_size) for previewing an image at display size
+
+    The proxy is shared between calls and must not be modified. Render it with
+    spec.scaled(proxy.width / source_size[0]) so the watermark keeps its
+    relative size and position.
+    """
+    path = os.path.abspath(path)
+    return _load_preview_proxy(path, os.path.getmtime(path), tuple(max_size))
+
+
+def clear_preview_cache():
+    """Drop all cached preview proxies"""
+    _load_preview_proxy.cache_clear()
+
+
+def output_filename(image_path, spec):
+    """Generate the output file name for an input image"""
+    original_name = Path(image_path).stem
+    ext = OUTPUT_EXTENSIONS.get(spec.output_format, ".png")
+    return f"{spec.filename_prefix}{original_name}{spec.filename_suffix}{ext}"
+
+
+def resized_size(size, spec):
+    """Size an image of size is exported at, size itself when the spec does not resize"""
+    width, height = size
+    mode, value = spec.resize_mode, spec.resize_value
+    if value <= 0:
+        return size
+    if mode == "percent":
+        factor = value / 100.0
+    elif mode == "width":
+        factor = min(value / width, 1.0)
+    elif mode == "height":
+        factor = min(value / height, 1.0)
+    elif mode == "long_edge":
+        factor = min(value / max(width, height), 1.0)
+    else:
+        return size
+    return max(1, int(round(width * factor))), max(1, int(round(height * factor)))
+
+
+def resize_image(image, size):
+    """High quality resize of a decoded image"""
+    if image.mode in ('1', 'P', 'PA'):
+        # LANCZOS needs a continuous-tone mode; palettes would fall back to NEAREST
+        image = image.convert('RGBA' if image.mode != '1' else 'L')
+    return image.resize(size, Image.Resampling.LANCZOS, reducing_gap=REDUCING_GAP)
+
+
+def draft_for_specs(image, specs):
+    """Reduce on load: let a JPEG decoder scale down when every spec shrinks the image enough
+
+    Call on an opened image before it is loaded; other formats are left
+    alone. Returns the size of the source, which output sizes and
+    watermark scales are computed from (see render_variants).
+    """
+    source_size = image.size
+    sizes = [resized_size(source_size, spec) for spec in specs]
+    width, height = max(size[0] for size in sizes), max(size[1] for size in sizes)
+    if (width, height) != source_size:
+        image.draft(image.mode, (int(width * DRAFT_MARGIN), int(height * DRAFT_MARGIN)))
+    return source_size
+
+
+def render_image(image, spec, source_size=None):
+    """Resize an image as the spec asks and watermark it at the matching relative size"""
+    return next(render_variants(image, [spec], source_size))[1]
+
+
+def render_variants(image, specs, source_size=None):
+    """Yield (index, rendered image) for each spec, like render_image, from one decoded image
+
+    source_size is the size of the source when image was decoded at a
+    reduced size (see draft_for_specs). Specs are rendered from the largest
+    output size down, and each resized copy is derived from the smallest
+    copy already made that is at least as large, so downscales cascade and
+    the full frame is resampled only once.
+    """
+    source_size = source_size or image.size
+    copies = {image.size: image}
+    sizes = [resized_size(source_size, spec) for spec in specs]
+    for index in sorted(range(len(specs)), key=lambda i: sizes[i][0] * sizes[i][1], reverse=True):
+        size = sizes[index]
+        if size not in copies:
+            larger = [other for other in copies if other[0] >= size[0] and other[1] >= size[1]]
+            source = copies[min(larger, key=lambda other: other[0] * other[1])] if larger else image
+            copies[size] = resize_image(source, size)
+        # The watermark is sized relative to the source, whatever size it was decoded at
+        spec = specs[index] if size == source_size else specs[index].scaled(size[0] / source_size[0])
+        yield index, apply_watermark(copies[size], spec)
+
+
+def export_targets(spec):
+    """Normalize a spec, or a sequence of ExportTarget, to a tuple of targets"""
+    if isinstance(spec, WatermarkSpec):
+        return (ExportTarget('', spec),)
+    return tuple(spec)
+
+
+def target_path(output_dir, image_path, target):
+    """Output path of an image for an export target"""
+    return os.path.join(output_dir, target.subdir, output_filename(image_path, target.spec))
+
+
+def prepare_for_save(image, spec):
+    """Convert a watermarked image to a mode the output format can store"""
+    save_modes = SAVE_MODES.get(spec.output_format, SAVE_MODES["PNG"])
+    if image.mode in save_modes:
+        return image
+
+    if image.mode in ('P', 'PA'):
+        image = image.convert('RGBA')
+    if spec.output_format == "JPEG" and image.mode in ('RGBA', 'LA'):
+        # Convert to RGB with white background for JPEG
+        background = Image.new('RGB', image.size, (255, 255, 255))
+        background.paste(image, mask=image.split()[-1] if image.mode == 'RGBA' else None)
+        return background
+    if image.mode == 'LA' and 'RGBA' in save_modes:
+        image = image.convert('RGBA')
+    if image.mode not in save_modes:
+        image = image.convert('RGB')
+    return image
+
+
+@contextlib.contextmanager
+def atomic_output(output_path):
+    """Yield a temporary path next to output_path and move it into place once written
+
+    The output path only ever holds a complete file: if writing fails or the
+    process dies, at most a .tmp file is left behind.
+    """
+    tmp_path = f"{output_path}.{os.getpid()}.tmp"
+    try:
+        yield tmp_path
+        # Flush to disk before the rename; Windows needs a writable handle for this
+        with open(tmp_path, 'r+b') as f:
+            os.fsync(f.fileno())
+        os.replace(tmp_path, output_path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+
+def encoder_options(spec, output_format=None):
+    """Pillow save options for the spec's encoder preset and quality settings"""
+    output_format = output_format or spec.output_format
+    presets = ENCODER_PRESETS.get(output_format, {})
+    options = dict(presets.get(spec.encoder_preset, presets.get("default", {})))
+    if output_format in LOSSY_FORMATS:
+        options['quality'] = spec.jpeg_quality
+    if output_format == "JPEG" and spec.jpeg_subsampling:
+        options['subsampling'] = spec.jpeg_subsampling
+    return options
+
+
+def compress_level(spec):
+    """zlib level of the spec's encoder preset, for encoders driving zlib directly"""
+    return ENCODER_PRESETS["PNG"].get(spec.encoder_preset, {}).get('compress_level', DEFAULT_COMPRESS_LEVEL)
+
+
+def encode_image(image, fp, spec):
+    """Encode a watermarked image to a path or file object in the spec's output format"""
+    if spec.output_format == "TIFF":
+        image.save(fp, "TIFF", compression="tiff_adobe_deflate")
+    elif spec.output_format in OUTPUT_EXTENSIONS:
+        image.save(fp, spec.output_format, **encoder_options(spec))
+    else:
+        image.save(fp, "PNG", **encoder_options(spec, "PNG"))
+
+
+def save_image(image, output_path, spec):
+    """Encode and write a watermarked image atomically"""
+    with atomic_output(output_path) as tmp_path:
+        encode_image(image, tmp_path, spec)
+
+
+def render_file(image_path, output_dir, spec):
+    """Watermark one file and write it to output_dir, returning the output path"""
+    with Image.open(image_path) as img:
+        source_size = draft_for_specs(img, [spec])
+        watermarked = prepare_for_save(render_image(img, spec, source_size), spec)
+        output_path = os.path.join(output_dir, output_filename(image_path, spec))
+        save_image(watermarked, output_path, spec)
+    return output_path
+
+
+def render_file_targets(image_path, output_dir, targets):
+    """Decode one file once and write an output for each target, returning the output paths"""
+    output_paths = [target_path(output_dir, image_path, target) for target in targets]
+    specs = [target.spec for target in targets]
+    with Image.open(image_path) as img:
+        source_size = draft_for_specs(img, specs)
+        img.load()
+        for index, watermarked in render_variants(img, specs, source_size):
+            spec = targets[index].spec
+            os.makedirs(os.path.dirname(output_paths[index]), exist_ok=True)
+            save_image(prepare_for_save(watermarked, spec), output_paths[index], spec)
+    return output_paths
+
+
+def render_bytes(data, spec, timings=None):
+    """Watermark an encoded image held in memory and return the encoded output
+
+    With a timings dict, the seconds spent in each stage (decode, watermark,
+    convert, encode) are stored in it.
+    """
+    return render_bytes_multi(data, [spec], timings)[0]
+
+
+def render_bytes_multi(data, specs, timings=None):
+    """Decode an encoded image once and return its encoded output for each spec
+
+    With a timings dict, the seconds spent in each stage (decode, watermark,
+    convert, encode) are stored in it, summed over the specs.
+    """
+    laps = [time.perf_counter()] if timings is not None else None
+
+    def lap(stage):
+        if laps:
+            now = time.perf_counter()
+            timings[stage] = timings.get(stage, 0.0) + now - laps[0]
+            laps[0] = now
+
+    outputs = [None] * len(specs)
+    with Image.open(io.BytesIO(data)) as img:
+        source_size = draft_for_specs(img, specs)
+        img.load()
+        lap('decode')
+        for index, watermarked in render_variants(img, specs, source_size):
+            # Resizing is counted with the watermark stage
+            lap('watermark')
+            watermarked = prepare_for_save(watermarked, specs[index])
+            lap('convert')
+            output = io.BytesIO()
+            encode_image(watermarked, output, specs[index])
+            lap('encode')
+            outputs[index] = output.getvalue()
+    return outputs
+
+
+def _storage_bytes(mode):
+    """Bytes per pixel Pillow uses for an image mode"""
+    if mode in ('1', 'L', 'P'):
+        return 1
+    if mode.startswith('I;16'):
+        return 2
+    return 4
+
+
+def estimate_render_memory(size, mode, encoded_size, spec):
+    """Rough peak working set in bytes of render_bytes for an image with this header
+
+    Counts the decoded frame and its watermarked copy, full-frame RGBA
+    buffers when the whole frame is blended (modes converted as a whole, or
+    the tile layout), and the encoded input and output. Calibrated on 24 MP
+    images of each mode, erring high.
+    """
+    pixels = size[0] * size[1]
+    storage = _storage_bytes(mode)
+    if not REGION_COMPOSITING or mode not in REGION_MODES:
+        per_pixel = storage + 16
+    elif spec.watermark_position == "tile":
+        per_pixel = 2 * storage + 14
+    else:
+        per_pixel = 2 * storage
+    return pixels * per_pixel + 2 * encoded_size
+
+
+def find_images(paths, recursive=True):
+    """Expand files and directories into a list of supported image paths"""
+    images = []
+    for path in paths:
+        path = Path(path)
+        if path.is_dir():
+            candidates = path.rglob('*') if recursive else path.iterdir()
+            images.extend(str(p) for p in sorted(candidates)
+                          if p.is_file() and p.suffix.lower() in SUPPORTED_FORMATS)
+        elif path.suffix.lower() in SUPPORTED_FORMATS:
+            images.append(str(path))
+    return images
@@ -0,0 +1,196 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Font resolution
+Maps font family/style names to font files through an index of the system
+font directories, persisted to disk, and caches loaded FreeType fonts.
+"""
+
+import os
+import sys
+import json
+import hashlib
+import functools
+import threading
+from PIL import ImageFont
+
+INDEX_VERSION = 1
+FONT_EXTENSIONS = ('.ttf', '.otf', '.ttc', '.otc')
+MAX_COLLECTION_FACES = 16
+
+# Style names to try, in order, for each (bold, italic) request
+STYLE_CANDIDATES = {
+    (False, False): ('regular', 'normal', 'book', 'roman', 'medium'),
+    (True, False): ('bold', 'semibold', 'demibold', 'heavy', 'black'),
+    (False, True): ('italic', 'oblique', 'regular italic', 'book italic'),
+    (True, True): ('bold italic', 'bold oblique', 'semibold italic', 'demibold italic'),
+}
+
+_index = None
+_index_lock = threading.Lock()
+
+
+def user_cache_dir():
+    """Per-user cache directory for the application"""
+    if sys.platform == 'win32':
+        base = os.environ.get('LOCALAPPDATA') or os.path.expanduser('~')
+        return os.path.join(base, 'WatermarkApp', 'cache')
+    if sys.platform == 'darwin':
+        return os.path.expanduser('~/Library/Caches/WatermarkApp')
+    base = os.environ.get('XDG_CACHE_HOME') or os.path.expanduser('~/.cache')
+    return os.path.join(base, 'watermark_app')
+
+
+def font_dirs():
+    """System and user font directories for this platform"""
+    if sys.platform == 'win32':
+        dirs = [os.path.join(os.environ.get('WINDIR', r'C:\Windows'), 'Fonts')]
+        if os.environ.get('LOCALAPPDATA'):
+            dirs.append(os.path.join(os.environ['LOCALAPPDATA'], 'Microsoft', 'Windows', 'Fonts'))
+    elif sys.platform == 'darwin':
+        dirs = ['/System/Library/Fonts', '/Library/Fonts', os.path.expanduser('~/Library/Fonts')]
+    else:
+        dirs = ['/usr/share/fonts', '/usr/local/share/fonts',
+                os.path.expanduser('~/.local/share/fonts'), os.path.expanduser('~/.fonts')]
+    return [d for d in dirs if os.path.isdir(d)]
+
+
+def _dirs_signature(dirs):
+    """Cheap fingerprint of the font directory trees, used to invalidate the index"""
+    digest = hashlib.sha1()
+    for root_dir in dirs:
+        for dirpath, dirnames, filenames in os.walk(root_dir):
+            dirnames.sort()
+            try:
+                mtime = os.stat(dirpath).st_mtime_ns
+            except OSError:
+                continue
+            digest.update(f"{dirpath}|{mtime}|{len(filenames)}\n".encode('utf-8', 'surrogatepass'))
+    return digest.hexdigest()
+
+
+def _scan_font_file(path):
+    """Yield (family, style, index) for every face in a font file"""
+    faces = MAX_COLLECTION_FACES if path.lower().endswith(('.ttc', '.otc')) else 1
+    for index in range(faces):
+        try:
+            font = ImageFont.truetype(path, 12, index=index)
+        except Exception:
+            break
+        family, style = font.getname()
+        if family:
+            yield family, style or 'Regular', index
+
+
+def build_font_index(dirs=None):
+    """Scan font directories and return {family: {style: [path, index]}}, lowercased"""
+    dirs = font_dirs() if dirs is None else dirs
+    fonts = {}
+    for root_dir in dirs:
+        for dirpath, dirnames, filenames in os.walk(root_dir):
+            for filename in sorted(filenames):
+                if not filename.lower().endswith(FONT_EXTENSIONS):
+                    continue
+                path = os.path.join(dirpath, filename)
+                for family, style, index in _scan_font_file(path):
+                    styles = fonts.setdefault(family.lower(), {})
+                    styles.setdefault(style.lower(), [path, index])
+                # Also allow lookup by file name, e.g. "arial" -> arial.ttf
+                stem = os.path.splitext(filename)[0].lower()
+                fonts.setdefault(stem, {}).setdefault('regular', [path, 0])
+    return fonts
+
+
+def index_path():
+    """Location of the persisted font index"""
+    return os.path.join(user_cache_dir(), 'font_index.json')
+
+
+def load_font_index(path=None, dirs=None):
+    """Load the persisted index, rebuilding it when the font directories changed"""
+    path = path or index_path()
+    dirs = font_dirs() if dirs is None else dirs
+    signature = _dirs_signature(dirs)
+
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            data = json.load(f)
+        if data.get('version') == INDEX_VERSION and data.get('signature') == signature:
+            return data['fonts']
+    except (OSError, ValueError, KeyError):
+        pass
+
+    fonts = build_font_index(dirs)
+    # Pool workers, the server and the GUI may rebuild at once; each writes its own file
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    try:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump({'version': INDEX_VERSION, 'signature': signature, 'fonts': fonts}, f)
+        os.replace(tmp_path, path)
+    except OSError as e:
+        # stdout carries the CLI's progress output
+        print(f"Font index save error: {str(e)}", file=sys.stderr)
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+    return fonts
+
+
+def get_font_index():
+    """Return the process-wide font index, loading it on first use"""
+    global _index
+    if _index is None:
+        with _index_lock:
+            if _index is None:
+                _index = load_font_index()
+    return _index
+
+
+def resolve_font(family, bold=False, italic=False):
+    """Resolve a family and style to (path, index), or None if unknown"""
+    styles = get_font_index().get(family.lower())
+    if not styles:
+        return None
+    for style in STYLE_CANDIDATES[(bool(bold), bool(italic))]:
+        if style in styles:
+            return tuple(styles[style])
+    # Fall back to the regular face, then to any face of the family
+    for style in STYLE_CANDIDATES[(False, False)]:
+        if style in styles:
+            return tuple(styles[style])
+    return tuple(next(iter(styles.values())))
+
+
+@functools.lru_cache(maxsize=64)
+def _load_truetype(path, size, index=0):
+    """Load a FreeType font, or None if it cannot be loaded; cached by (file, size, face index)"""
+    try:
+        return ImageFont.truetype(path, size, index=index)
+    except Exception:
+        return None
+
+
+@functools.lru_cache(maxsize=1)
+def _load_default():
+    """Pillow's built-in font, loaded once"""
+    return ImageFont.load_default()
+
+
+def get_font(family, size, bold=False, italic=False, path="", index=0):
+    """Return a loaded font for a family/style/size, falling back to Arial and the default font
+
+    A font file path (and face index) given is tried before the font index.
+    """
+    resolved = (path, index) if path else resolve_font(family, bold, italic)
+    candidates = [resolved] if resolved else []
+    candidates += [(f"{family}.ttf", 0), ("arial.ttf", 0)]
+    for path, index in candidates:
+        font = _load_truetype(path, size, index)
+        if font is not None:
+            return font
+    return _load_default()
+
+
+def font_cache_info():
+    """Hit/miss counters of the loaded font cache"""
+    return _load_truetype.cache_info()
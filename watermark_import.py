@@ -0,0 +1,121 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Image import
+Finds images under files and folders on a background thread, probing only
+their headers, and hands results over in batches. Does not touch tkinter.
+"""
+
+import os
+import time
+import queue
+import threading
+from collections import namedtuple
+from PIL import Image
+
+from watermark_engine import SUPPORTED_FORMATS
+
+ImageInfo = namedtuple('ImageInfo', ['path', 'size', 'mode', 'format'])
+
+
+def iter_image_files(paths, recursive=True):
+    """Yield explicitly listed files and supported image files under folders, using os.scandir"""
+    for path in paths:
+        if not os.path.isdir(path):
+            yield path
+            continue
+
+        stack = [path]
+        while stack:
+            directory = stack.pop()
+            try:
+                with os.scandir(directory) as it:
+                    entries = sorted(it, key=lambda entry: entry.name)
+            except OSError:
+                continue
+            subdirs = []
+            for entry in entries:
+                try:
+                    if entry.is_dir(follow_symlinks=False):
+                        subdirs.append(entry.path)
+                    elif entry.name.lower().endswith(SUPPORTED_FORMATS) and entry.is_file():
+                        yield entry.path
+                except OSError:
+                    continue
+            if recursive:
+                # Reversed so directories are visited in name order
+                stack.extend(reversed(subdirs))
+
+
+def probe_image(path):
+    """Read size, mode and format from an image header without decoding pixels"""
+    with Image.open(path) as img:
+        return ImageInfo(path, img.size, img.mode, img.format)
+
+
+class ImageScanner:
+    """Background scanner that probes image headers and batches results
+
+    Call poll() periodically from the consumer thread to receive batches of
+    ImageInfo; done is set once scanning finishes or is cancelled. Files
+    that cannot be read are collected in failures as (path, message).
+    """
+
+    def __init__(self, paths, recursive=True, batch_size=200, batch_interval=0.1):
+        self.paths = list(paths)
+        self.recursive = recursive
+        self.batch_size = batch_size
+        self.batch_interval = batch_interval
+        self.scanned_count = 0
+        self.found_count = 0
+        self.failures = []
+        self.done = threading.Event()
+        self._cancel = threading.Event()
+        self._batches = queue.Queue()
+        self._thread = threading.Thread(target=self._run, name="image-scanner", daemon=True)
+
+    def start(self):
+        """Start scanning"""
+        self._thread.start()
+        return self
+
+    def cancel(self):
+        """Stop scanning after the current file"""
+        self._cancel.set()
+
+    @property
+    def cancelled(self):
+        return self._cancel.is_set()
+
+    def poll(self):
+        """Return all batches found since the last call, flattened"""
+        found = []
+        while True:
+            try:
+                found.extend(self._batches.get_nowait())
+            except queue.Empty:
+                return found
+
+    def _run(self):
+        batch = []
+        last_flush = time.monotonic()
+        try:
+            for path in iter_image_files(self.paths, self.recursive):
+                if self._cancel.is_set():
+                    break
+                self.scanned_count += 1
+                try:
+                    batch.append(probe_image(path))
+                    self.found_count += 1
+                except Exception as e:
+                    self.failures.append((path, str(e)))
+
+                now = time.monotonic()
+                if batch and (len(batch) >= self.batch_size or now - last_flush >= self.batch_interval):
+                    self._batches.put(batch)
+                    batch = []
+                    last_flush = now
+        finally:
+            if batch:
+                self._batches.put(batch)
+            self.done.set()
@@ -0,0 +1,168 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Export manifest
+Records, per input image, what it was rendered from and where the output
+went (one or more outputs), so a re-run of the same export only renders inputs or settings that
+changed. The manifest lives in the output directory and is rewritten
+atomically as results come in, so an interrupted export resumes where it
+stopped.
+"""
+
+import os
+import json
+import time
+import hashlib
+
+from watermark_engine import WatermarkSpec
+
+MANIFEST_NAME = ".watermark_manifest.json"
+MANIFEST_VERSION = 1
+
+# Rewrite the manifest at most this often while an export runs
+SAVE_INTERVAL = 2.0
+
+
+def file_sha1(path, chunk_size=1024 * 1024):
+    """SHA-1 of a file's contents"""
+    digest = hashlib.sha1()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+# Spec fields added after manifests were introduced, with their defaults;
+# they only enter the fingerprint when set, so older outputs stay current
+LATER_FIELDS = {'resize_mode': "none", 'resize_value': 0, 'encoder_preset': "default", 'jpeg_subsampling': "",
+                'watermark_font_path': "", 'watermark_font_index': 0}
+
+
+def _spec_data(spec):
+    """Fingerprinted fields of a spec"""
+    data = spec.to_dict()
+    for name, default in LATER_FIELDS.items():
+        if data[name] == default:
+            del data[name]
+    if spec.watermark_type == "image" and spec.watermark_image_path and os.path.exists(spec.watermark_image_path):
+        # An edited logo must invalidate outputs just like changed settings
+        stat = os.stat(spec.watermark_image_path)
+        data['watermark_image_stat'] = [stat.st_size, stat.st_mtime_ns]
+    return data
+
+
+def spec_fingerprint(spec, memory_budget=None):
+    """Hash of everything besides the input that determines the output files
+
+    spec may also be a sequence of ExportTarget.
+    """
+    if isinstance(spec, WatermarkSpec):
+        data = _spec_data(spec)
+    else:
+        data = {'targets': [dict(_spec_data(target.spec), subdir=target.subdir) for target in spec]}
+    # Tiled rendering writes a different output format
+    data['tiled'] = bool(memory_budget)
+    return hashlib.sha1(json.dumps(data, sort_keys=True).encode('utf-8')).hexdigest()
+
+
+class ExportManifest:
+    """Manifest of rendered outputs in an output directory
+
+    Inputs are matched by size and modification time; with checksum=True a
+    content hash is also recorded, so files that were touched or copied
+    without changing are not rendered again.
+    """
+
+    def __init__(self, output_dir, checksum=False):
+        self.output_dir = output_dir
+        self.path = os.path.join(output_dir, MANIFEST_NAME)
+        self.checksum = checksum
+        self.entries = {}
+        self._signatures = {}
+        self._dirty = False
+        self._last_save = time.monotonic()
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+            if data.get('version') == MANIFEST_VERSION:
+                self.entries = data.get('entries', {})
+        except (OSError, ValueError) as e:
+            if os.path.exists(self.path):
+                print(f"Manifest error: {str(e)}")
+
+    def _signature(self, image_path):
+        stat = os.stat(image_path)
+        return {'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns}
+
+    def is_current(self, image_path, fingerprint):
+        """True when image_path was rendered with fingerprint and neither it nor the output changed since"""
+        key = os.path.abspath(image_path)
+        signature = self._signature(image_path)
+        self._signatures[key] = signature
+        entry = self.entries.get(key)
+        if not entry or entry.get('spec') != fingerprint:
+            return False
+
+        outputs = [(entry['output'], entry.get('output_size'))]
+        outputs += [tuple(extra) for extra in entry.get('extra_outputs', ())]
+        try:
+            if any(os.path.getsize(os.path.join(self.output_dir, output)) != size for output, size in outputs):
+                return False
+        except OSError:
+            return False
+
+        if signature['size'] == entry.get('size') and signature['mtime_ns'] == entry.get('mtime_ns'):
+            if self.checksum and 'sha1' in entry:
+                signature['sha1'] = entry['sha1']
+            return True
+        if not self.checksum or signature['size'] != entry.get('size') or 'sha1' not in entry:
+            return False
+        signature['sha1'] = file_sha1(image_path)
+        if signature['sha1'] != entry['sha1']:
+            return False
+        # Same contents with a new timestamp; remember it so the next run skips hashing
+        entry.update(signature)
+        self._dirty = True
+        return True
+
+    def output_paths(self, image_path):
+        """Paths of the recorded outputs of an input"""
+        entry = self.entries[os.path.abspath(image_path)]
+        outputs = [entry['output']] + [output for output, size in entry.get('extra_outputs', ())]
+        return [os.path.join(self.output_dir, output) for output in outputs]
+
+    def record(self, image_path, output_paths, fingerprint):
+        """Remember the finished output path, or paths, of an input
+
+        The input signature is the one seen by is_current.
+        """
+        if isinstance(output_paths, str):
+            output_paths = [output_paths]
+        key = os.path.abspath(image_path)
+        signature = self._signatures.pop(key, None) or self._signature(image_path)
+        if self.checksum and 'sha1' not in signature:
+            signature['sha1'] = file_sha1(image_path)
+        outputs = [[os.path.relpath(output_path, self.output_dir), os.path.getsize(output_path)]
+                   for output_path in output_paths]
+        entry = dict(signature, spec=fingerprint, output=outputs[0][0], output_size=outputs[0][1])
+        if len(outputs) > 1:
+            entry['extra_outputs'] = outputs[1:]
+        self.entries[key] = entry
+        self._dirty = True
+        if time.monotonic() - self._last_save >= SAVE_INTERVAL:
+            self.save()
+
+    def save(self):
+        """Write the manifest atomically if anything changed"""
+        if not self._dirty:
+            return
+        tmp_path = f"{self.path}.{os.getpid()}.tmp"
+        try:
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump({'version': MANIFEST_VERSION, 'entries': self.entries}, f, ensure_ascii=False)
+            os.replace(tmp_path, self.path)
+        except OSError as e:
+            print(f"Manifest error: {str(e)}")
+            return
+        self._dirty = False
+        self._last_save = time.monotonic()
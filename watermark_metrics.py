@@ -0,0 +1,146 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Export metrics
+Collects per-image stage durations and byte counts from an export and
+aggregates them into throughput and per-stage percentiles, written as a
+JSON report or a Prometheus text-format file (e.g. for node_exporter's
+textfile collector).
+
+Stages, in order: read, decode, watermark, convert, encode, write.
+Without a metrics collector the export pipeline takes no timings at all.
+"""
+
+import json
+import time
+import threading
+from collections import namedtuple
+
+from watermark_engine import atomic_output
+
+STAGES = ('read', 'decode', 'watermark', 'convert', 'encode', 'write')
+QUANTILES = (0.5, 0.95, 0.99)
+
+ImageMetrics = namedtuple('ImageMetrics', ['image_path', 'stages', 'bytes_read', 'bytes_written', 'error'])
+
+
+def percentile(sorted_values, fraction):
+    """Nearest-rank percentile of an already sorted list"""
+    if not sorted_values:
+        return None
+    return sorted_values[min(len(sorted_values) - 1, int(len(sorted_values) * fraction))]
+
+
+class ExportMetrics:
+    """Thread-safe collector for one export's per-image metrics"""
+
+    def __init__(self):
+        self.images = []
+        self.started = None
+        self.finished = None
+        self._lock = threading.Lock()
+
+    def start(self):
+        """Mark the start of the export, for throughput"""
+        with self._lock:
+            if self.started is None:
+                self.started = time.time()
+
+    def record(self, image_path, stages, bytes_read=0, bytes_written=0, error=None):
+        """Add one image's stage durations (seconds by stage name) and byte counts"""
+        now = time.time()
+        with self._lock:
+            if self.started is None:
+                self.started = now
+            self.finished = now
+            self.images.append(ImageMetrics(image_path, dict(stages), bytes_read, bytes_written, error))
+
+    def summary(self):
+        """Batch aggregates: counts, bytes, throughput and per-stage percentiles"""
+        with self._lock:
+            images = list(self.images)
+            elapsed = (self.finished - self.started) if images else 0.0
+        succeeded = [image for image in images if not image.error]
+        bytes_read = sum(image.bytes_read for image in images)
+        bytes_written = sum(image.bytes_written for image in images)
+
+        stages = {}
+        for stage in STAGES:
+            values = sorted(image.stages[stage] for image in images if stage in image.stages)
+            if not values:
+                continue
+            stats = {'count': len(values), 'sum': sum(values), 'max': values[-1]}
+            stats.update({f"p{int(q * 100)}": percentile(values, q) for q in QUANTILES})
+            stages[stage] = stats
+
+        return {
+            'images': len(images),
+            'failed': len(images) - len(succeeded),
+            'bytes_read': bytes_read,
+            'bytes_written': bytes_written,
+            'seconds': elapsed,
+            'images_per_second': len(succeeded) / elapsed if elapsed > 0 else None,
+            'read_bytes_per_second': bytes_read / elapsed if elapsed > 0 else None,
+            'write_bytes_per_second': bytes_written / elapsed if elapsed > 0 else None,
+            'stages': stages,
+        }
+
+    def to_dict(self):
+        """Summary plus the per-image records"""
+        with self._lock:
+            images = [image._asdict() for image in self.images]
+        return {'summary': self.summary(), 'images': images}
+
+    def write_json(self, path):
+        """Write the full report as JSON"""
+        with atomic_output(path) as tmp_path:
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump(self.to_dict(), f, ensure_ascii=False, indent=2)
+
+    def prometheus_text(self, prefix="watermark_export"):
+        """Aggregates in the Prometheus text exposition format"""
+        summary = self.summary()
+        lines = [
+            f"# HELP {prefix}_stage_seconds Per-image time spent in each export stage",
+            f"# TYPE {prefix}_stage_seconds summary",
+        ]
+        for stage, stats in summary['stages'].items():
+            for q in QUANTILES:
+                lines.append(f'{prefix}_stage_seconds{{stage="{stage}",quantile="{q}"}} '
+                             f'{stats[f"p{int(q * 100)}"]:.6f}')
+            lines.append(f'{prefix}_stage_seconds_sum{{stage="{stage}"}} {stats["sum"]:.6f}')
+            lines.append(f'{prefix}_stage_seconds_count{{stage="{stage}"}} {stats["count"]}')
+
+        def metric(name, kind, help_text, samples):
+            lines.append(f"# HELP {prefix}_{name} {help_text}")
+            lines.append(f"# TYPE {prefix}_{name} {kind}")
+            for labels, value in samples:
+                lines.append(f"{prefix}_{name}{labels} {value}")
+
+        metric("images_total", "counter", "Images exported, by result",
+               [('{result="ok"}', summary['images'] - summary['failed']),
+                ('{result="failed"}', summary['failed'])])
+        metric("bytes_read_total", "counter", "Input bytes read", [('', summary['bytes_read'])])
+        metric("bytes_written_total", "counter", "Output bytes written", [('', summary['bytes_written'])])
+        metric("duration_seconds", "gauge", "Wall time of the export", [('', f"{summary['seconds']:.6f}")])
+        metric("images_per_second", "gauge", "Export throughput",
+               [('', f"{summary['images_per_second'] or 0:.6f}")])
+        return "\n".join(lines) + "\n"
+
+    def write_prometheus(self, path):
+        """Write the aggregates as a Prometheus text-format file, replaced atomically"""
+        with atomic_output(path) as tmp_path:
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                f.write(self.prometheus_text())
+
+    def report(self):
+        """Multi-line human readable summary"""
+        summary = self.summary()
+        rate = summary['images_per_second']
+        lines = [f"{summary['images']} images in {summary['seconds']:.2f}s"
+                 f" ({rate:.2f} images/s)" if rate else f"{summary['images']} images",
+                 f"{'stage':<10} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} {'total s':>9}"]
+        for stage, stats in summary['stages'].items():
+            lines.append(f"{stage:<10} {stats['p50'] * 1000:>9.1f} {stats['p95'] * 1000:>9.1f} "
+                         f"{stats['p99'] * 1000:>9.1f} {stats['sum']:>9.2f}")
+        return "\n".join(lines)
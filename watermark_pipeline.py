@@ -0,0 +1,364 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Export pipeline
+Overlaps disk and CPU work during an export: a reader thread prefetches
+input file bytes, a pool decodes, watermarks and encodes them, and a
+writer thread writes finished outputs. Bounded queues between the stages
+keep memory in check, and their occupancy is tracked over time so a
+report can show which stage holds the others up.
+
+    read -> [read queue] -> render pool -> [render queue] -> [write queue] -> write
+
+The read queue holds prefetched files waiting for a render slot, the
+render queue the renders in progress, and the write queue finished outputs
+waiting for the disk. With a memory limit, renders are also admitted only
+while their estimated working sets (from each file's header) fit in it, so
+small images keep every worker busy while large scans run a few at a time.
+Given several export targets, each file is decoded once and rendered for
+every target.
+"""
+
+import io
+import os
+import time
+import queue
+import threading
+from concurrent.futures import Future, ProcessPoolExecutor, ThreadPoolExecutor
+from PIL import Image
+
+from watermark_engine import (WatermarkSpec, export_targets, target_path, render_bytes_multi, atomic_output,
+                              draft_for_specs, estimate_render_memory)
+
+# Default depth of each queue, per render worker
+QUEUE_DEPTH_PER_WORKER = 2
+
+# Seconds between checks for a stopped pipeline while a stage waits
+_POLL_SECONDS = 0.1
+
+_DONE = object()
+
+
+class StageQueue(queue.Queue):
+    """Bounded queue that tracks its time-averaged and peak length"""
+
+    def __init__(self, name, maxsize):
+        super().__init__(maxsize)
+        self.name = name
+        self.peak = 0
+        self._area = 0.0
+        self._started = self._changed = time.perf_counter()
+
+    def _account(self):
+        now = time.perf_counter()
+        self._area += len(self.queue) * (now - self._changed)
+        self._changed = now
+
+    def _put(self, item):
+        self._account()
+        super()._put(item)
+        self.peak = max(self.peak, len(self.queue))
+
+    def _get(self):
+        self._account()
+        return super()._get()
+
+    def occupancy(self):
+        """Dict with the queue's depth and its mean and peak length so far"""
+        with self.mutex:
+            self._account()
+            elapsed = self._changed - self._started
+            mean = self._area / elapsed if elapsed > 0 else 0.0
+            return {'depth': self.maxsize, 'mean': round(mean, 2), 'peak': self.peak}
+
+
+class MemoryGate:
+    """Admit jobs while their summed memory estimates stay within a limit
+
+    A job larger than the limit on its own is admitted once nothing else
+    runs, so it cannot stall the export.
+    """
+
+    def __init__(self, limit):
+        self.limit = limit
+        self.in_use = 0
+        self.active = 0
+        self.peak = 0
+        self.waits = 0
+        self._condition = threading.Condition()
+
+    def _fits(self, cost):
+        return self.active == 0 or self.in_use + cost <= self.limit
+
+    def acquire(self, cost, stop):
+        """Wait until cost fits; returns False if stop is set first"""
+        with self._condition:
+            if not self._fits(cost):
+                self.waits += 1
+            while not self._fits(cost):
+                if stop.is_set():
+                    return False
+                self._condition.wait(_POLL_SECONDS)
+            self.in_use += cost
+            self.active += 1
+            self.peak = max(self.peak, self.in_use)
+            return True
+
+    def release(self, cost):
+        with self._condition:
+            self.in_use -= cost
+            self.active -= 1
+            self._condition.notify_all()
+
+
+def _estimate(data, specs):
+    """Memory estimate for rendering encoded image bytes, read from the header only
+
+    Renders for several specs share the decoded frame and run one after the
+    other, so the largest one counts, plus the outputs kept until written.
+    JPEGs count at the size they will be decoded at.
+    """
+    try:
+        with Image.open(io.BytesIO(data)) as img:
+            draft_for_specs(img, specs)
+            return (max(estimate_render_memory(img.size, img.mode, len(data), spec) for spec in specs)
+                    + (len(specs) - 1) * len(data))
+    except Exception:
+        # Not an image; the render will report the error
+        return 2 * len(data)
+
+
+def _render_job(data, specs, timed=False):
+    """Pool entry point: render encoded bytes for each spec, reporting failures instead of raising
+
+    Returns (outputs, error, stage timings or None).
+    """
+    timings = {} if timed else None
+    try:
+        return render_bytes_multi(data, specs, timings), None, timings
+    except Exception as e:
+        return None, str(e), timings
+
+
+class ExportPipeline:
+    """Staged export: prefetching reader, render pool, writer
+
+    Depths default to QUEUE_DEPTH_PER_WORKER per worker. memory_limit
+    (bytes) caps the estimated working set of the renders in flight; the
+    pool then grows from workers up to max_workers (default: one per CPU)
+    processes, so small images render more at a time than large ones. With
+    an ExportMetrics collector, every image's stage durations and byte
+    counts are recorded in it. A pipeline object can run several exports;
+    occupancy() and report() describe the last one.
+    """
+
+    def __init__(self, read_depth=None, render_depth=None, write_depth=None, memory_limit=None, metrics=None,
+                 max_workers=None):
+        self.depths = (read_depth, render_depth, write_depth)
+        self.memory_limit = memory_limit
+        self.metrics = metrics
+        self.max_workers = max_workers
+        self.pool_size = 0
+        self.memory = None
+        self.queues = []
+        self.busy = {}
+        self._stop = threading.Event()
+
+    def run(self, image_paths, output_dir, spec, workers=1):
+        """Yield (image_path, output_path, error) for each image in input order
+
+        spec may also be a sequence of ExportTarget; each image is then
+        decoded once, and output_path is the tuple of its outputs in target
+        order. workers=1 renders on a thread of this process; more use a
+        process pool, which a memory limit lets grow past workers.
+        """
+        targets = export_targets(spec)
+        for target in targets:
+            if target.subdir:
+                os.makedirs(os.path.join(output_dir, target.subdir), exist_ok=True)
+        pool_size = max(workers, 1)
+        if self.memory_limit and pool_size > 1:
+            # The memory gate decides how many render at once; workers is the floor
+            pool_size = max(pool_size, self.max_workers or os.cpu_count() or 1)
+        self.pool_size = pool_size = min(pool_size, max(len(image_paths), 1))
+        default_depth = pool_size * QUEUE_DEPTH_PER_WORKER
+        read_depth, render_depth, write_depth = (depth or default_depth for depth in self.depths)
+        read_queue = StageQueue('read', read_depth)
+        render_queue = StageQueue('render', render_depth)
+        write_queue = StageQueue('write', write_depth)
+        results = queue.Queue()
+        self.queues = [read_queue, render_queue, write_queue]
+        self.busy = {'read': 0.0, 'write': 0.0}
+        self.memory = MemoryGate(self.memory_limit) if self.memory_limit else None
+        self._stop.clear()
+        if self.metrics:
+            self.metrics.start()
+
+        if pool_size <= 1:
+            executor = ThreadPoolExecutor(max_workers=1)
+        else:
+            executor = ProcessPoolExecutor(max_workers=pool_size)
+        threads = [
+            threading.Thread(target=self._read, args=(image_paths, targets, read_queue), daemon=True),
+            threading.Thread(target=self._dispatch, args=(executor, targets, read_queue, render_queue), daemon=True),
+            threading.Thread(target=self._collect, args=(render_queue, write_queue), daemon=True),
+            threading.Thread(target=self._write, args=(output_dir, targets, write_queue, results), daemon=True),
+        ]
+        for thread in threads:
+            thread.start()
+        try:
+            while True:
+                item = results.get()
+                if item is _DONE:
+                    break
+                image_path, output_paths, error = item
+                if isinstance(spec, WatermarkSpec):
+                    yield image_path, output_paths[0] if output_paths else None, error
+                else:
+                    yield image_path, output_paths, error
+        finally:
+            # Also reached when the consumer stops early: unblock and drain the stages
+            self._stop.set()
+            executor.shutdown(wait=False, cancel_futures=True)
+            for thread in threads:
+                thread.join()
+            executor.shutdown(wait=True)
+
+    def _put(self, stage_queue, item):
+        while not self._stop.is_set():
+            try:
+                stage_queue.put(item, timeout=_POLL_SECONDS)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def _get(self, stage_queue):
+        while not self._stop.is_set():
+            try:
+                return stage_queue.get(timeout=_POLL_SECONDS)
+            except queue.Empty:
+                continue
+        return _DONE
+
+    def _read(self, image_paths, targets, read_queue):
+        for image_path in image_paths:
+            started = time.perf_counter()
+            try:
+                with open(image_path, 'rb') as f:
+                    data = f.read()
+                elapsed = time.perf_counter() - started
+                cost = _estimate(data, [target.spec for target in targets]) if self.memory else 0
+                item = (image_path, data, cost, None)
+            except OSError as e:
+                elapsed = time.perf_counter() - started
+                item = (image_path, None, 0, str(e))
+            self.busy['read'] += elapsed
+            # Per-image stage timings travel with the item, only when collecting metrics
+            item += ({'read': elapsed} if self.metrics else None,)
+            if not self._put(read_queue, item):
+                return
+        self._put(read_queue, _DONE)
+
+    def _dispatch(self, executor, targets, read_queue, render_queue):
+        specs = [target.spec for target in targets]
+        while True:
+            item = self._get(read_queue)
+            if item is _DONE:
+                self._put(render_queue, _DONE)
+                return
+            image_path, data, cost, error, stages = item
+            if error is None:
+                # Jobs are admitted in input order, so a large scan holds back the files behind it
+                if self.memory and not self.memory.acquire(cost, self._stop):
+                    return
+                try:
+                    future = executor.submit(_render_job, data, specs, stages is not None)
+                except RuntimeError:
+                    # Pool shut down because the pipeline is stopping
+                    if self.memory:
+                        self.memory.release(cost)
+                    return
+                if self.memory:
+                    future.add_done_callback(lambda future, cost=cost: self.memory.release(cost))
+            else:
+                future = Future()
+                future.set_result((None, error, None))
+            if not self._put(render_queue, (image_path, future, stages, len(data) if data else 0)):
+                return
+
+    def _collect(self, render_queue, write_queue):
+        while True:
+            item = self._get(render_queue)
+            if item is _DONE:
+                self._put(write_queue, _DONE)
+                return
+            image_path, future, stages, bytes_read = item
+            try:
+                outputs, error, timings = future.result()
+            except Exception as e:
+                # Cancelled, or the worker process died
+                outputs, error, timings = None, str(e) or type(e).__name__, None
+            if stages is not None and timings:
+                stages.update(timings)
+            if not self._put(write_queue, (image_path, outputs, error, stages, bytes_read)):
+                return
+
+    def _write(self, output_dir, targets, write_queue, results):
+        while True:
+            item = self._get(write_queue)
+            if item is _DONE:
+                break
+            image_path, outputs, error, stages, bytes_read = item
+            output_paths = None
+            bytes_written = 0
+            if error is None:
+                started = time.perf_counter()
+                output_paths = tuple(target_path(output_dir, image_path, target) for target in targets)
+                try:
+                    for output_path, output in zip(output_paths, outputs):
+                        with atomic_output(output_path) as tmp_path:
+                            with open(tmp_path, 'wb') as f:
+                                f.write(output)
+                        bytes_written += len(output)
+                except OSError as e:
+                    output_paths, error = None, str(e)
+                elapsed = time.perf_counter() - started
+                self.busy['write'] += elapsed
+                if stages is not None:
+                    stages['write'] = elapsed
+            if stages is not None:
+                self.metrics.record(image_path, stages, bytes_read, bytes_written, error)
+            results.put((image_path, output_paths, error))
+        results.put(_DONE)
+
+    def occupancy(self):
+        """Per-queue depth, mean and peak length for the last run"""
+        return {stage_queue.name: stage_queue.occupancy() for stage_queue in self.queues}
+
+    def bottleneck(self):
+        """Name of the stage that limited the last run"""
+        occupancy = self.occupancy()
+        fill = {name: stats['mean'] / stats['depth'] for name, stats in occupancy.items()}
+        # Outputs piling up before the writer, or files before the renderers,
+        # mean the next stage is the slow one; otherwise the reader starves them
+        if fill['write'] >= 0.5:
+            return 'write'
+        if fill['read'] >= 0.5:
+            return 'render'
+        return 'read'
+
+    def report(self):
+        """One-line summary of queue occupancy and I/O time for the last run"""
+        if not self.queues:
+            return "Pipeline: not run"
+        parts = [f"{name} {stats['mean']:.1f}/{stats['depth']} (peak {stats['peak']})"
+                 for name, stats in self.occupancy().items()]
+        line = (f"Pipeline queues (mean/depth): {', '.join(parts)}; "
+                f"read {self.busy['read']:.1f}s, write {self.busy['write']:.1f}s; "
+                f"bottleneck: {self.bottleneck()}")
+        if self.memory:
+            line += (f"; estimated render memory peak {self.memory.peak / 1e6:.0f} of "
+                     f"{self.memory.limit / 1e6:.0f} MB, {self.memory.waits} waits, "
+                     f"{self.pool_size} render workers")
+        return line
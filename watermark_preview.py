@@ -0,0 +1,102 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Background preview rendering
+Renders preview frames on a worker thread with latest-request-wins
+semantics: requests that arrive while a frame is rendering replace each
+other, and only the newest one is rendered next. Every finished frame is
+published until a newer one replaces it, so a continuous drag keeps
+showing frames at most one render behind. Does not touch tkinter; the GUI
+collects finished frames from its own thread.
+"""
+
+import time
+import threading
+from collections import namedtuple
+
+import watermark_engine as engine
+
+PreviewFrame = namedtuple('PreviewFrame', ['generation', 'image', 'seconds'])
+
+
+class PreviewRenderer:
+    """Coalescing background renderer for preview frames"""
+
+    def __init__(self, render=engine.apply_watermark):
+        self.render = render
+        self.rendered_count = 0
+        self.dropped_count = 0
+        self._cond = threading.Condition()
+        self._generation = 0
+        self._pending = None
+        self._result = None
+        self._busy = False
+        self._stopped = False
+        self._thread = threading.Thread(target=self._run, name="preview-renderer", daemon=True)
+        self._thread.start()
+
+    def request(self, image, spec):
+        """Queue a render, replacing any request that has not started yet"""
+        with self._cond:
+            self._generation += 1
+            if self._pending is not None:
+                self.dropped_count += 1
+            self._pending = (self._generation, image, spec)
+            self._cond.notify()
+            return self._generation
+
+    def take_result(self):
+        """Return the newest finished frame, or None; safe to call from any thread"""
+        with self._cond:
+            result, self._result = self._result, None
+            return result
+
+    def poll(self):
+        """Return (newest finished frame or None, idle), read together
+
+        Pollers should use this instead of take_result() then is_idle(): a
+        render finishing between those two calls would leave a frame
+        behind after polling stopped.
+        """
+        with self._cond:
+            result, self._result = self._result, None
+            return result, self._pending is None and not self._busy
+
+    def is_idle(self):
+        """True when nothing is queued or rendering"""
+        with self._cond:
+            return self._pending is None and not self._busy
+
+    def stop(self):
+        """Stop the worker thread"""
+        with self._cond:
+            self._stopped = True
+            self._cond.notify()
+        self._thread.join(timeout=1)
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while self._pending is None and not self._stopped:
+                    self._cond.wait()
+                if self._stopped:
+                    return
+                generation, image, spec = self._pending
+                self._pending = None
+                self._busy = True
+
+            start = time.perf_counter()
+            try:
+                frame = self.render(image, spec)
+            except Exception as e:
+                print(f"Preview update error: {str(e)}")
+                frame = None
+            elapsed = time.perf_counter() - start
+
+            with self._cond:
+                self._busy = False
+                if frame is None:
+                    continue
+                # Published even when a newer request is waiting; its frame replaces this one
+                self.rendered_count += 1
+                self._result = PreviewFrame(generation, frame, elapsed)
@@ -0,0 +1,236 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Profiling sessions
+Runs cProfile and tracemalloc over a batch export or a series of preview
+refreshes and writes what a performance bug report needs:
+
+    PREFIX.pstats         cProfile data, for pstats / snakeviz
+    PREFIX_alloc.txt      top allocation sites traced by tracemalloc
+    PREFIX_summary.txt    time spent in the watermark code paths
+
+Before Python 3.12 cProfile only sees the thread that enabled it, so every
+thread gets its own profiler: threads started while the session runs are
+picked up automatically, and code on threads that already exist (the Tk
+thread, the preview worker) is profiled through profiled() or wrap(). The
+profilers are merged when the reports are written. From 3.12 cProfile
+hooks sys.monitoring, which sees every thread but allows only one active
+profiler per process, so the session runs a single profiler from start()
+to stop() and profiled() and wrap() have nothing to add.
+
+tracemalloc sees Python and NumPy allocations but not Pillow's pixel
+buffers, which is why the allocation report also gives the process peak.
+"""
+
+import io
+import os
+import sys
+import time
+import pstats
+import cProfile
+import functools
+import threading
+import contextlib
+import tracemalloc
+
+# Functions always listed in the summary, called or not
+KEY_FUNCTIONS = ('apply_text_watermark', 'apply_image_watermark', 'update_preview')
+
+# Files counted as watermark code paths in the summary
+SOURCE_PREFIX = 'watermark_'
+
+DEFAULT_TOP = 25
+TRACEBACK_FRAMES = 10
+
+# One cProfile.Profile covers every thread, and only one may be active
+PROCESS_WIDE_PROFILER = sys.version_info >= (3, 12)
+
+
+def peak_rss():
+    """Peak resident set size of this process in bytes, or None if unavailable"""
+    try:
+        import resource
+    except ImportError:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak if sys.platform == 'darwin' else peak * 1024
+
+
+class ProfileSession:
+    """cProfile and tracemalloc over everything run between start() and stop()"""
+
+    def __init__(self, label="profile", top=DEFAULT_TOP):
+        self.label = label
+        self.top = top
+        self.started = None
+        self.seconds = 0.0
+        self.snapshot = None
+        self.traced_peak = 0
+        self._profilers = []
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._running = False
+        self._started_tracing = False
+        self._process_profiler = None
+
+    def start(self):
+        """Start tracing allocations and profiling threads started from now on"""
+        if not tracemalloc.is_tracing():
+            tracemalloc.start(TRACEBACK_FRAMES)
+            self._started_tracing = True
+        if PROCESS_WIDE_PROFILER:
+            profiler = self._new_profiler()
+            if self._enable(profiler):
+                self._process_profiler = profiler
+        else:
+            threading.setprofile(self._thread_started)
+        self.started = time.perf_counter()
+        self._running = True
+
+    def stop(self):
+        """Stop profiling and take the allocation snapshot"""
+        if not self._running:
+            return
+        self._running = False
+        if self._process_profiler is not None:
+            self._process_profiler.disable()
+            self._process_profiler = None
+        else:
+            threading.setprofile(None)
+        self.seconds = time.perf_counter() - self.started
+        self.snapshot = tracemalloc.take_snapshot().filter_traces((
+            tracemalloc.Filter(False, tracemalloc.__file__),
+            tracemalloc.Filter(False, "<frozen importlib._bootstrap>"),
+            tracemalloc.Filter(False, "<frozen importlib._bootstrap_external>"),
+        ))
+        self.traced_peak = tracemalloc.get_traced_memory()[1]
+        if self._started_tracing:
+            tracemalloc.stop()
+
+    def _new_profiler(self):
+        profiler = cProfile.Profile()
+        with self._lock:
+            self._profilers.append(profiler)
+        return profiler
+
+    @staticmethod
+    def _enable(profiler):
+        """Enable a profiler, reporting instead of raising when another profiler is active"""
+        try:
+            profiler.enable()
+            return True
+        except ValueError as e:
+            # Raising here would kill the thread being profiled
+            print(f"Profiling error: {str(e)}", file=sys.stderr)
+            return False
+
+    def _thread_started(self, frame, event, arg):
+        # Runs once as the first profile event of a new thread, then hands over to cProfile
+        self._enable(self._new_profiler())
+
+    @contextlib.contextmanager
+    def profiled(self):
+        """Profile the enclosed code on the calling thread"""
+        depth = getattr(self._local, 'depth', 0)
+        if not self._running or depth or PROCESS_WIDE_PROFILER:
+            # Not running, or already covered by an outer profiled() or the session's profiler
+            yield
+            return
+        profiler = getattr(self._local, 'profiler', None)
+        if profiler is None:
+            profiler = self._local.profiler = self._new_profiler()
+        if not self._enable(profiler):
+            yield
+            return
+        self._local.depth = 1
+        try:
+            yield
+        finally:
+            profiler.disable()
+            self._local.depth = 0
+
+    def wrap(self, func):
+        """Return func profiled on whatever thread calls it"""
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with self.profiled():
+                return func(*args, **kwargs)
+        return wrapper
+
+    def stats(self, stream=None):
+        """Merged pstats.Stats of every profiler in the session"""
+        with self._lock:
+            profilers = list(self._profilers)
+        stats = pstats.Stats(stream=stream or io.StringIO())
+        for profiler in profilers:
+            # create_stats() disables the profiler on this thread; the others are finished
+            profiler.create_stats()
+            if profiler.stats:
+                stats.add(profiler)
+        return stats
+
+    def summary_text(self):
+        """Per-function timings of the watermark code paths, slowest first"""
+        stats = self.stats()
+        rows = {}
+        for (filename, line, name), (calls, primitive, total, cumulative, callers) in stats.stats.items():
+            if not os.path.basename(filename).startswith(SOURCE_PREFIX):
+                continue
+            key = f"{os.path.basename(filename)}:{line}({name})"
+            rows[key] = (name, calls, total, cumulative)
+
+        lines = [f"Profile: {self.label}, {self.seconds:.2f}s wall", "",
+                 f"{'function':<60} {'calls':>7} {'own s':>9} {'cum s':>9} {'ms/call':>9}"]
+
+        def row(key, name, calls, total, cumulative):
+            per_call = cumulative / calls * 1000 if calls else 0.0
+            return f"{key:<60} {calls:>7} {total:>9.3f} {cumulative:>9.3f} {per_call:>9.2f}"
+
+        called = {values[0] for values in rows.values()}
+        lines.append("Key functions:")
+        for name in KEY_FUNCTIONS:
+            matches = [(key, values) for key, values in rows.items() if values[0] == name]
+            for key, values in matches:
+                lines.append(row(key, *values))
+            if name not in called:
+                lines.append(f"{name:<60} {'not called':>7}")
+        lines.append("")
+        lines.append("All watermark functions by cumulative time:")
+        for key, values in sorted(rows.items(), key=lambda item: item[1][3], reverse=True)[:self.top * 2]:
+            lines.append(row(key, *values))
+        return "\n".join(lines) + "\n"
+
+    def allocation_text(self):
+        """Top allocation sites at the end of the session and the peaks"""
+        peak = peak_rss()
+        lines = [f"Allocations: {self.label}",
+                 f"tracemalloc peak: {self.traced_peak / 1e6:.1f} MB",
+                 f"process peak RSS: {peak / 1e6:.1f} MB" if peak else "process peak RSS: n/a",
+                 "(Pillow pixel buffers are not traced; compare the two peaks)", ""]
+        if self.snapshot is None:
+            return "\n".join(lines) + "\n"
+        statistics = self.snapshot.statistics('lineno')
+        lines.append(f"Top {self.top} allocation sites still held:")
+        for stat in statistics[:self.top]:
+            frame = stat.traceback[0]
+            lines.append(f"{stat.size / 1024:>10.1f} KiB {stat.count:>8} blocks  {frame.filename}:{frame.lineno}")
+        lines.append("")
+        lines.append("Largest by traceback:")
+        for stat in self.snapshot.statistics('traceback')[:min(self.top, 5)]:
+            lines.append(f"{stat.size / 1024:.1f} KiB in {stat.count} blocks")
+            lines.extend(f"    {line}" for line in stat.traceback.format())
+        return "\n".join(lines) + "\n"
+
+    def write(self, prefix):
+        """Stop if needed and write the .pstats, allocation and summary files; returns their paths"""
+        self.stop()
+        directory = os.path.dirname(prefix)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        paths = [f"{prefix}.pstats", f"{prefix}_alloc.txt", f"{prefix}_summary.txt"]
+        self.stats().dump_stats(paths[0])
+        with open(paths[1], 'w', encoding='utf-8') as f:
+            f.write(self.allocation_text())
+        with open(paths[2], 'w', encoding='utf-8') as f:
+            f.write(self.summary_text())
+        return paths
@@ -0,0 +1,433 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+HTTP watermarking service
+Serves the rendering engine over HTTP so upload pipelines can watermark
+images without starting a process per file:
+
+    python -m watermark_server --port 8080 -j 4
+
+    POST /watermark?template=NAME   body: image bytes -> watermarked image bytes
+    GET  /health                    JSON status and counters
+
+Without a template, settings.json (or the defaults) is used. An
+X-Watermark-Spec header holding a JSON object of spec fields is applied on
+top, e.g. {"watermark_text": "Client A", "output_format": "JPEG"}; only
+the visual and encoder fields in INLINE_FIELDS are accepted, within their
+bounds, and logos can only come from templates. Renders run on a process pool that is warmed
+up at start, so fonts, text marks and logos are already cached when the
+first request arrives. Connections are kept alive, bodies above
+--max-body-mb are refused with 413, and when --max-concurrency renders are
+already running or queued further requests get 503 instead of piling up.
+"""
+
+import os
+import re
+import sys
+import json
+import time
+import signal
+import argparse
+import threading
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, BrokenExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlsplit, parse_qs
+from PIL import Image
+
+from watermark_engine import WatermarkSpec, OUTPUT_EXTENSIONS, ENCODER_PRESET_NAMES, apply_watermark, render_bytes
+from watermark_batch import default_workers
+from watermark_variants import RESIZE_MODES
+
+DEFAULT_PORT = 8080
+DEFAULT_MAX_BODY = 64 * 1024 * 1024
+# Seconds a request may wait for a render slot before it is refused
+DEFAULT_QUEUE_TIMEOUT = 5.0
+# Seconds an idle keep-alive connection is held open
+KEEP_ALIVE_TIMEOUT = 30
+
+CONTENT_TYPES = {"PNG": "image/png", "JPEG": "image/jpeg", "TIFF": "image/tiff", "WEBP": "image/webp",
+                 "AVIF": "image/avif"}
+
+# Spec fields an X-Watermark-Spec header may set: (type, minimum, maximum)
+# for numbers, (str, allowed values or None, maximum length) for strings.
+# The bounds keep a request from forcing huge text, logo or output buffers;
+# logos, render_scale and file naming stay with templates.
+INLINE_FIELDS = {
+    'watermark_text': (str, None, 500),
+    'watermark_font_family': (str, None, 100),
+    'watermark_font_size': (int, 1, 1000),
+    'watermark_bold': (bool, None, None),
+    'watermark_italic': (bool, None, None),
+    'watermark_color': (str, None, 9),
+    'watermark_opacity': (int, 0, 100),
+    'watermark_rotation': (int, -360, 360),
+    'watermark_position': (str, None, 20),
+    'watermark_type': (str, ("text", "image"), None),
+    'watermark_scale': (int, 1, 500),
+    'watermark_x': (int, -100000, 100000),
+    'watermark_y': (int, -100000, 100000),
+    'watermark_tile_spacing': (int, 0, 1000),
+    'watermark_tile_stagger': (int, 0, 100),
+    'output_format': (str, tuple(OUTPUT_EXTENSIONS), None),
+    'jpeg_quality': (int, 1, 100),
+    'encoder_preset': (str, ENCODER_PRESET_NAMES, None),
+    'jpeg_subsampling': (str, ("", "4:4:4", "4:2:2", "4:2:0"), None),
+    'resize_mode': (str, RESIZE_MODES, None),
+    'resize_value': (int, 0, 100000),
+}
+
+# Inline string fields that must also match a pattern: colors as hex_to_rgba reads them
+INLINE_PATTERNS = {'watermark_color': re.compile(r'#?[0-9A-Fa-f]{6}')}
+
+
+class RequestError(Exception):
+    """A request the service refuses, with the HTTP status to answer"""
+
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+
+
+def _warm_worker(specs):
+    """Pool initializer: render each spec once so fonts, marks and logos are cached"""
+    canvas = Image.new('RGB', (64, 64))
+    for spec in specs:
+        try:
+            apply_watermark(canvas, spec)
+        except Exception as e:
+            print(f"Warm-up error: {str(e)}")
+
+
+def _ready():
+    """No-op job used to start every pool process"""
+    return os.getpid()
+
+
+class TemplateStore:
+    """Specs loaded from a templates directory, reloaded when a file changes"""
+
+    def __init__(self, templates_dir="templates", default_path="settings.json"):
+        self.templates_dir = templates_dir
+        self.default_path = default_path
+        self._cache = {}
+        self._lock = threading.Lock()
+
+    def names(self):
+        """Template names available in the templates directory"""
+        try:
+            return sorted(name[:-5] for name in os.listdir(self.templates_dir) if name.endswith('.json'))
+        except OSError:
+            return []
+
+    def _load(self, path):
+        mtime = os.stat(path).st_mtime_ns
+        with self._lock:
+            cached = self._cache.get(path)
+            if cached and cached[0] == mtime:
+                return cached[1]
+        spec = WatermarkSpec.load(path)
+        with self._lock:
+            self._cache[path] = (mtime, spec)
+        return spec
+
+    def get(self, name=None):
+        """Spec for a template name, or settings.json / the defaults without one"""
+        if not name:
+            if os.path.exists(self.default_path):
+                return self._load(self.default_path)
+            return WatermarkSpec()
+        # Names only: a request must not read arbitrary files
+        if os.path.basename(name) != name or name.startswith('.'):
+            raise RequestError(400, f"invalid template name: {name}")
+        path = os.path.join(self.templates_dir, f"{name}.json")
+        try:
+            return self._load(path)
+        except FileNotFoundError:
+            raise RequestError(404, f"unknown template: {name}")
+        except (OSError, ValueError, TypeError) as e:
+            raise RequestError(500, f"template {name}: {str(e)}")
+
+
+def check_inline_fields(fields):
+    """Raise RequestError(400) unless every inline spec field is allowed and in range"""
+    for name, value in fields.items():
+        if name not in INLINE_FIELDS:
+            raise RequestError(400, f"{name} cannot be set by X-Watermark-Spec")
+        kind, low, high = INLINE_FIELDS[name]
+        # bool is an int subclass; neither may stand in for the other
+        if type(value) is not kind:
+            raise RequestError(400, f"{name} must be {kind.__name__}")
+        if kind is int and not low <= value <= high:
+            raise RequestError(400, f"{name} must be between {low} and {high}")
+        if kind is str and low is not None and value not in low:
+            raise RequestError(400, f"{name} must be one of {', '.join(low)}")
+        if kind is str and high is not None and len(value) > high:
+            raise RequestError(400, f"{name} is longer than {high} characters")
+        if name in INLINE_PATTERNS and not INLINE_PATTERNS[name].fullmatch(value):
+            raise RequestError(400, f"invalid {name}: {value}")
+
+
+class WatermarkService:
+    """Render pool with a cap on renders running or waiting"""
+
+    def __init__(self, workers=None, templates=None, max_body=DEFAULT_MAX_BODY, max_concurrency=None,
+                 queue_timeout=DEFAULT_QUEUE_TIMEOUT):
+        self.workers = workers or default_workers()
+        self.templates = templates or TemplateStore()
+        self.max_body = max_body
+        self.max_concurrency = max_concurrency or self.workers * 2
+        self.queue_timeout = queue_timeout
+        self.served = 0
+        self.rejected = 0
+        self.failed = 0
+        self._slots = threading.BoundedSemaphore(self.max_concurrency)
+        self._in_flight = 0
+        self._lock = threading.Lock()
+
+        specs = [self.templates.get()]
+        for name in self.templates.names():
+            try:
+                specs.append(self.templates.get(name))
+            except RequestError as e:
+                print(f"Template error: {str(e)}")
+        self._specs = specs
+        self._pool_lock = threading.Lock()
+        self.executor = self._start_executor()
+
+    def _start_executor(self):
+        """Create the render pool and warm it up"""
+        if self.workers <= 1:
+            # Renders in this process, like the batch exporter's -j 1
+            _warm_worker(self._specs)
+            return ThreadPoolExecutor(max_workers=1)
+        executor = ProcessPoolExecutor(max_workers=self.workers, initializer=_warm_worker, initargs=(self._specs,))
+        # Pool processes start on demand; start them all now so no request pays for it
+        for future in [executor.submit(_ready) for _ in range(self.workers)]:
+            future.result()
+        return executor
+
+    def _replace_executor(self, broken):
+        """Replace a pool that lost a worker, once however many requests saw it break"""
+        with self._pool_lock:
+            if self.executor is not broken:
+                return
+            print("Render pool broke, starting a new one", file=sys.stderr)
+            broken.shutdown(wait=False, cancel_futures=True)
+            self.executor = self._start_executor()
+
+    def spec_for(self, template=None, inline=None):
+        """Spec for a request: a template with inline JSON fields applied on top"""
+        spec = self.templates.get(template)
+        if not inline:
+            return spec
+        try:
+            fields = json.loads(inline)
+        except ValueError as e:
+            raise RequestError(400, f"invalid X-Watermark-Spec: {str(e)}")
+        if not isinstance(fields, dict):
+            raise RequestError(400, "X-Watermark-Spec must be a JSON object")
+        if 'watermark_image_path' in fields:
+            raise RequestError(400, "watermark_image_path can only be set by templates")
+        check_inline_fields(fields)
+        spec = WatermarkSpec.from_dict(dict(spec.to_dict(), **fields))
+        if spec.resize_mode == "percent" and spec.resize_value > 100:
+            raise RequestError(400, "resize_value must be at most 100 percent")
+        return spec
+
+    def acquire(self):
+        """Take a render slot, raising 503 when none frees up in time"""
+        if not self._slots.acquire(timeout=self.queue_timeout):
+            with self._lock:
+                self.rejected += 1
+            raise RequestError(503, "too many concurrent requests")
+        with self._lock:
+            self._in_flight += 1
+
+    def release(self):
+        with self._lock:
+            self._in_flight -= 1
+        self._slots.release()
+
+    def render(self, data, spec):
+        """Watermark image bytes on the pool; call between acquire() and release()"""
+        executor = self.executor
+        try:
+            output = executor.submit(render_bytes, data, spec).result()
+        except BrokenExecutor as e:
+            # A worker died (out of memory, crash in a codec); later requests get a fresh pool
+            self._count_failure()
+            self._replace_executor(executor)
+            raise RequestError(500, f"render worker died: {str(e)}")
+        except Image.DecompressionBombError as e:
+            self._count_failure()
+            raise RequestError(413, str(e))
+        except (Image.UnidentifiedImageError, SyntaxError) as e:
+            self._count_failure()
+            raise RequestError(400, f"not a supported image: {str(e)}")
+        except Exception as e:
+            self._count_failure()
+            raise RequestError(500, f"render failed: {str(e)}")
+        with self._lock:
+            self.served += 1
+        return output
+
+    def _count_failure(self):
+        with self._lock:
+            self.failed += 1
+
+    def status(self):
+        """Counters reported by /health"""
+        with self._lock:
+            return {"status": "ok", "workers": self.workers, "max_concurrency": self.max_concurrency,
+                    "in_flight": self._in_flight, "served": self.served, "failed": self.failed,
+                    "rejected": self.rejected}
+
+    def close(self):
+        self.executor.shutdown(cancel_futures=True)
+
+
+class WatermarkRequestHandler(BaseHTTPRequestHandler):
+    """HTTP/1.1 handler; one thread per connection, kept alive between requests"""
+
+    protocol_version = "HTTP/1.1"
+    server_version = "WatermarkServer/1.0"
+    timeout = KEEP_ALIVE_TIMEOUT
+
+    def do_GET(self):
+        if urlsplit(self.path).path != "/health":
+            self._send_error(404, "not found")
+            return
+        self._send(200, "application/json", json.dumps(self.server.service.status()).encode('utf-8'))
+
+    def do_POST(self):
+        url = urlsplit(self.path)
+        if url.path != "/watermark":
+            self._send_error(404, "not found", close=True)
+            return
+        service = self.server.service
+        try:
+            length = self._content_length(service.max_body)
+            template = parse_qs(url.query).get('template', [None])[0]
+            spec = service.spec_for(template, self.headers.get('X-Watermark-Spec'))
+            # The slot is taken before the body is read, so the cap also bounds buffered uploads
+            service.acquire()
+        except RequestError as e:
+            # The unread body would be parsed as the next request; drop the connection instead
+            self._send_error(e.status, str(e), close=True)
+            return
+
+        try:
+            data = self.rfile.read(length)
+            if len(data) != length:
+                self.close_connection = True
+                return
+            started = time.perf_counter()
+            output = service.render(data, spec)
+            elapsed = (time.perf_counter() - started) * 1000
+        except RequestError as e:
+            self._send_error(e.status, str(e))
+            return
+        finally:
+            service.release()
+        self._send(200, CONTENT_TYPES.get(spec.output_format, "application/octet-stream"), output,
+                   {"Server-Timing": f"render;dur={elapsed:.1f}"})
+
+    def _content_length(self, max_body):
+        value = self.headers.get('Content-Length')
+        if value is None:
+            raise RequestError(411, "Content-Length required")
+        try:
+            length = int(value)
+        except ValueError:
+            raise RequestError(400, "invalid Content-Length")
+        if length <= 0:
+            raise RequestError(400, "empty body")
+        if length > max_body:
+            raise RequestError(413, f"body exceeds {max_body} bytes")
+        return length
+
+    def _send(self, status, content_type, body, headers=None, close=False):
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        if close:
+            self.send_header("Connection", "close")
+            self.close_connection = True
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _send_error(self, status, message, close=False):
+        headers = {"Retry-After": "1"} if status == 503 else None
+        self._send(status, "application/json", json.dumps({"error": message}).encode('utf-8'), headers, close)
+
+    def log_message(self, format, *args):
+        if self.server.access_log:
+            super().log_message(format, *args)
+
+
+class WatermarkServer(ThreadingHTTPServer):
+    """Threading HTTP server holding the render service"""
+
+    daemon_threads = True
+
+    def __init__(self, address, service, access_log=False):
+        super().__init__(address, WatermarkRequestHandler)
+        self.service = service
+        self.access_log = access_log
+
+
+def _interrupt(signum, frame):
+    raise KeyboardInterrupt
+
+
+def build_parser():
+    """Create the argument parser"""
+    parser = argparse.ArgumentParser(prog="watermark_server", description="Serve watermarking over HTTP")
+    parser.add_argument("--host", default="127.0.0.1", help="address to listen on (default: 127.0.0.1)")
+    parser.add_argument("--port", type=int, default=DEFAULT_PORT, help=f"port (default: {DEFAULT_PORT})")
+    parser.add_argument("-j", "--workers", type=int, default=None,
+                        help="render processes (default: CPU count, 1 renders in-process)")
+    parser.add_argument("--templates", default="templates", help="templates directory (default: templates)")
+    parser.add_argument("--max-body-mb", type=int, default=DEFAULT_MAX_BODY // (1024 * 1024), metavar="MB",
+                        help=f"largest accepted upload (default: {DEFAULT_MAX_BODY // (1024 * 1024)})")
+    parser.add_argument("--max-concurrency", type=int, default=None, metavar="N",
+                        help="renders running or waiting before requests get 503 (default: 2 per worker)")
+    parser.add_argument("--queue-timeout", type=float, default=DEFAULT_QUEUE_TIMEOUT, metavar="SECONDS",
+                        help=f"seconds to wait for a render slot (default: {DEFAULT_QUEUE_TIMEOUT:g})")
+    parser.add_argument("--access-log", action="store_true", help="log every request")
+    return parser
+
+
+def main(argv=None):
+    """Run the server until interrupted"""
+    args = build_parser().parse_args(argv)
+    service = WatermarkService(workers=args.workers, templates=TemplateStore(args.templates),
+                               max_body=args.max_body_mb * 1024 * 1024, max_concurrency=args.max_concurrency,
+                               queue_timeout=args.queue_timeout)
+    try:
+        server = WatermarkServer((args.host, args.port), service, access_log=args.access_log)
+    except OSError as e:
+        service.close()
+        print(f"Server error: {str(e)}", file=sys.stderr)
+        return 1
+    host, port = server.server_address[:2]
+    print(f"Serving on http://{host}:{port} ({service.workers} workers, "
+          f"max {service.max_concurrency} concurrent)", flush=True)
+    # Shut down the pool cleanly on SIGTERM too
+    signal.signal(signal.SIGTERM, _interrupt)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        service.close()
+    return 0
+
+
+if __name__ == "__main__":
+    multiprocessing.freeze_support()
+    sys.exit(main())
@@ -0,0 +1,93 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Compiled templates
+Turns template JSON files into immutable, hashable render specs whose font
+and logo are resolved up front, so a bad template fails once instead of on
+every image, and several templates can be applied to each decoded image:
+
+    templates = [compile_template(load_template(name), name) for name in ("客户A", "客户B")]
+    export_images(paths, "out", [template.target for template in templates])
+
+writes out/客户A/... and out/客户B/... from a single decode of every input.
+"""
+
+import os
+from dataclasses import dataclass, replace
+from pathlib import Path
+
+from watermark_engine import WatermarkSpec, ExportTarget, load_font, prepare_watermark_image
+
+TEMPLATES_DIR = "templates"
+
+
+def template_path(template, templates_dir=TEMPLATES_DIR):
+    """Path of a template given as a JSON file or a name in the templates directory"""
+    if os.path.exists(template):
+        return template
+    return os.path.join(templates_dir, f"{template}.json")
+
+
+def load_template(template, templates_dir=TEMPLATES_DIR):
+    """Load the spec of a template file or template name"""
+    return WatermarkSpec.load(template_path(template, templates_dir))
+
+
+def template_name(template):
+    """Name of a template given as a path or a name, e.g. templates/客户A.json -> 客户A"""
+    return Path(template).stem if template.endswith('.json') else template
+
+
+@dataclass(frozen=True)
+class CompiledTemplate:
+    """A template ready to render: its spec with the font and logo resolved
+
+    font is the (file, face index) the text is drawn with, None for Pillow's
+    built-in font, and is pinned in spec so every worker draws with that
+    file; logo is the (size, mtime_ns) of the logo file, whose path in spec
+    is absolute. Both are part of the hash, so a compiled template is a
+    valid cache key for what it renders.
+    """
+    name: str
+    spec: WatermarkSpec
+    font: tuple = None
+    logo: tuple = None
+
+    @property
+    def target(self):
+        """Export target writing into a subdirectory named after the template"""
+        return ExportTarget(self.name, self.spec)
+
+
+def compile_template(spec, name=""):
+    """Resolve a spec's font or logo and return a CompiledTemplate
+
+    Raises ValueError when an image watermark's logo is missing, and the
+    error of Pillow when it cannot be read. The prepared text or logo is
+    left in this process's caches.
+    """
+    font = logo = None
+    if spec.watermark_type == "text":
+        loaded = load_font(spec)
+        if isinstance(getattr(loaded, 'path', None), str):
+            font = (loaded.path, loaded.index)
+            spec = replace(spec, watermark_font_path=font[0], watermark_font_index=font[1])
+    else:
+        if not spec.watermark_image_path or not os.path.isfile(spec.watermark_image_path):
+            raise ValueError(f"watermark image not found: {spec.watermark_image_path}")
+        spec = replace(spec, watermark_image_path=os.path.abspath(spec.watermark_image_path))
+        stat = os.stat(spec.watermark_image_path)
+        logo = (stat.st_size, stat.st_mtime_ns)
+        prepare_watermark_image(spec)
+    return CompiledTemplate(name, spec, font, logo)
+
+
+def compile_templates(templates, templates_dir=TEMPLATES_DIR):
+    """Load and compile templates given as files or names, checking their names are unique"""
+    compiled = []
+    for template in templates:
+        name = template_name(template)
+        if any(other.name == name for other in compiled):
+            raise ValueError(f"duplicate template name: {name}")
+        compiled.append(compile_template(load_template(template, templates_dir), name))
+    return compiled
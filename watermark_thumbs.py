@@ -0,0 +1,173 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Thumbnails
+Disk-backed thumbnail cache keyed by path, size and mtime with a size cap
+and LRU eviction, plus a threaded loader that only works on the rows the
+list currently shows. Does not touch tkinter.
+"""
+
+import os
+import queue
+import hashlib
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from PIL import Image
+
+from watermark_fonts import user_cache_dir
+
+THUMB_SIZE = (48, 48)
+DEFAULT_MAX_BYTES = 200 * 1024 * 1024
+
+
+def make_thumbnail(path, size=THUMB_SIZE):
+    """Decode a small thumbnail, using JPEG draft mode where possible"""
+    with Image.open(path) as img:
+        img.draft(img.mode, (size[0] * 2, size[1] * 2))
+        if img.mode not in ('RGB', 'RGBA', 'L', 'LA'):
+            img = img.convert('RGBA')
+        img.thumbnail(size, Image.Resampling.LANCZOS)
+        img.load()
+    return img
+
+
+class ThumbnailCache:
+    """On-disk thumbnail cache with a size cap and LRU eviction
+
+    Entries are PNG files named after a hash of (path, file size, mtime,
+    thumbnail size), so edited images get new thumbnails automatically.
+    Cache file mtimes are bumped on every hit and the least recently used
+    files are removed once the cache grows past max_bytes.
+    """
+
+    def __init__(self, cache_dir=None, max_bytes=DEFAULT_MAX_BYTES, size=THUMB_SIZE):
+        self.cache_dir = cache_dir or os.path.join(user_cache_dir(), 'thumbnails')
+        self.max_bytes = max_bytes
+        self.size = tuple(size)
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        os.makedirs(self.cache_dir, exist_ok=True)
+        self._total_bytes = sum(entry.stat().st_size for entry in os.scandir(self.cache_dir)
+                                if entry.name.endswith('.png'))
+
+    def _entry_path(self, path):
+        stat = os.stat(path)
+        key = f"{os.path.abspath(path)}|{stat.st_size}|{stat.st_mtime_ns}|{self.size[0]}x{self.size[1]}"
+        digest = hashlib.sha1(key.encode('utf-8', 'surrogatepass')).hexdigest()
+        return os.path.join(self.cache_dir, f"{digest}.png")
+
+    def get(self, path):
+        """Return the thumbnail for an image, generating and storing it on a miss"""
+        entry = self._entry_path(path)
+        try:
+            with Image.open(entry) as thumb:
+                thumb.load()
+            os.utime(entry)
+            with self._lock:
+                self.hits += 1
+            return thumb
+        except OSError:
+            pass
+
+        thumb = make_thumbnail(path, self.size)
+        with self._lock:
+            self.misses += 1
+        self._store(entry, thumb)
+        return thumb
+
+    def _store(self, entry, thumb):
+        tmp_path = f"{entry}.{threading.get_ident()}.tmp"
+        try:
+            thumb.save(tmp_path, "PNG")
+            size = os.path.getsize(tmp_path)
+            os.replace(tmp_path, entry)
+        except OSError as e:
+            print(f"Thumbnail cache error: {str(e)}")
+            return
+        with self._lock:
+            self._total_bytes += size
+            if self._total_bytes > self.max_bytes:
+                self._evict()
+
+    def _evict(self):
+        """Remove least recently used entries until the cache is at 90% of its cap"""
+        entries = []
+        for entry in os.scandir(self.cache_dir):
+            if entry.name.endswith('.png'):
+                try:
+                    stat = entry.stat()
+                except OSError:
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, entry.path))
+        entries.sort()
+
+        self._total_bytes = sum(size for mtime, size, path in entries)
+        target = self.max_bytes * 0.9
+        for mtime, size, path in entries:
+            if self._total_bytes <= target:
+                break
+            try:
+                os.remove(path)
+                self._total_bytes -= size
+            except OSError:
+                continue
+
+
+class ThumbnailLoader:
+    """Generate thumbnails on worker threads for the rows that are visible
+
+    The GUI calls request() with the (key, path) pairs it currently shows and
+    collects finished (key, thumbnail) pairs with poll(). Queued work for rows
+    that scrolled out of view is skipped.
+    """
+
+    def __init__(self, cache, workers=4):
+        self.cache = cache
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="thumbnail")
+        self._lock = threading.Lock()
+        self._wanted = set()
+        self._queued = set()
+        self._results = queue.Queue()
+
+    def request(self, visible):
+        """Load thumbnails for the visible (key, path) pairs, dropping older requests"""
+        with self._lock:
+            self._wanted = {key for key, path in visible}
+            for key, path in visible:
+                if key not in self._queued:
+                    self._queued.add(key)
+                    self._executor.submit(self._load, key, path)
+
+    def poll(self):
+        """Return the (key, thumbnail) pairs finished since the last call"""
+        results = []
+        while True:
+            try:
+                results.append(self._results.get_nowait())
+            except queue.Empty:
+                return results
+
+    def reset(self):
+        """Forget all requests, e.g. when the list is cleared"""
+        with self._lock:
+            self._wanted = set()
+            self._queued = set()
+
+    def shutdown(self):
+        """Stop the worker threads"""
+        self.reset()
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+    def _load(self, key, path):
+        with self._lock:
+            if key not in self._wanted:
+                # Scrolled out of view before we got to it; allow it to be requested again
+                self._queued.discard(key)
+                return
+        try:
+            thumb = self.cache.get(path)
+        except Exception as e:
+            print(f"Thumbnail error {path}: {str(e)}")
+            return
+        self._results.put((key, thumb))
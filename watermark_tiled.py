@@ -0,0 +1,468 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Tiled export
+Watermarks very large images (stitched panoramas, gigapixel TIFFs) in
+horizontal bands so peak memory follows a configurable budget instead of
+the image size. Bands are written out as they are finished, either as a
+tiled, deflate-compressed TIFF or as a streamed PNG; other output formats
+are refused.
+
+Sources stored as uncompressed pixel rows (uncompressed TIFF, BMP,
+PPM/PGM) are decoded band by band, and so are compressed strip or tiled
+TIFFs, one run of strips or tiles at a time. Pillow decodes PNG and JPEG
+in one piece, so those are decoded once and then watermarked and encoded
+in bands, and are refused when that decode alone exceeds the budget.
+"""
+
+import io
+import os
+import zlib
+import struct
+import functools
+from PIL import Image, TiffImagePlugin
+
+from watermark_engine import output_filename, resized_size, compress_level, plan_watermark, apply_watermark_band, atomic_output
+
+DEFAULT_MEMORY_BUDGET = 256 * 1024 * 1024
+TIFF_TILE_SIZE = 256
+
+# Output formats the band writers produce
+TILED_FORMATS = ("PNG", "TIFF")
+
+# Rough bytes held per pixel of a band while it is watermarked and encoded:
+# decoded band, watermarked copy, converted band and encoder buffers
+BYTES_PER_BAND_PIXEL = 20
+
+# Pixel layouts the band writers store directly
+WRITER_MODES = ('L', 'LA', 'RGB', 'RGBA')
+
+# TIFF tags describing the pixel layout, copied into the in-memory TIFF a
+# band of strips or tiles is decoded from
+TIFF_LAYOUT_TAGS = (256, 258, 259, 262, 266, 277, 278, 284, 317, 320, 322, 323, 338, 339, 347, 529, 530, 531, 532)
+TIFF_STRIP_OFFSETS, TIFF_STRIP_BYTE_COUNTS = 273, 279
+TIFF_TILE_OFFSETS, TIFF_TILE_BYTE_COUNTS = 324, 325
+
+# Largest source, in pixels, tiled rendering accepts. Pillow's decompression
+# bomb limit is meant for whole-frame decodes and does not apply here.
+MAX_TILED_PIXELS = 1 << 36
+
+
+def _open_large(path, max_pixels=None):
+    """Open an image allowing up to max_pixels (default MAX_TILED_PIXELS) pixels
+
+    Image.open checks sizes against the process-wide Image.MAX_IMAGE_PIXELS,
+    so the format plugins are tried directly, in the order Image.open uses.
+    """
+    max_pixels = max_pixels or MAX_TILED_PIXELS
+    Image.init()
+    with open(path, 'rb') as f:
+        prefix = f.read(16)
+    for format_id in Image.ID:
+        factory, accept = Image.OPEN[format_id]
+        accepted = accept(prefix) if accept else True
+        # accept() returns a message instead of True for formats Pillow cannot read
+        if not accepted or isinstance(accepted, str):
+            continue
+        try:
+            img = factory(path)
+        except (SyntaxError, IndexError, TypeError, struct.error):
+            continue
+        if img.size[0] * img.size[1] > max_pixels:
+            img.close()
+            raise Image.DecompressionBombError(f"{os.path.basename(path)} has {img.size[0] * img.size[1]} pixels, "
+                                               f"over the limit of {max_pixels}")
+        return img
+    raise Image.UnidentifiedImageError(f"cannot identify image file {path!r}")
+
+
+@functools.lru_cache(maxsize=None)
+def _raw_bits_per_pixel(mode, rawmode):
+    """Bits per pixel of a raw pixel layout, found by probing Pillow's unpacker"""
+    # For an 8 pixel wide row the row length in bytes equals the bits per pixel
+    for bits in range(1, 8 * 16 + 1):
+        try:
+            Image.frombytes(mode, (8, 1), bytes(bits), 'raw', rawmode)
+            return bits
+        except ValueError:
+            continue
+    raise ValueError(f"unsupported raw mode {rawmode}")
+
+
+def decoded_bytes(size, mode):
+    """Bytes Pillow holds for a fully decoded image of this size and mode"""
+    if mode in ('1', 'L', 'P'):
+        per_pixel = 1
+    elif mode.startswith('I;16'):
+        per_pixel = 2
+    else:
+        per_pixel = 4
+    return size[0] * size[1] * per_pixel
+
+
+class TiffChunks:
+    """Strip or tile layout of a compressed TIFF, for decoding it a run of rows at a time
+
+    Each band is decoded by copying the strips (or rows of tiles) covering
+    it into a small in-memory TIFF with the same layout tags and letting
+    Pillow decode that, so every compression libtiff reads is supported.
+    """
+
+    def __init__(self, img):
+        tags = img.tag_v2
+        self.size = img.size
+        self.tags = [(tag, tags[tag], tags.tagtype[tag]) for tag in TIFF_LAYOUT_TAGS if tag in tags]
+        if TIFF_TILE_OFFSETS in tags:
+            self.offsets_tag, self.counts_tag = TIFF_TILE_OFFSETS, TIFF_TILE_BYTE_COUNTS
+            self.rows = tags[323]
+            self.across = -(-self.size[0] // tags[322])
+        else:
+            self.offsets_tag, self.counts_tag = TIFF_STRIP_OFFSETS, TIFF_STRIP_BYTE_COUNTS
+            self.rows = min(tags.get(278, self.size[1]), self.size[1])
+            self.across = 1
+        self.offsets = self._values(tags[self.offsets_tag])
+        self.counts = self._values(tags[self.counts_tag])
+
+    @staticmethod
+    def _values(value):
+        return value if isinstance(value, tuple) else (value,)
+
+    @classmethod
+    def of(cls, img):
+        """Layout of a single-image, interleaved TIFF Pillow decodes through libtiff, else None"""
+        if img.format != 'TIFF' or getattr(img, 'n_frames', 1) != 1:
+            return None
+        if any(tile[0] != 'libtiff' for tile in img.tile) or img.tag_v2.get(284, 1) != 1:
+            return None
+        if TIFF_TILE_OFFSETS not in img.tag_v2 and TIFF_STRIP_OFFSETS not in img.tag_v2:
+            return None
+        return cls(img)
+
+    def read(self, f, top, bottom):
+        """Decode rows [top, bottom) from the open file f"""
+        first, last = top // self.rows, (bottom - 1) // self.rows
+        start, end = first * self.rows, min((last + 1) * self.rows, self.size[1])
+        chunks = []
+        for i in range(first * self.across, (last + 1) * self.across):
+            f.seek(self.offsets[i])
+            chunks.append(f.read(self.counts[i]))
+
+        ifd = TiffImagePlugin.ImageFileDirectory_v2()
+        for tag, value, kind in self.tags:
+            ifd[tag] = value
+            ifd.tagtype[tag] = kind
+        ifd[257] = end - start
+        offsets = []
+        position = 0
+        for chunk in chunks:
+            offsets.append(position)
+            position += len(chunk)
+        ifd[self.offsets_tag] = tuple(offsets)
+        ifd[self.counts_tag] = tuple(len(chunk) for chunk in chunks)
+        ifd.tagtype[self.offsets_tag] = ifd.tagtype[self.counts_tag] = 4
+        # Pillow moves strip offsets past the directory it writes; tile offsets are placed here
+        directory = ifd.tobytes(8)
+        if self.offsets_tag == TIFF_TILE_OFFSETS:
+            ifd[self.offsets_tag] = tuple(offset + 8 + len(directory) for offset in offsets)
+            directory = ifd.tobytes(8)
+
+        data = b'II*\x00' + struct.pack('<I', 8) + directory + b''.join(chunks)
+        # Opened as a TIFF directly: a band of a very wide image may be over Image.MAX_IMAGE_PIXELS
+        with TiffImagePlugin.TiffImageFile(io.BytesIO(data)) as img:
+            img.load()
+            return img.crop((0, top - start, self.size[0], bottom - start))
+
+
+def writer_mode(mode):
+    """Mode a band of the given source mode is converted to before writing"""
+    if mode in WRITER_MODES:
+        return mode
+    if mode in ('P', 'PA'):
+        return 'RGBA'
+    if mode == '1':
+        return 'L'
+    return 'RGB'
+
+
+class BandReader:
+    """Decode horizontal bands of an image
+
+    When every tile of the source is stored as uncompressed rows ("raw"),
+    read() decodes only the rows of the requested band; compressed TIFFs
+    decode only the strips or tiles covering it. Other sources are decoded
+    in full on first use and bands are cropped from that.
+    """
+
+    def __init__(self, path, max_pixels=None):
+        self.path = path
+        self.max_pixels = max_pixels
+        with _open_large(path, max_pixels) as img:
+            self.size = img.size
+            self.mode = img.mode
+            self.tiles = list(img.tile)
+            self.info = dict(img.info)
+            self.palette = (img.palette.mode, img.palette.tobytes()) if img.mode == 'P' and img.palette else None
+            raw = bool(self.tiles) and all(tile[0] == 'raw' for tile in self.tiles)
+            self.chunks = None if raw else TiffChunks.of(img)
+        self.streamable = raw or self.chunks is not None
+        self._image = None
+
+    def read(self, top, bottom):
+        """Return rows [top, bottom) as an image"""
+        if self.chunks is not None:
+            with open(self.path, 'rb') as f:
+                return self.chunks.read(f, top, bottom)
+        if not self.streamable:
+            if self._image is None:
+                self._image = _open_large(self.path, self.max_pixels)
+                self._image.load()
+            return self._image.crop((0, top, self.size[0], bottom))
+
+        band = Image.new(self.mode, (self.size[0], bottom - top))
+        with open(self.path, 'rb') as f:
+            for tile in self.tiles:
+                codec, (x0, y0, x1, y1), offset, args = tile[:4]
+                lo, hi = max(y0, top), min(y1, bottom)
+                if lo >= hi:
+                    continue
+                if isinstance(args, str):
+                    args = (args,)
+                rawmode = args[0]
+                stride = args[1] if len(args) > 1 else 0
+                orientation = args[2] if len(args) > 2 else 1
+                if stride <= 0:
+                    stride = ((x1 - x0) * _raw_bits_per_pixel(self.mode, rawmode) + 7) // 8
+                if orientation < 0:
+                    # Bottom-up rows: the last row of the slice is stored first
+                    f.seek(offset + (y1 - hi) * stride)
+                else:
+                    f.seek(offset + (lo - y0) * stride)
+                data = f.read(stride * (hi - lo))
+                rows = Image.frombytes(self.mode, (x1 - x0, hi - lo), data, 'raw', rawmode, stride, orientation)
+                band.paste(rows, (x0, lo - top))
+
+        if self.palette:
+            band.putpalette(self.palette[1], self.palette[0])
+        if 'transparency' in self.info:
+            band.info['transparency'] = self.info['transparency']
+        return band
+
+    def close(self):
+        self._image = None
+
+
+class StreamingPngWriter:
+    """Write a PNG band by band without holding the whole image"""
+
+    COLOR_TYPES = {'L': 0, 'RGB': 2, 'LA': 4, 'RGBA': 6}
+
+    def __init__(self, path, size, mode, compress_level=6):
+        self.size = size
+        self.mode = mode
+        self.rows_written = 0
+        self._compressor = zlib.compressobj(compress_level)
+        self._file = open(path, 'wb')
+        self._file.write(b'\x89PNG\r\n\x1a\n')
+        self._chunk(b'IHDR', struct.pack('>IIBBBBB', size[0], size[1], 8, self.COLOR_TYPES[mode], 0, 0, 0))
+
+    def _chunk(self, kind, data):
+        self._file.write(struct.pack('>I', len(data)))
+        self._file.write(kind)
+        self._file.write(data)
+        self._file.write(struct.pack('>I', zlib.crc32(data, zlib.crc32(kind)) & 0xffffffff))
+
+    def write(self, band):
+        """Append the next band of rows"""
+        data = band.tobytes()
+        stride = len(data) // band.height
+        # Filter type 0 (None) before every row
+        rows = b''.join(b'\x00' + data[i:i + stride] for i in range(0, len(data), stride))
+        compressed = self._compressor.compress(rows)
+        if compressed:
+            self._chunk(b'IDAT', compressed)
+        self.rows_written += band.height
+
+    def close(self):
+        if self._file.closed:
+            return
+        try:
+            self._chunk(b'IDAT', self._compressor.flush())
+            self._chunk(b'IEND', b'')
+        finally:
+            self._file.close()
+        if self.rows_written != self.size[1]:
+            raise ValueError(f"PNG has {self.rows_written} of {self.size[1]} rows")
+
+    def abort(self):
+        """Close the file without finishing it"""
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type:
+            self.abort()
+        else:
+            self.close()
+
+
+class TiledTiffWriter:
+    """Write a tiled, deflate-compressed TIFF band by band
+
+    Bands must be a multiple of the tile size high, except the last one.
+    BigTIFF is used when the uncompressed data would not fit 32-bit offsets.
+    """
+
+    PHOTOMETRIC = {'L': 1, 'LA': 1, 'RGB': 2, 'RGBA': 2}
+
+    def __init__(self, path, size, mode, tile_size=TIFF_TILE_SIZE, compress_level=6):
+        self.size = size
+        self.mode = mode
+        self.tile_size = tile_size
+        self.compress_level = compress_level
+        self.samples = len(mode)
+        self.rows_written = 0
+        self.offsets = []
+        self.byte_counts = []
+        self.bigtiff = size[0] * size[1] * self.samples > 0xF0000000
+        self._file = open(path, 'wb')
+        if self.bigtiff:
+            self._file.write(b'II' + struct.pack('<HHHQ', 43, 8, 0, 0))
+        else:
+            self._file.write(b'II' + struct.pack('<HI', 42, 0))
+
+    def write(self, band):
+        """Append the next band of rows"""
+        if self.rows_written % self.tile_size:
+            raise ValueError("only the last band may end inside a tile row")
+        tile = self.tile_size
+        for y in range(0, band.height, tile):
+            for x in range(0, self.size[0], tile):
+                # Edge tiles are padded to full size as TIFF requires
+                data = zlib.compress(band.crop((x, y, x + tile, y + tile)).tobytes(), self.compress_level)
+                self.offsets.append(self._file.tell())
+                self.byte_counts.append(len(data))
+                self._file.write(data)
+        self.rows_written += band.height
+
+    def close(self):
+        if self._file.closed:
+            return
+        try:
+            self._write_ifd()
+        finally:
+            self._file.close()
+        if self.rows_written != self.size[1]:
+            raise ValueError(f"TIFF has {self.rows_written} of {self.size[1]} rows")
+
+    def _write_ifd(self):
+        short, long_, long8 = 3, 4, 16
+        offset_type = long8 if self.bigtiff else long_
+        entries = [
+            (256, long_, [self.size[0]]),
+            (257, long_, [self.size[1]]),
+            (258, short, [8] * self.samples),
+            (259, short, [8]),  # Adobe deflate
+            (262, short, [self.PHOTOMETRIC[self.mode]]),
+            (277, short, [self.samples]),
+            (284, short, [1]),
+            (322, short, [self.tile_size]),
+            (323, short, [self.tile_size]),
+            (324, offset_type, self.offsets),
+            (325, offset_type, self.byte_counts),
+        ]
+        if self.mode.endswith('A'):
+            entries.append((338, short, [2]))  # unassociated alpha
+
+        formats = {short: 'H', long_: 'I', long8: 'Q'}
+        inline = 8 if self.bigtiff else 4
+        ifd_offset = self._file.tell()
+        ifd_offset += ifd_offset % 2
+        entry_size = 20 if self.bigtiff else 12
+        header_size = 8 if self.bigtiff else 2
+        next_size = 8 if self.bigtiff else 4
+        data_offset = ifd_offset + header_size + entry_size * len(entries) + next_size
+
+        ifd = [struct.pack('<Q' if self.bigtiff else '<H', len(entries))]
+        extra = []
+        for tag, kind, values in entries:
+            payload = struct.pack(f"<{len(values)}{formats[kind]}", *values)
+            if len(payload) <= inline:
+                value = payload.ljust(inline, b'\x00')
+            else:
+                value = struct.pack('<Q' if self.bigtiff else '<I', data_offset)
+                extra.append(payload)
+                data_offset += len(payload) + len(payload) % 2
+                if len(payload) % 2:
+                    extra.append(b'\x00')
+            ifd.append(struct.pack('<HHQ' if self.bigtiff else '<HHI', tag, kind, len(values)) + value)
+        ifd.append(b'\x00' * next_size)
+
+        if data_offset > 0xFFFFFFFF and not self.bigtiff:
+            raise ValueError("TIFF exceeds 4 GiB; use BigTIFF")
+        self._file.seek(ifd_offset)
+        self._file.write(b''.join(ifd) + b''.join(extra))
+        self._file.seek(8 if self.bigtiff else 4)
+        self._file.write(struct.pack('<Q' if self.bigtiff else '<I', ifd_offset))
+
+    def abort(self):
+        """Close the file without finishing it"""
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type:
+            self.abort()
+        else:
+            self.close()
+
+
+def band_height(width, memory_budget, multiple=1):
+    """Rows per band that keep a band's working set within memory_budget"""
+    rows = max(memory_budget // max(width * BYTES_PER_BAND_PIXEL, 1), 1)
+    return max(rows - rows % multiple, multiple)
+
+
+def render_file_tiled(image_path, output_dir, spec, memory_budget=DEFAULT_MEMORY_BUDGET):
+    """Watermark one file band by band and write it to output_dir, returning the output path
+
+    PNG output is streamed and TIFF output is tiled; other formats raise
+    ValueError. Resizing needs the whole frame and is not supported, and sources that
+    cannot be decoded band by band are refused when decoding them whole
+    would exceed memory_budget.
+    """
+    if spec.output_format not in TILED_FORMATS:
+        raise ValueError(f"tiled rendering writes PNG or TIFF, not {spec.output_format}")
+    output_path = os.path.join(output_dir, output_filename(image_path, spec))
+
+    reader = BandReader(image_path)
+    try:
+        if resized_size(reader.size, spec) != reader.size:
+            raise ValueError("tiled rendering does not resize; export without --tiled to resize")
+        if not reader.streamable and decoded_bytes(reader.size, reader.mode) > memory_budget:
+            raise ValueError(f"{os.path.basename(image_path)} is decoded whole and needs "
+                             f"{decoded_bytes(reader.size, reader.mode) // (1024 * 1024) + 1} MB, over the memory "
+                             f"budget; convert it to TIFF or raise --memory-budget")
+        width, height = reader.size
+        mode = writer_mode(reader.mode)
+        plan = plan_watermark(reader.size, spec)
+        with atomic_output(output_path) as tmp_path:
+            if spec.output_format == "PNG":
+                writer = StreamingPngWriter(tmp_path, reader.size, mode, compress_level(spec))
+                rows = band_height(width, memory_budget)
+            else:
+                writer = TiledTiffWriter(tmp_path, reader.size, mode, compress_level=compress_level(spec))
+                rows = band_height(width, memory_budget, TIFF_TILE_SIZE)
+
+            with writer:
+                for top in range(0, height, rows):
+                    band = reader.read(top, min(top + rows, height))
+                    if band.mode != mode:
+                        band = band.convert(mode)
+                    writer.write(apply_watermark_band(band, top, plan))
+    finally:
+        reader.close()
+    return output_path
@@ -0,0 +1,91 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Output variants
+An export profile lists the outputs wanted for every source, for example a
+full-size JPEG, a 2048px web copy and a 400px thumbnail:
+
+    {"variants": [
+        {"name": "full", "output_format": "JPEG", "jpeg_quality": 92},
+        {"name": "web", "resize_mode": "long_edge", "resize_value": 2048,
+         "output_format": "JPEG", "jpeg_quality": 85, "filename_suffix": "_web"},
+        {"name": "thumb", "resize_mode": "long_edge", "resize_value": 400,
+         "filename_suffix": "_thumb", "subdir": "thumbs"}
+    ]}
+
+Each variant overrides the export settings of the spec (size, format,
+quality, encoder preset, file name prefix/suffix) and may write into a
+subfolder. All variants are rendered from one decode, smaller sizes
+resampled from larger ones (see watermark_engine.render_variants).
+"""
+
+import os
+import json
+from dataclasses import dataclass, replace
+
+from watermark_engine import OUTPUT_EXTENSIONS, ENCODER_PRESET_NAMES, ExportTarget, export_targets
+
+# Spec fields a variant may set
+VARIANT_FIELDS = ('resize_mode', 'resize_value', 'output_format', 'jpeg_quality', 'encoder_preset',
+                  'jpeg_subsampling', 'filename_prefix', 'filename_suffix')
+
+RESIZE_MODES = ("none", "width", "height", "long_edge", "percent")
+
+
+@dataclass(frozen=True)
+class OutputVariant:
+    """One output per source: spec settings to override and a subfolder to write into"""
+    name: str
+    subdir: str = ""
+    settings: tuple = ()
+
+    @classmethod
+    def from_dict(cls, data):
+        """Build a variant from a profile entry, rejecting settings a variant cannot change"""
+        data = dict(data)
+        name = str(data.pop('name', ""))
+        subdir = str(data.pop('subdir', ""))
+        unknown = sorted(set(data) - set(VARIANT_FIELDS))
+        if unknown:
+            raise ValueError(f"variant {name}: unsupported settings {', '.join(unknown)}")
+        if data.get('resize_mode', "none") not in RESIZE_MODES:
+            raise ValueError(f"variant {name}: unknown resize_mode {data['resize_mode']}")
+        if data.get('output_format', "PNG") not in OUTPUT_EXTENSIONS:
+            raise ValueError(f"variant {name}: unknown output_format {data['output_format']}")
+        if data.get('encoder_preset', "default") not in ENCODER_PRESET_NAMES:
+            raise ValueError(f"variant {name}: unknown encoder_preset {data['encoder_preset']}")
+        return cls(name, subdir, tuple(sorted(data.items())))
+
+    def apply(self, spec):
+        """The spec rendering this variant"""
+        return replace(spec, **dict(self.settings))
+
+
+def load_profile(path):
+    """Load the variants of an export profile JSON file"""
+    with open(path, 'r', encoding='utf-8') as f:
+        data = json.load(f)
+    variants = [OutputVariant.from_dict(entry) for entry in data.get('variants', ())]
+    if not variants:
+        raise ValueError(f"{path}: no variants")
+    return variants
+
+
+def variant_targets(spec, variants):
+    """Export targets rendering every variant of a spec, or of each of a sequence of ExportTarget
+
+    Raises ValueError when two variants would write the same files.
+    """
+    targets = []
+    seen = set()
+    for base in export_targets(spec):
+        for variant in variants:
+            target = ExportTarget(os.path.join(base.subdir, variant.subdir) if variant.subdir else base.subdir,
+                                  variant.apply(base.spec))
+            key = (os.path.normpath(target.subdir or "."), target.spec.filename_prefix, target.spec.filename_suffix,
+                   OUTPUT_EXTENSIONS.get(target.spec.output_format))
+            if key in seen:
+                raise ValueError(f"variant {variant.name} writes the same files as another variant")
+            seen.add(key)
+            targets.append(target)
+    return targets
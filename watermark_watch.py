@@ -0,0 +1,382 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Watch-folder mode
+Watches input folders and watermarks images as they arrive, using inotify
+on Linux and periodic rescans elsewhere (or on network shares, where
+inotify does not see remote writes). A file is rendered once its size and
+mtime have stopped changing, so half-copied files are left alone.
+Renders run on a worker pool with a bounded number of jobs in flight; when
+arrivals outpace the pool the backlog is capped and later files are picked
+up by a rescan once it drains. Finished outputs go into the export
+manifest, so restarts and rescans never redo work. A worker that dies
+fails the files in flight and the pool is replaced.
+"""
+
+import os
+import sys
+import time
+import errno
+import ctypes
+import select
+import struct
+import threading
+import statistics
+import ctypes.util
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, BrokenExecutor, FIRST_COMPLETED, wait
+
+from watermark_engine import SUPPORTED_FORMATS
+from watermark_import import iter_image_files
+from watermark_manifest import ExportManifest, spec_fingerprint
+from watermark_batch import ExportResult, export_one, default_workers
+
+# Seconds a file's size and mtime must stay unchanged before it is rendered
+DEFAULT_SETTLE_SECONDS = 2.0
+DEFAULT_POLL_INTERVAL = 2.0
+DEFAULT_STATS_INTERVAL = 60.0
+# Files waiting to be rendered before new arrivals are left for a rescan
+DEFAULT_MAX_BACKLOG = 1000
+
+# Main loop tick: how often settling files are re-checked
+TICK_SECONDS = 0.2
+
+
+class PollingWatcher:
+    """Find new or changed images by rescanning the folders"""
+
+    def __init__(self, dirs, recursive=True, interval=DEFAULT_POLL_INTERVAL):
+        self.dirs = list(dirs)
+        self.recursive = recursive
+        self.interval = interval
+        self.overflowed = False
+        self._snapshot = self._scan()
+        self._next_scan = time.monotonic() + interval
+
+    def _scan(self):
+        snapshot = {}
+        for path in iter_image_files(self.dirs, self.recursive):
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue
+            snapshot[path] = (stat.st_size, stat.st_mtime_ns)
+        return snapshot
+
+    def poll(self, timeout):
+        """Wait up to timeout seconds and return paths that appeared or changed"""
+        delay = self._next_scan - time.monotonic()
+        if delay > timeout:
+            time.sleep(timeout)
+            return []
+        time.sleep(max(delay, 0))
+        self._next_scan = time.monotonic() + self.interval
+        snapshot = self._scan()
+        changed = [path for path, signature in snapshot.items() if self._snapshot.get(path) != signature]
+        self._snapshot = snapshot
+        return changed
+
+    def close(self):
+        pass
+
+
+class InotifyWatcher:
+    """Find new or changed images from Linux inotify events"""
+
+    IN_CLOSE_WRITE = 0x00000008
+    IN_MOVED_TO = 0x00000080
+    IN_CREATE = 0x00000100
+    IN_Q_OVERFLOW = 0x00004000
+    IN_ISDIR = 0x40000000
+    EVENT_HEADER = struct.Struct('iIII')
+
+    def __init__(self, dirs, recursive=True):
+        if not sys.platform.startswith('linux'):
+            raise OSError(errno.ENOSYS, "inotify is only available on Linux")
+        self._libc = ctypes.CDLL(ctypes.util.find_library('c') or 'libc.so.6', use_errno=True)
+        self._fd = self._libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        if self._fd < 0:
+            error = ctypes.get_errno()
+            raise OSError(error, os.strerror(error))
+        self.recursive = recursive
+        # Set when the kernel dropped events; the caller should rescan
+        self.overflowed = False
+        self._watches = {}
+        try:
+            for directory in dirs:
+                self._add_tree(directory)
+        except OSError:
+            self.close()
+            raise
+
+    def _add_watch(self, directory):
+        mask = self.IN_CLOSE_WRITE | self.IN_MOVED_TO | self.IN_CREATE
+        wd = self._libc.inotify_add_watch(self._fd, os.fsencode(directory), mask)
+        if wd < 0:
+            error = ctypes.get_errno()
+            raise OSError(error, os.strerror(error), directory)
+        self._watches[wd] = directory
+
+    def _add_tree(self, directory):
+        self._add_watch(directory)
+        if self.recursive:
+            for root, subdirs, files in os.walk(directory):
+                for subdir in subdirs:
+                    self._add_watch(os.path.join(root, subdir))
+
+    def poll(self, timeout):
+        """Wait up to timeout seconds and return paths that appeared or changed"""
+        readable, _, _ = select.select([self._fd], [], [], timeout)
+        if not readable:
+            return []
+        try:
+            data = os.read(self._fd, 64 * 1024)
+        except BlockingIOError:
+            return []
+
+        changed = []
+        offset = 0
+        while offset < len(data):
+            wd, mask, cookie, length = self.EVENT_HEADER.unpack_from(data, offset)
+            offset += self.EVENT_HEADER.size
+            name = os.fsdecode(data[offset:offset + length].rstrip(b'\0'))
+            offset += length
+            if mask & self.IN_Q_OVERFLOW:
+                self.overflowed = True
+                continue
+            directory = self._watches.get(wd)
+            if directory is None or not name:
+                continue
+            path = os.path.join(directory, name)
+            if mask & self.IN_ISDIR:
+                if self.recursive:
+                    # Files may have landed in the new folder before it was watched
+                    try:
+                        self._add_tree(path)
+                    except OSError:
+                        continue
+                    changed.extend(iter_image_files([path], True))
+            elif name.lower().endswith(SUPPORTED_FORMATS):
+                changed.append(path)
+        return changed
+
+    def close(self):
+        if self._fd >= 0:
+            os.close(self._fd)
+            self._fd = -1
+
+
+def create_watcher(dirs, recursive=True, poll_interval=DEFAULT_POLL_INTERVAL, use_inotify=True):
+    """Return an inotify watcher when possible, otherwise a polling one"""
+    if use_inotify:
+        try:
+            return InotifyWatcher(dirs, recursive)
+        except (OSError, AttributeError) as e:
+            print(f"Watch: inotify unavailable ({str(e)}), polling every {poll_interval:g}s")
+    return PollingWatcher(dirs, recursive, poll_interval)
+
+
+class WatchStats:
+    """Throughput and latency counters, reported per interval"""
+
+    def __init__(self):
+        self.started = time.monotonic()
+        self.rendered = 0
+        self.failed = 0
+        self.skipped = 0
+        self._interval_start = self.started
+        self._interval_rendered = 0
+        self._latencies = []
+
+    def add(self, result, latency):
+        if result.error:
+            self.failed += 1
+            return
+        self.rendered += 1
+        self._interval_rendered += 1
+        self._latencies.append(latency)
+
+    def report(self, backlog, in_flight, settling):
+        """Return a log line for the interval since the last report and start a new one"""
+        now = time.monotonic()
+        elapsed = max(now - self._interval_start, 1e-9)
+        line = (f"Watch: {self.rendered} rendered, {self.failed} failed, {self.skipped} up to date; "
+                f"{self._interval_rendered / elapsed:.2f} files/s, backlog {backlog}, "
+                f"in flight {in_flight}, settling {settling}")
+        if self._latencies:
+            latencies = sorted(self._latencies)
+            p95 = latencies[min(len(latencies) - 1, int(len(latencies) * 0.95))]
+            line += f", latency avg {statistics.mean(latencies):.2f}s p95 {p95:.2f}s"
+        self._interval_start = now
+        self._interval_rendered = 0
+        self._latencies = []
+        return line
+
+
+class WatchDaemon:
+    """Watermark images arriving in input folders until stop() is called
+
+    Latency is measured from when a file was first seen to when its output
+    was written, so it includes the settle time.
+    """
+
+    def __init__(self, input_dirs, output_dir, spec, workers=None, recursive=True,
+                 settle=DEFAULT_SETTLE_SECONDS, poll_interval=DEFAULT_POLL_INTERVAL,
+                 stats_interval=DEFAULT_STATS_INTERVAL, max_backlog=DEFAULT_MAX_BACKLOG,
+                 memory_budget=None, checksum=False, use_inotify=True, log=print):
+        self.input_dirs = [os.path.abspath(path) for path in input_dirs]
+        self.output_dir = os.path.abspath(output_dir)
+        self.spec = spec
+        self.workers = workers or default_workers()
+        self.recursive = recursive
+        self.settle = settle
+        self.poll_interval = poll_interval
+        self.stats_interval = stats_interval
+        self.max_backlog = max_backlog
+        self.memory_budget = memory_budget
+        self.use_inotify = use_inotify
+        self.log = log
+        self.stats = WatchStats()
+        os.makedirs(self.output_dir, exist_ok=True)
+        self.manifest = ExportManifest(self.output_dir, checksum=checksum)
+        self._fingerprint = spec_fingerprint(spec, memory_budget)
+        self._output_prefix = os.path.join(os.path.realpath(self.output_dir), '')
+        self._stop = threading.Event()
+        # path -> (signature, stable since, first seen) for files that may still be written
+        self._settling = {}
+        # (path, first seen) ready to render
+        self._backlog = deque()
+        self._queued = set()
+        # future -> (path, first seen, executor it was submitted to)
+        self._in_flight = {}
+        self._missed = False
+        self._executor = None
+
+    def stop(self):
+        """Ask run() to return after the jobs in flight finish"""
+        self._stop.set()
+
+    def run(self):
+        """Watch and render until stop(); returns the stats"""
+        watcher = create_watcher(self.input_dirs, self.recursive, self.poll_interval, self.use_inotify)
+        self._executor = self._create_executor()
+        self.log(f"Watch: {', '.join(self.input_dirs)} -> {self.output_dir} "
+                 f"({type(watcher).__name__}, {self.workers} workers)")
+        next_stats = time.monotonic() + self.stats_interval
+        try:
+            # Catch up on files that arrived while nothing was watching
+            self._scan()
+            while not self._stop.is_set():
+                for path in watcher.poll(TICK_SECONDS):
+                    self._add_candidate(path)
+                if watcher.overflowed:
+                    watcher.overflowed = False
+                    self._missed = True
+                if self._missed and len(self._backlog) < self.max_backlog // 2:
+                    self._missed = False
+                    self._scan()
+
+                self._check_settled()
+                self._collect(block=False)
+                self._submit()
+                if time.monotonic() >= next_stats:
+                    next_stats = time.monotonic() + self.stats_interval
+                    self._report()
+            while self._in_flight:
+                self._collect(block=True)
+        finally:
+            self._executor.shutdown(cancel_futures=True)
+            watcher.close()
+            self.manifest.save()
+            self._report()
+        return self.stats
+
+    def _create_executor(self):
+        if self.workers <= 1:
+            return ThreadPoolExecutor(max_workers=1)
+        return ProcessPoolExecutor(max_workers=self.workers)
+
+    def _report(self):
+        self.log(self.stats.report(len(self._backlog), len(self._in_flight), len(self._settling)))
+
+    def _scan(self):
+        for path in iter_image_files(self.input_dirs, self.recursive):
+            if path in self._settling or path in self._queued:
+                continue
+            try:
+                if self.manifest.is_current(path, self._fingerprint):
+                    # Rendered before; only new work counts against the backlog
+                    continue
+            except OSError:
+                continue
+            self._add_candidate(path)
+
+    def _add_candidate(self, path):
+        if os.path.realpath(path).startswith(self._output_prefix):
+            # Our own outputs when the output folder is inside a watched folder
+            return
+        if path in self._settling:
+            return
+        if len(self._backlog) + len(self._settling) >= self.max_backlog:
+            # Backpressure: leave the file on disk and find it again with a rescan
+            if not self._missed:
+                self.log(f"Watch: backlog full ({self.max_backlog}), deferring new arrivals")
+            self._missed = True
+            return
+        now = time.monotonic()
+        self._settling[path] = (None, now, now)
+
+    def _check_settled(self):
+        now = time.monotonic()
+        busy = {path for path, first_seen, executor in self._in_flight.values()}
+        for path, (signature, stable_since, first_seen) in list(self._settling.items()):
+            try:
+                stat = os.stat(path)
+            except OSError:
+                del self._settling[path]
+                continue
+            current = (stat.st_size, stat.st_mtime_ns)
+            if current != signature:
+                self._settling[path] = (current, now, first_seen)
+                continue
+            if now - stable_since < self.settle or path in busy or path in self._queued:
+                continue
+            del self._settling[path]
+            try:
+                if self.manifest.is_current(path, self._fingerprint):
+                    self.stats.skipped += 1
+                    continue
+            except OSError:
+                # Removed or unreadable since it settled
+                continue
+            self._backlog.append((path, first_seen))
+            self._queued.add(path)
+
+    def _submit(self):
+        # Keep the pool busy without queueing the whole backlog in it
+        while self._backlog and len(self._in_flight) < self.workers * 2:
+            path, first_seen = self._backlog.popleft()
+            self._queued.discard(path)
+            future = self._executor.submit(export_one, path, self.output_dir, self.spec, self.memory_budget)
+            self._in_flight[future] = (path, first_seen, self._executor)
+
+    def _collect(self, block):
+        if not self._in_flight:
+            return
+        done, _ = wait(list(self._in_flight), timeout=None if block else 0, return_when=FIRST_COMPLETED)
+        for future in done:
+            path, first_seen, executor = self._in_flight.pop(future)
+            try:
+                result = future.result()
+            except Exception as e:
+                # export_one reports render errors itself; this is the pool failing, e.g. a worker killed
+                result = ExportResult(path, None, f"worker failed: {str(e) or type(e).__name__}")
+                if isinstance(e, BrokenExecutor) and executor is self._executor:
+                    self.log("Watch: worker pool broke, starting a new one")
+                    executor.shutdown(wait=False, cancel_futures=True)
+                    self._executor = self._create_executor()
+            self.stats.add(result, time.monotonic() - first_seen)
+            if result.error:
+                self.log(f"Watch: failed {path}: {result.error}")
+            else:
+                self.manifest.record(path, result.outputs, self._fingerprint)